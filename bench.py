@@ -0,0 +1,79 @@
+import argparse
+import os
+import sys
+import time
+
+"""
+This file will contain the wordlist benchmark for DIS.
+
+Adds a number of flat words to an empty InsultGen, a third of them vulgar,
+then removes every tenth word by text, and the first word by index a thousand times.
+Run it against another checkout to compare, such as the list based wordlists before WordStore:
+
+    python bench.py
+    python bench.py --tree ../dis-baseline
+"""
+
+
+def bench(tree='.', words=100000, removes=1000):
+
+    """
+    Times adding and removing words on an empty InsultGen.
+    :param tree: Directory of the DIS checkout to time
+    :param words: Number of words to add
+    :param removes: Number of words to remove by index
+    :return: Tuple of seconds taken to add and to remove
+    """
+
+    sys.path.insert(0, tree)
+
+    from insult import InsultGen
+
+    # Starting from the insult file of the checkout, and clearing it, as older checkouts always parse it:
+
+    gen = InsultGen(os.path.join(tree, 'insults.txt'))
+
+    gen.clear()
+
+    text = ['word{}'.format(num) for num in range(words)]
+
+    # Adding the words, every third word is vulgar:
+
+    start = time.perf_counter()
+
+    for num, word in enumerate(text):
+
+        gen._add_word(word, 'flat', num % 3 == 0)
+
+    added = time.perf_counter() - start
+
+    # Removing every tenth word by text, then the first word by index:
+
+    start = time.perf_counter()
+
+    for word in text[::10]:
+
+        gen._remove_word(word, 'flat')
+
+    for num in range(removes):
+
+        gen._remove_word(0, 'flat')
+
+    removed = time.perf_counter() - start
+
+    return added, removed
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description="Times adding and removing words on an InsultGen.")
+    parser.add_argument('--tree', default=os.path.dirname(os.path.abspath(__file__)),
+                        help="Directory of the DIS checkout to time, defaults to this one")
+    parser.add_argument('--words', type=int, default=100000, help="Number of words to add")
+    parser.add_argument('--removes', type=int, default=1000, help="Number of words to remove by index")
+
+    args = parser.parse_args()
+
+    added, removed = bench(args.tree, args.words, args.removes)
+
+    print("load {:.2f}s   edit {:.2f}s".format(added, removed))
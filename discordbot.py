@@ -1,8 +1,21 @@
 from insult import InsultGen
+from watcher import ConfigWatcher
+from sampler import InsultSampler
+from pool import InsultPool
+from guilds import GuildWordlists
+from settings import SettingsStore, MAXIMUMS
+from journal import EditJournal
+from messages import MessageBuffer, ChannelLimiter
 import discord
 from discord.ext import commands
 from math import ceil
+from itertools import islice, chain
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
 import traceback
+import time
+import io
 
 """
 This file will communicate with discord, 
@@ -17,6 +30,27 @@ bot = commands.Bot(command_prefix='>dis ', description="Dynamic Insult System -
 
 insult_gen = InsultGen()
 
+# Sampler used to stop channels seeing the same words over and over, 'bag' or 'window':
+
+insult_gen.sampler = InsultSampler('bag')
+
+# Journal of the changes made to each wordlist, written every second, and compacted after 1000 changes:
+
+journal = EditJournal('edits.journal', interval=1.0, threshold=1000)
+
+# Wordlist of each guild, sharing the insult generator above until they change something.
+# Guilds unused for an hour are cleaned up:
+
+guilds = GuildWordlists(insult_gen, max_idle=3600, journal=journal)
+
+# Replaying the changes made before we were last stopped:
+
+guilds.replay()
+
+# Settings of each guild and channel, changes are written to disk every few seconds:
+
+settings = SettingsStore('settings.jsonl', interval=5.0)
+
 # Discord Token:
 
 TOKEN = "TOKEN HERE"
@@ -25,6 +59,164 @@ TOKEN = "TOKEN HERE"
 
 ADMIN = 'Slick-Rick'
 
+# Weather we should reload the wordlist automatically when the insult file changes:
+
+WATCH = True
+
+# Watcher for the insult file:
+
+watcher = ConfigWatcher(insult_gen.config, guilds.reload)
+
+# Seconds a parse from a command may take before we give up on it:
+
+PARSE_TIMEOUT = 10
+
+# Seconds a reload may take before we give up on it:
+
+RELOAD_TIMEOUT = 120
+
+# Maximum number of values the notation in a command may expand to:
+
+EXPANSION_BUDGET = 10000
+
+# Maximum number of characters a value may have, repeats that go over this are rejected:
+
+LENGTH_BUDGET = 2000
+
+insult_gen.parser.max_length = LENGTH_BUDGET
+
+# Largest file that can be imported, in bytes:
+
+IMPORT_SIZE = 8 * 1024 * 1024
+
+# Number of lines of an imported file parsed at a time:
+
+IMPORT_CHUNK = 2000
+
+# Maximum number of values an imported file may expand to:
+
+IMPORT_BUDGET = 1000000
+
+# Number of values added at a time while importing, the event loop is freed between each batch:
+
+IMPORT_BATCH = 2000
+
+# Seconds between each update of the import progress:
+
+IMPORT_PROGRESS = 2
+
+# Seconds an export may take before we give up on it:
+
+EXPORT_TIMEOUT = 120
+
+# Largest file we can upload, in bytes:
+
+UPLOAD_SIZE = 8 * 1024 * 1024
+
+# Weather we should keep insults ready made, so bursts of messages are answered quickly.
+# Pooled insults don't use the sampler, it is only used when the pool is empty:
+
+POOL = False
+
+# Pool of ready made insults, filled up to 100 insults, refilled below 25, 50 insults at a time.
+# Chains are capped at the largest setting, and at most 64 sets of settings are pooled:
+
+pool = InsultPool(insult_gen, size=100, low=25, rate=50, interval=0.5, max_chains=MAXIMUMS['chain'], max_pools=64)
+
+# Rate limit of each channel, discord allows 5 messages every 5 seconds.
+# Commands with a lot of output join their lines into as few messages as they can, and wait on this before sending:
+
+limiter = ChannelLimiter(rate=5, per=5.0)
+
+# Threads used for parsing, so large or nasty notation doesn't block the event loop:
+
+executor = ThreadPoolExecutor(max_workers=2)
+
+
+async def run_blocking(func, *args, timeout=PARSE_TIMEOUT):
+    """
+    Runs a function in the parsing threads, so the event loop is free while it runs.
+    :param func: Function to run
+    :param args: Arguments to pass to the function
+    :param timeout: Seconds to wait for the function, None to wait forever
+    :return: Value returned by the function
+    :raises asyncio.TimeoutError: If the function takes too long
+    """
+
+    return await asyncio.wait_for(asyncio.get_event_loop().run_in_executor(executor, partial(func, *args)), timeout)
+
+
+def preview_notation(text, num=10):
+    """
+    Compiles notation, and expands the first few values.
+    :param text: Text to parse
+    :param num: Number of values to expand
+    :return: Total number of values, list of the first values
+    """
+
+    parsed = insult_gen.parser.compile(text)
+
+    # Checking the cost before expanding anything, we only limit the length as we only expand a few values:
+
+    parsed.check(max_length=LENGTH_BUDGET)
+
+    return parsed.count(), list(islice(parsed, num))
+
+
+def expand_chunk(sections, size, budget):
+    """
+    Expands the next few lines of a file being imported.
+    Lines are pulled from the file as they are needed, so only one chunk is held at a time.
+    :param sections: Generator yielding (word type, line) pairs, from InsultParser.iter_sections()
+    :param size: Number of lines to expand
+    :param budget: Maximum number of values the lines may expand to
+    :return: Number of lines read, dictionary of expanded words(None once the file is done)
+    """
+
+    lines = list(islice(sections, size))
+
+    if not lines:
+
+        return 0, None
+
+    return len(lines), insult_gen.expand_sections(lines, budget, LENGTH_BUDGET)
+
+
+def dump_wordlist(changes, compress=False, compact=False):
+    """
+    Writes a copy of a wordlist as DIS notation, see InsultGen.dump().
+    :param changes: Changes of the guild, from GuildWordlists.changes()
+    :param compress: Value determining if the file should be gzip compressed
+    :param compact: Value determining if words should be folded into as few lines as we can
+    :return: Temporary file holding the wordlist, positioned at the start
+    """
+
+    return guilds.rebuild(changes).dump(compress=compress, compact=compact)
+
+
+def search_page(reader, pattern, word_type, page=1, size=10):
+    """
+    Gets a page of the words matching a pattern, from a copy of a guild wordlist, see InsultGen.find_page().
+    :param reader: Reader of the guild, from GuildWordlists.reader()
+    :param pattern: Regular expression to check
+    :param word_type: Type of word to check
+    :param page: Page to get, starting at 1
+    :param size: Number of words on each page
+    :return: List of [word, safe] on the page, and the total number of matches
+    """
+
+    return guilds.read(reader).find_page(pattern, word_type, page, size)
+
+
+def guild_of(ctx):
+    """
+    Gets the ID of the guild a command was used in.
+    :param ctx: Context provided, or a message
+    :return: ID of the guild, None for direct messages
+    """
+
+    return (ctx.guild.id if ctx.guild is not None else None)
+
 
 async def perm_check(ctx):
     """
@@ -87,14 +279,35 @@ class WordlistCommands(commands.Cog, name='Wordlist Commands', ):
 
         words = text.split('/')
 
-        # Adding words to the collection:
+        # Parsing the words in a thread, and adding them to the collection:
+
+        try:
+
+            expanded = await run_blocking(insult_gen.expand_words, words, word_type, EXPANSION_BUDGET,
+                                          LENGTH_BUDGET)
+
+        except asyncio.TimeoutError:
+
+            await ctx.send("Parsing took too long, no words were added!")
+
+            return
+
+        except ValueError as e:
+
+            await ctx.send("Unable to add words: {}".format(e))
+
+            return
+
+        done = guilds.edit(guild_of(ctx)).add_words(words, word_type, expanded=expanded)
 
-        done = insult_gen.add_words(words, word_type)
+        # Joining the output into as few messages as we can:
 
-        await ctx.send("Added words to category [{}]:".format(word_type))
+        async with MessageBuffer(ctx, limiter) as out:
 
-        for i in done[word_type]:
-            await ctx.send("  > {}".format(i[0]))
+            await out.add("Added words to category [{}]:".format(word_type))
+
+            for i in done[word_type]:
+                await out.add("  > {}".format(i[0]))
 
     @commands.command(pass_context=True, name='remove', help="Removes one or more words to the wordlist, "
                                                              "'/' separated without spaces. "
@@ -127,7 +340,10 @@ class WordlistCommands(commands.Cog, name='Wordlist Commands', ):
 
         try:
 
-            done = insult_gen.remove_words(words, word_type)
+            expanded = await run_blocking(insult_gen.expand_words, words, word_type, EXPANSION_BUDGET,
+                                          LENGTH_BUDGET)
+
+            done = guilds.edit(guild_of(ctx)).remove_words(words, word_type, expanded=expanded)
 
         except Exception:
 
@@ -135,10 +351,128 @@ class WordlistCommands(commands.Cog, name='Wordlist Commands', ):
 
             return
 
-        await ctx.send("Removed words from category [{}]:".format(word_type))
+        # Joining the output into as few messages as we can:
+
+        async with MessageBuffer(ctx, limiter) as out:
+
+            await out.add("Removed words from category [{}]:".format(word_type))
+
+            for i in done[word_type]:
+                await out.add("  > {}".format(i[0]))
+
+    @commands.command(name='import', help="Imports words from an attached file, written like the insult file. "
+                                          "If a word type is given, lines outside of a section are added to it. "
+                                          "Supports DIS insult notation.")
+    @commands.check(perm_check)
+    async def import_words(self, ctx, word_type: str = None):
+
+        """
+        Imports words from an attached file.
+        The file is parsed a chunk at a time in a thread, and each chunk is added in bulk.
+        Progress is shown by editing a single message.
+        :param ctx: Context supplied
+        :param word_type: Type of words outside of a section, 'chain' or 'flat'. None to skip them.
+        :return:
+        """
+
+        # Checking arguments:
+
+        if word_type is not None and word_type not in ['chain', 'flat']:
+            await ctx.send("Invalid word type used! Must be 'chain' or 'flat'.")
+
+            return
+
+        if not ctx.message.attachments:
+            await ctx.send("No file attached! Attach a wordlist to import.")
+
+            return
+
+        attachment = ctx.message.attachments[0]
+
+        if attachment.size > IMPORT_SIZE:
+            await ctx.send("File is too big! Max size: {} bytes".format(IMPORT_SIZE))
+
+            return
+
+        status = await ctx.send("Importing [{}]...".format(attachment.filename))
+
+        # Downloading and decoding the file, decoding in a thread as the file may be large:
+
+        data = await attachment.read()
+        text = await run_blocking(data.decode, 'utf-8', 'replace')
+
+        del data
+
+        lines = io.StringIO(text)
+
+        if word_type is not None:
+
+            # Start in a section of the given type, so plain lists of words work:
+
+            header = (insult_gen.parser.start_flat if word_type == 'flat' else insult_gen.parser.start_chain)
+            lines = chain([header], lines)
+
+        sections = insult_gen.parser.iter_sections(lines)
+
+        read = 0
+        added = 0
+        last = time.monotonic()
+
+        while True:
+
+            # Parsing the next chunk in a thread, so the event loop stays free:
+
+            try:
+
+                count, expanded = await run_blocking(expand_chunk, sections, IMPORT_CHUNK, IMPORT_BUDGET - added)
+
+            except asyncio.TimeoutError:
+
+                await status.edit(content="Parsing took too long! Stopped after {} lines, {} words imported.".format(
+                    read, added))
+
+                return
+
+            except Exception as e:
+
+                await status.edit(content="Unable to import: {}\nStopped after {} lines, {} words imported.".format(
+                    e, read, added))
+
+                return
+
+            if expanded is None:
+
+                # End of the file:
+
+                break
+
+            # Adding the chunk in batches, one type at a time so each type is recorded in the journal.
+            # A few lines can expand to a lot of values, so we let other tasks run between each batch:
+
+            for thing in ['flat', 'chain']:
+
+                for num in range(0, len(expanded[thing]), IMPORT_BATCH):
+
+                    batch = expanded[thing][num:num + IMPORT_BATCH]
+
+                    guilds.edit(guild_of(ctx)).add_words(None, thing, expanded={'flat': [], 'chain': [], thing: batch})
+
+                    added = added + len(batch)
 
-        for i in done[word_type]:
-            await ctx.send("  > {}".format(i[0]))
+                    await asyncio.sleep(0)
+
+            read = read + count
+
+            if time.monotonic() - last > IMPORT_PROGRESS:
+
+                # Showing progress, not too often as edits are rate limited:
+
+                last = time.monotonic()
+
+                await status.edit(content="Importing [{}]... {} lines, {} words so far.".format(
+                    attachment.filename, read, added))
+
+        await status.edit(content="Imported [{}]: {} lines, {} words.".format(attachment.filename, read, added))
 
     @commands.command(name='reload', help='Reloads the insult wordlist.')
     @commands.check(perm_check)
@@ -152,7 +486,15 @@ class WordlistCommands(commands.Cog, name='Wordlist Commands', ):
 
         await ctx.send("Reloading insult wordlist...")
 
-        insult_gen.parse()
+        try:
+
+            await run_blocking(guilds.reload, timeout=RELOAD_TIMEOUT)
+
+        except asyncio.TimeoutError:
+
+            await ctx.send("Reload is taking a while, the new wordlist will be used once it is done.")
+
+            return
 
         await ctx.send("Reloaded insult wordlist!")
 
@@ -161,12 +503,12 @@ class WordlistCommands(commands.Cog, name='Wordlist Commands', ):
     async def clear(self, ctx):
 
         """
-        Clears the collection.
+        Clears the collection of this guild.
         :param ctx: Context supplied.
         :return:
         """
 
-        insult_gen.clear()
+        guilds.edit(guild_of(ctx)).clear()
 
         await ctx.send("Cleared insult collection!")
 
@@ -188,12 +530,32 @@ class WordlistCommands(commands.Cog, name='Wordlist Commands', ):
         final = "--== Word Information: ==--" \
                 "\nPattern: {}\nTotal Occurrences: {}\n".format(text, '{}')
 
+        # Searching a copy of the wordlist in a thread, so a slow pattern doesn't block the event loop,
+        # and words changed while we search don't change what we are searching:
+
+        reader = guilds.reader(guild_of(ctx))
+
         for thing in ['chain', 'flat']:
-            result = insult_gen.find_word(text, thing)
 
-            final = final + "\n  > Pattern occurs in [{}] wordlist {} times.".format(thing, len(result))
+            try:
+
+                result = (await run_blocking(search_page, reader, text, thing, 1, 0))[1]
+
+            except asyncio.TimeoutError:
+
+                await ctx.send("```Searching took too long!```")
+
+                return
+
+            except ValueError as e:
 
-            total = total + len(result)
+                await ctx.send("```Unable to search: {}```".format(e))
+
+                return
+
+            final = final + "\n  > Pattern occurs in [{}] wordlist {} times.".format(thing, result)
+
+            total = total + result
 
         final = final + "\n\nUse '>dis list [wordlist] [page number] {}' to see the matched values.".format(text)
 
@@ -243,26 +605,39 @@ class WordlistCommands(commands.Cog, name='Wordlist Commands', ):
 
             return
 
-        # Getting list of relevant words:
+        # Getting the page of relevant words from a copy of the wordlist, in a thread so a slow pattern doesn't block
+        # the event loop. The copy is reused until the words change, and caches its matches,
+        # so only the first page has to search:
 
-        words_full = insult_gen.find_word(regex, wordlist)
+        reader = guilds.reader(guild_of(ctx))
 
-        if len(words_full) <= (page - 1) * 10:
-            # Page number is too big!
+        try:
+
+            words, total = await run_blocking(search_page, reader, regex, wordlist, page)
+
+        except asyncio.TimeoutError:
+
+            await ctx.send("```Searching took too long!```")
+
+            return
+
+        except ValueError as e:
 
-            await ctx.send("```Page number is too big! Max page number: {}```".format(ceil(len(
-                words_full) / 10)))
+            await ctx.send("```Unable to search: {}```".format(e))
 
             return
 
-        # Getting list of insults:
+        if total <= (page - 1) * 10:
+            # Page number is too big!
 
-        words = words_full[((page - 1) * 10): (page * 10)]
+            await ctx.send("```Page number is too big! Max page number: {}```".format(ceil(total / 10)))
+
+            return
 
         # Displaying them:
 
         final = "--== Insult List: ==--\nA '!' denotes that the word is vulgar.\nWord List: [{}]\nPage: {}/{}\n".format(
-            wordlist, page, ceil(len(words_full) / 10))
+            wordlist, page, ceil(total / 10))
 
         for num, word in enumerate(words):
             # Add word to final string
@@ -273,20 +648,68 @@ class WordlistCommands(commands.Cog, name='Wordlist Commands', ):
 
         await ctx.send("```" + final + "```")
 
-    @commands.command(name='all', help='Send wordlist to channel.')
-    async def all(self, ctx):
+    @commands.command(name='all', help="Send wordlist to channel, including any changes made to it. "
+                                       "Use 'gzip' to send it compressed, "
+                                       "and 'compact' to fold words back into DIS insult notation.")
+    async def all(self, ctx, *options):
 
         """
-        Sends the insult wordlist as a file.
+        Sends the insult wordlist of this guild as a file, written in DIS notation.
+        The file is written in a thread, so large wordlists don't block the event loop.
         :param ctx: Context provided.
+        :param options: 'gzip' to compress the file, 'compact' to fold words sharing a prefix or suffix
         :return:
         """
 
+        for option in options:
+
+            if option not in ['gzip', 'compact']:
+                await ctx.send("Invalid option [{}] used! Must be 'gzip' or 'compact'.".format(option))
+
+                return
+
+        compress = 'gzip' in options
+
         await ctx.send("Sending DIS insult wordlist, please wait...")
 
-        # Sending wordlist:
+        # Taking the changes of this guild here, and writing a copy of the wordlist in a thread.
+        # The copy never changes, so the thread doesn't see words being added or removed part way:
 
-        await ctx.send(file=discord.File(insult_gen.config, filename="all_insults.txt"))
+        changes = guilds.changes(guild_of(ctx))
+
+        try:
+
+            buffer = await run_blocking(dump_wordlist, changes, compress, 'compact' in options, timeout=EXPORT_TIMEOUT)
+
+        except asyncio.TimeoutError:
+
+            await ctx.send("Writing the wordlist took too long!")
+
+            return
+
+        except ValueError as e:
+
+            await ctx.send("Unable to write the wordlist: {}".format(e))
+
+            return
+
+        with buffer:
+
+            size = buffer.seek(0, io.SEEK_END)
+
+            buffer.seek(0)
+
+            if size > UPLOAD_SIZE:
+                await ctx.send("Wordlist is too big to send! ({} bytes){}".format(
+                    size, '' if compress else " Try '>dis all gzip'."))
+
+                return
+
+            # Sending wordlist:
+
+            name = ("all_insults.txt.gz" if compress else "all_insults.txt")
+
+            await ctx.send(file=discord.File(buffer, filename=name))
 
         await ctx.send("Wordlist sent!")
 
@@ -299,9 +722,8 @@ class VulgarCommands(commands.Cog, name='Vulgar Commands'):
     def __init__(self, bot):
 
         self.bot = bot  # Discord bot instance
-        self.vulgar = True  # Weather we should use vulgarity
 
-    @commands.command(name='enable', help='Enables vulgarity')
+    @commands.command(name='enable', help='Enables vulgarity in this guild')
     @commands.check(perm_check)
     async def enable(self, ctx):
 
@@ -311,7 +733,7 @@ class VulgarCommands(commands.Cog, name='Vulgar Commands'):
         :return:
         """
 
-        if self.vulgar:
+        if settings.get(guild_of(ctx), ctx.channel.id)['vulgar']:
             # Vulgarity already enabled, do nothing!
 
             await ctx.send('Vulgarity is already enabled!')
@@ -320,11 +742,11 @@ class VulgarCommands(commands.Cog, name='Vulgar Commands'):
 
         # Enabling vulgarity
 
-        self.vulgar = True
+        settings.set('guild', guild_of(ctx), 'vulgar', True)
 
         await ctx.send("Vulgarity Enabled!")
 
-    @commands.command(name='disable', help='Disables vulgarity')
+    @commands.command(name='disable', help='Disables vulgarity in this guild')
     @commands.check(perm_check)
     async def disable(self, ctx):
 
@@ -334,12 +756,12 @@ class VulgarCommands(commands.Cog, name='Vulgar Commands'):
         :return:
         """
 
-        if not self.vulgar:
+        if not settings.get(guild_of(ctx), ctx.channel.id)['vulgar']:
             # Vulgarity already disabled, do nothing!
 
             await ctx.send('Vulgarity is already disabled!')
 
-        self.vulgar = False
+        settings.set('guild', guild_of(ctx), 'vulgar', False)
 
         await ctx.send("Vulgarity disabled!")
 
@@ -352,7 +774,88 @@ class VulgarCommands(commands.Cog, name='Vulgar Commands'):
         :return:
         """
 
-        await ctx.send("Vulgarity is: [{}]".format("Enabled" if self.vulgar else "Disabled"))
+        vulgar = settings.get(guild_of(ctx), ctx.channel.id)['vulgar']
+
+        await ctx.send("Vulgarity is: [{}]".format("Enabled" if vulgar else "Disabled"))
+
+
+class SettingsCommands(commands.Cog, name='Settings Commands'):
+    """
+    Cog that controls the settings of each guild and channel
+    """
+
+    def __init__(self, bot):
+
+        self.bot = bot  # Discord bot instance
+
+    @commands.command(name='set', help="Changes a setting(vulgar, chain, limit, start). "
+                                       "Scope can be 'guild'(default) or 'channel'.")
+    @commands.check(perm_check)
+    async def set(self, ctx, key: str, value: str, scope='guild'):
+
+        """
+        Changes a setting for this guild or channel.
+        :param ctx: Context given
+        :param key: Name of the setting
+        :param value: New value of the setting
+        :param scope: Scope to change the setting at, 'guild' or 'channel'
+        :return:
+        """
+
+        try:
+
+            settings.set(scope, (guild_of(ctx) if scope == 'guild' else ctx.channel.id), key,
+                         settings.parse_value(key, value))
+
+        except ValueError as e:
+
+            await ctx.send("Unable to change setting: {}".format(e))
+
+            return
+
+        await ctx.send("Setting [{}] is now [{}] for this {}!".format(key, value, scope))
+
+    @commands.command(name='unset', help="Sets a setting back to the default. "
+                                         "Scope can be 'guild'(default) or 'channel'.")
+    @commands.check(perm_check)
+    async def unset(self, ctx, key: str, scope='guild'):
+
+        """
+        Sets a setting for this guild or channel back to the default.
+        :param ctx: Context given
+        :param key: Name of the setting
+        :param scope: Scope to reset the setting at, 'guild' or 'channel'
+        :return:
+        """
+
+        try:
+
+            settings.set(scope, (guild_of(ctx) if scope == 'guild' else ctx.channel.id), key, None)
+
+        except ValueError as e:
+
+            await ctx.send("Unable to reset setting: {}".format(e))
+
+            return
+
+        await ctx.send("Setting [{}] has been reset for this {}!".format(key, scope))
+
+    @commands.command(name='settings', help="Shows the settings in use in this channel.")
+    async def settings(self, ctx):
+
+        """
+        Shows the settings in use in this channel.
+        :param ctx: Context given
+        :return:
+        """
+
+        final = "--== Settings: ==--\n"
+
+        for key, value in settings.get(guild_of(ctx), ctx.channel.id).items():
+
+            final = final + "  > {}: {}\n".format(key, value)
+
+        await ctx.send('```' + final + '```')
 
 
 class NotationCommands(commands.Cog, name='Notation Commands'):
@@ -391,8 +894,9 @@ DIS Insult Notation allows for easy formatting of insults, so the user doesn't h
 < - Render character or section after at the start of the line.
 > - Render character or section after at the end of the line.
 *n - Repeat the next character or section a specified number of times.
+%n - Placed at the end, makes the insult n times as likely to be picked.
 
-These characters may be located anywhere in the text, and may be escaped by the ';' character
+These characters may be located anywhere in the text(apart from '%n'), and may be escaped by the ';' character
 
 Example:
 
@@ -419,12 +923,26 @@ end||||||||||||||||||end
 
         thing = ' '.join(args)
 
-        # Sending text through the parser:
+        # Compiling the text in a thread, values are only expanded as we display them:
 
-        parsed = insult_gen.parser.notation_parse(thing)
+        try:
+
+            total, parsed = await run_blocking(preview_notation, thing)
+
+        except asyncio.TimeoutError:
+
+            await ctx.send("```Parsing took too long!```")
+
+            return
+
+        except ValueError as e:
+
+            await ctx.send("```Unable to parse: {}```".format(e))
+
+            return
 
         final = "--== Parser Output: ==--\nDisplaying first 10 values.\nShowing {}/{} values:".format(
-            10 if len(parsed) >= 10 else len(parsed), len(parsed))
+            10 if total >= 10 else total, total)
 
         for num, val in enumerate(parsed):
 
@@ -432,11 +950,6 @@ end||||||||||||||||||end
 
             final = final + '\n[{}]:'.format(num + 1) + val[0]
 
-            # Check if we are done:
-
-            if num == 9:
-                break
-
         # Sending final string:
 
         await ctx.send('```' + final + '```')
@@ -446,6 +959,30 @@ end||||||||||||||||||end
 async def on_ready():
     print("DIS Has connected to discord!")
 
+    # Reloads run in threads, and move the changes of each guild over on the event loop:
+
+    guilds.loop = asyncio.get_event_loop()
+
+    if WATCH:
+
+        # Start watching the insult file, does nothing if we are already watching:
+
+        watcher.start()
+
+    if POOL:
+
+        # Start refilling the insult pool, does nothing if we are already refilling:
+
+        pool.start()
+
+    # Start writing settings changes, does nothing if we are already writing:
+
+    settings.start()
+
+    # Start writing wordlist changes, does nothing if we are already writing:
+
+    journal.start(guilds.snapshot)
+
 
 @bot.event
 async def on_command_error(ctx, error):
@@ -456,38 +993,42 @@ async def on_command_error(ctx, error):
     :return:
     """
 
+    # Joining the output into as few messages as we can, the traceback alone can be a few messages long:
+
+    out = MessageBuffer(ctx, limiter)
+
     if isinstance(error, commands.errors.CheckFailure):
 
-        await ctx.send("You don't have the correct role for this command.")
+        await out.add("You don't have the correct role for this command.")
 
     elif isinstance(error, commands.errors.MissingRequiredArgument):
 
-        await ctx.send("You are missing a required argument. Try '>dis help [command]'.")
+        await out.add("You are missing a required argument. Try '>dis help [command]'.")
 
     elif isinstance(error, commands.errors.BadArgument):
 
-        await ctx.send("You supplied a bad argument.")
+        await out.add("You supplied a bad argument.")
 
         if error.__str__() in ['Member "@​everyone" not found', 'Member "@​here" not found']:
-            await ctx.send("Don't @ mention everyone or here, as that is very annoying.")
+            await out.add("Don't @ mention everyone or here, as that is very annoying.")
 
-        await ctx.send("Try '>dis help [command]' to get info on the required arguments.")
+        await out.add("Try '>dis help [command]' to get info on the required arguments.")
 
     elif isinstance(error, commands.errors.InvalidEndOfQuotedStringError):
 
-        await ctx.send("Seems you messed up your quoting. Be sure that your closing quotation has a space after it.")
+        await out.add("Seems you messed up your quoting. Be sure that your closing quotation has a space after it.")
 
     elif isinstance(error, commands.errors.ExpectedClosingQuoteError):
 
-        await ctx.send("Seems you messed up your quoting. Be sure that your quote has a closing quotation.")
+        await out.add("Seems you messed up your quoting. Be sure that your quote has a closing quotation.")
 
     elif isinstance(error, commands.errors.CommandNotFound):
 
-        await ctx.send("You supplied an unknown command. Try '>dis help [command]'.")
+        await out.add("You supplied an unknown command. Try '>dis help [command]'.")
 
     else:
 
-        await ctx.send("""You triggered an unhandled exception. Congratulations.\n
+        await out.add("""You triggered an unhandled exception. Congratulations.\n
 You failed at the most basic of tasks.
 Your incompetence and general idiocy greatly disappoints me.\n
 You are a waste of life and sentience. I hope you are happy with yourself for getting to this point.\n
@@ -495,9 +1036,11 @@ If you can even read this, know that everyone is not amused, and your reputation
 I would recommend acquiring a monkey, or a chimp, as the random gibberish that gets generated
 from it banging on the keyboard is light years ahead of whats going on in your brain.""")
 
-    await ctx.send("Exception info:\nException: \n{}\nFull Traceback: \n{}".format(error, traceback.format_exc()))
+    await out.add("Exception info:\nException: \n{}\nFull Traceback: \n{}".format(error, traceback.format_exc()))
+
+    await out.add("For that, you truly deserve an insult:")
+    await out.flush()
 
-    await ctx.send("For that, you truly deserve an insult:")
     await insult(ctx, ctx.message.author)
 
 @bot.event
@@ -527,15 +1070,19 @@ async def on_message(message):
 
 
 @bot.command(name='insult', help='Insults a particular user.')
-async def insult(ctx, user: discord.Member, chain=3):
+async def insult(ctx, user: discord.Member, chain: int = None):
     """
     DIS a user. User must @mention a user, and can optionally supply chains
     :param ctx: Context given
     :param user: User to insult
-    :param chain: Number of chains to use
+    :param chain: Number of chains to use, None for the channel setting
     :return:
     """
 
+    # Getting the settings of this channel:
+
+    options = settings.get(guild_of(ctx), ctx.channel.id)
+
     if user == bot.user:
 
         # We don't insult ourselves, insult the issuer instead!
@@ -548,7 +1095,18 @@ async def insult(ctx, user: discord.Member, chain=3):
 
         name = user.mention
 
-    text = insult_gen.gen_insult(chain, start=name + ' is a', vulgar=bot.get_cog('Vulgar Commands').vulgar, limit=2000)
+    # Taking a ready made insult from the pool, if we are using it.
+    # The pool is made from the shared wordlist, so guilds with their own wordlist can't use it:
+
+    gen = guilds.get(guild_of(ctx))
+    gen = (pool.get if POOL and gen is insult_gen else gen.gen_insult)
+
+    # Chains given to the command are capped the same way as the setting:
+
+    chain = (min(chain, MAXIMUMS['chain']) if chain is not None else options['chain'])
+
+    text = gen(chain, start=name + ' ' + options['start'],
+               vulgar=options['vulgar'], limit=options['limit'], channel=ctx.channel.id)
 
     if not text:
         # Wordlist is empty:
@@ -570,12 +1128,23 @@ async def info(ctx):
 
     start = "--== DIS Information: ==--\n"
 
+    gen = guilds.get(guild_of(ctx))
+
     # Generating insult logic info:
 
     final = "\n[Insult Logic:]\n  > Version: {}\n  " \
-            "> Flat Words: {}\n  > Chain Words: {}".format(insult_gen.ver,
-                                                           insult_gen.get_word_length()[0],
-                                                           insult_gen.get_word_length()[1])
+            "> Flat Words: {}\n  > Chain Words: {}".format(gen.ver,
+                                                           gen.get_word_length()[0],
+                                                           gen.get_word_length()[1])
+
+    if POOL:
+
+        # Adding pool metrics:
+
+        rate = pool.hit_rate()
+
+        final = final + "\n\n[Insult Pool:]\n  > Hits: {}\n  > Misses: {}\n  > Hit Rate: {}".format(
+            pool.hits, pool.misses, ('{:.1%}'.format(rate) if rate is not None else 'N/A'))
 
     await ctx.send('```' + start + final + '```')
 
@@ -595,4 +1164,10 @@ async def exc_raise(ctx):
 bot.add_cog(VulgarCommands(bot))
 bot.add_cog(WordlistCommands(bot))
 bot.add_cog(NotationCommands(bot))
+bot.add_cog(SettingsCommands(bot))
 bot.run(TOKEN)
+
+# Writing any changes that are left:
+
+settings.stop()
+journal.stop()
@@ -30,10 +30,25 @@ DIS Insult Notation allows for easy formatting of insults, so the user dosen't h
 < - Render character or section after at the start of the line
 > - Render character or section after at the end of the line
 *n - Repeat the next character or section a specified number of times
+%n - Placed at the end of the line, makes its values n times as likely to be picked(Defaults to 1)
 
 These characters may be located anywhere in the text, and may be escaped by the ';' character
 """
 
+from array import array
+from bisect import bisect_right
+import hashlib
+import marshal
+import mmap
+import io
+import os
+import struct
+import sys
+
+_DIGITS = '0123456789'  # Characters that can make up a repeat count
+_NOTATION = ';!()[],^<>*%#'  # Characters that have a special meaning in DIS notation, and must be escaped
+_ESCAPES = str.maketrans({char: ';' + char for char in _NOTATION})  # Table escaping each notation character
+
 
 class InsultParser:
 
@@ -49,6 +64,8 @@ class InsultParser:
         self.start_flat = '------flat words:------'  # Header for flat words
         self.start_chain = '------chain words:------'  # Header for chain words
         self.stop = '------end section:------'  # Header for end section
+        self.max_length = None  # Maximum length a repeat may generate, None for no limit
+        self.weight = '%'  # Weight character, sets how likely the values of a line are to be picked
 
     def parse(self, path):
 
@@ -58,75 +75,126 @@ class InsultParser:
         :return: Dictionary wor words.
         """
 
-        # Open a file object on the path specified:
+        final = {'flat': [], 'chain': []}
 
-        flat = []
-        chain = []
-        selected = None
+        # Accumulate the records as they are streamed in:
+
+        for section, text, vulg in self.iter_parse(path):
+
+            final[section].append([text, vulg])
+
+        # End of parsing, return dictionary of words:
+
+        return final
+
+    def iter_parse(self, path):
+
+        """
+        Streams the insults in a file, without building any intermediate lists.
+        :param path: Path to insult file
+        :return: Generator yielding (section, text, vulgar) records
+        """
+
+        # Open a file object on the path specified:
 
         with open(path, mode='r') as self.reader:
 
-            # We now iterate over the text:
+            yield from self.iter_records(self.reader)
 
-            for line in self.reader:
+    def iter_records(self, lines):
 
-                # Removing newlines and other junk
+        """
+        Streams the insults found in an iterable of lines.
+        Each line is sent through the notation parser as it is found.
+        :param lines: Iterable of lines, such as a file object
+        :return: Generator yielding (section, text, vulgar) records
+        """
+
+        for section, line in self.iter_sections(lines):
+
+            for text, vulg in self.notation_parse(line):
+
+                yield section, text, vulg
+
+    def iter_expanded(self, lines, known=None):
+
+        """
+        Streams the content lines found in an iterable of lines, along with their values.
+        Lines that have already been expanded can be supplied, so only new lines go through the notation parser.
+        :param lines: Iterable of lines, such as a file object
+        :param known: Dictionary mapping (section, line) to values we already have
+        :return: Generator yielding (section, line, values, weight) records
+        """
+
+        for section, line in self.iter_sections(lines):
+
+            values = (known.get((section, line)) if known is not None else None)
+
+            if values is None:
 
-                line = line.rstrip("\n")
-                line = line.replace("\n", '')
-                line = line.lower()
+                # New line, send it through the parser:
 
-                if line == '' or line[0] == self.comment:
+                values = self.notation_parse(line)
 
-                    # We don't care about this, ignore it:
+            yield section, line, values, self.split_weight(line)[1]
 
-                    continue
+    def iter_sections(self, lines):
 
-                if line == self.start_flat:
+        """
+        Streams the content lines found in an iterable of lines,
+        along with the section they are located in.
+        Comments, blank lines and lines outside of a section are skipped.
+        :param lines: Iterable of lines, such as a file object
+        :return: Generator yielding (section, line) pairs, section being 'flat' or 'chain'
+        """
+
+        selected = None
 
-                    # Started flat word section, add flat words to list:
+        # We now iterate over the text:
 
-                    selected = 1
+        for line in lines:
 
-                    continue
+            # Removing newlines and other junk
 
-                if line == self.start_chain:
+            line = line.rstrip("\n")
+            line = line.replace("\n", '')
+            line = line.lower()
 
-                    # Started chain word section, add flat words to list:
+            if line == '' or line[0] == self.comment:
 
-                    selected = 2
+                # We don't care about this, ignore it:
 
-                    continue
+                continue
 
-                if line == self.stop:
+            if line == self.start_flat:
 
-                    # End of section:
+                # Started flat word section, add flat words to list:
 
-                    selected = None
+                selected = 'flat'
 
-                    continue
+                continue
 
-                # Add word to relevant list, if we are in a section:
+            if line == self.start_chain:
 
-                if selected is not None:
+                # Started chain word section, add flat words to list:
 
-                    if selected == 1:
+                selected = 'chain'
 
-                        # Add to flat wordlist:
+                continue
 
-                        flat = flat + self.notation_parse(line)
+            if line == self.stop:
 
-                    else:
+                # End of section:
 
-                        # Add to chain wordlist
+                selected = None
 
-                        chain = chain + self.notation_parse(line)
+                continue
 
-                    continue
+            # Yield the line, if we are in a section:
 
-            # End of parsing, return dictionary of words:
+            if selected is not None:
 
-            return {'flat': flat, 'chain': chain}
+                yield selected, line
 
     def _split_statement(self, text):
 
@@ -176,58 +244,251 @@ class InsultParser:
 
         return final
 
-    def _statement_expand(self, text) -> list:
+    def _statement_compile(self, text, prev, memo):
 
         """
-        Expands statements based on brackets. Finds all possible combinations for statement.
-        We implement some recursion so we can get all the possible combos.
-        :param text: Text to be split.
-        :return: List of split statements
+        Compiles statements based on brackets, so the combinations can be found without rebuilding strings.
+        Each bracket becomes a node whose children are the alternatives, followed by the rest of the text.
+        Nodes are shared between alternatives, so the rest of the text is only compiled once.
+        :param text: Text to be compiled.
+        :param prev: Character before the text, None if the text is the start of the statement.
+        :param memo: Dictionary of already compiled nodes.
+        :return: Root node of the compiled text
         """
 
+        # The only thing that matters about the previous character is if it escapes the text:
+
+        key = (text, None if prev is None else prev == ';')
+
+        if key in memo:
+
+            return memo[key]
+
         # Finding first instance of open bracket.
 
         start = text.find('[')
 
-        if start != -1 and text[start-1] != ';':
+        if start == -1:
 
-            # We have a bracket, find the end bracket:
+            # No brackets, the text is a single value:
 
-            stop = text.find(']', start)
+            node = _NotationNode(text)
 
-            if stop == -1:
+        else:
 
-                raise(Exception("No terminating bracket! Add ']' or escape '['!"))
+            # Getting the character before the bracket(The last character if we are at the very start):
 
-            # Split up text in the bracket:
+            before = text[start-1] if start > 0 else (prev if prev is not None else text[-1])
 
-            split = text[start+1:stop].split(',')
+            if before == ';':
 
-            # Add split text to final:
+                # Bracket is escaped, get expansion for the rest of the text:
 
-            done = list(text[:start] + x + text[stop+1:] for x in split)
-            final = []
+                node = _NotationNode(text[:start+1], [self._statement_compile(text[start+1:], None, memo)])
 
-            for i in done:
+            else:
 
-                final = final + self._statement_expand(i)
+                # We have a bracket, find the end bracket:
 
-            return final
+                stop = text.find(']', start)
 
-        elif start != -1 and text[start-1] == ';':
+                if stop == -1:
 
-            # Get expansion for the rest of the text:
+                    raise(Exception("No terminating bracket! Add ']' or escape '['!"))
 
-            new = self._statement_expand(text[start+1:])
-            final = []
+                rest = text[stop+1:]
+                before = text[start-1] if start > 0 else prev
+                children = []
 
-            for i in new:
+                # Split up text in the bracket, and add each alternative:
 
-                final.append(text[:start+1] + i)
+                for alt in text[start+1:stop].split(','):
 
-            return final
+                    if '[' in alt:
+
+                        # Alternative opens another bracket, it must be compiled along with the rest of the text:
+
+                        children.append(self._statement_compile(alt + rest, before, memo))
+
+                        continue
+
+                    children.append(_NotationNode(alt, [self._statement_compile(rest, alt[-1] if alt else before,
+                                                                                memo)]))
+
+                node = _NotationNode(text[:start], children)
+
+        memo[key] = node
+
+        return node
+
+    def compile(self, text, find_vulg=True):
+
+        """
+        Compiles notation into a CompiledNotation, which can expand it lazily.
+        Nothing is expanded until values are requested.
+        If we are finding vulgarity, the text is a whole line, and any weight at the end is removed.
+        :param text: Text to be compiled
+        :param find_vulg: Value determining if we should find vulgarity
+        :return: CompiledNotation for the text
+        """
+
+        text = text.lower()
+        weight = 1
+
+        if find_vulg:
+
+            # Whole line, check for a weight:
+
+            text, weight = self.split_weight(text)
+
+        return CompiledNotation(self, self._statement_compile(text, None, {}), text, find_vulg, weight)
+
+    def split_weight(self, text):
+
+        """
+        Splits the weight off the end of a line, if it has one.
+        The weight character can be escaped with ';' like any other.
+        :param text: Line to split
+        :return: Line without the weight, and the weight(1 if there isn't one)
+        """
+
+        index = len(text)
+
+        while index > 0 and text[index-1] in _DIGITS:
+
+            index = index - 1
+
+        if index == len(text) or index < 2 or text[index-1] != self.weight or text[index-2] == ';':
+
+            # No weight, or the weight character is escaped:
+
+            return text, 1
+
+        weight = int(text[index:])
+
+        if weight < 1:
+
+            raise Exception("Weight must be at least 1! Must be in form '%3'!")
+
+        return text[:index-1], weight
+
+    def escape(self, text, vulgar=False, weight=1):
+
+        """
+        Converts a value back into a line of DIS notation, which expands to exactly that value.
+        Notation characters are escaped, and uppercase characters are marked with '^'.
+        :param text: Value to convert
+        :param vulgar: Value determining if the line should be marked as vulgar
+        :param weight: Weight of the value, added to the end if it isn't 1
+        :return: Line of DIS notation
+        """
+
+        line = self.escape_text(text)
+
+        if line in ('', self.start_flat, self.start_chain, self.stop):
+
+            # Blank lines and headers would be skipped, wrap the line in a section so it is read as a value:
+
+            line = '<(' + line + ')'
+
+        return self.mark(line, vulgar, weight)
+
+    def escape_text(self, text):
+
+        """
+        Escapes the notation characters in some text, and marks uppercase characters with '^'.
+        The text can be part of a line, as each character is escaped on its own.
+        :param text: Text to escape
+        :return: Escaped text
+        """
+
+        line = text.translate(_ESCAPES)
+
+        if line != line.lower():
+
+            # Lines are read as lowercase, mark each uppercase character to be made uppercase again:
+
+            line = ''.join(('^' + char.lower() if char != char.lower() else char) for char in line)
+
+        return line
+
+    def mark(self, line, vulgar=False, weight=1):
+
+        """
+        Adds the vulgarity and weight to a line of notation.
+        :param line: Line of DIS notation
+        :param vulgar: Value determining if the line should be marked as vulgar
+        :param weight: Weight of the values, added to the end if it isn't 1
+        :return: Marked line
+        """
+
+        if vulgar:
+
+            line = '!' + line
+
+        if weight != 1:
+
+            if line.endswith(';'):
+
+                # An escaped ';' would escape the weight character, add an empty section between them:
+
+                line = line + '<()'
+
+            line = line + self.weight + str(weight)
+
+        return line
+
+    def _repeat_bound(self, text):
+
+        """
+        Works out the most the repeats in some notation could multiply the length of a value by.
+        We only look at the text, so this is a cheap upper bound, not the exact value.
+        :param text: Text to check
+        :return: Maximum multiplier, or None if a repeat count can't be found without expanding
+        """
+
+        bound = 1
+        index = text.find('*')
+
+        while index != -1:
+
+            after = text[index+1:index+2]
+
+            if after != '' and after in _DIGITS:
+
+                # Single digit repeat:
+
+                num = int(after)
+
+            elif after == '(':
+
+                # Section repeat, find the end of the section:
+
+                end = text.find(')', index)
+                content = (text[index+2:end] if end != -1 else '')
+
+                num = (int(content) if content != '' and all(char in _DIGITS for char in content) else None)
+
+            elif after in ('[', ']', ','):
+
+                # Number comes from a bracket, we can't know it without expanding:
+
+                num = None
+
+            else:
+
+                # Not a number, this will fail when it is formatted:
+
+                num = 1
+
+            if num is None:
 
-        return [text]
+                return None
+
+            bound = bound * max(num, 1)
+            index = text.find('*', index + 1)
+
+        return bound
 
     def notation_parse(self, text, find_vulg=True):
 
@@ -238,120 +499,982 @@ class InsultParser:
         :return: Formatted text in a list
         """
 
-        text = text.lower()
+        return list(self.compile(text, find_vulg))
 
-        # We first expand the text:
+    def _statement_format(self, state, find_vulg=True):
 
-        exp = self._statement_expand(text)
-        ret = []
+        """
+        Formats an expanded statement, interpreting the notation characters in it.
+        :param state: Statement to format, with all brackets expanded
+        :param find_vulg: Value determining if we should find vulgarity
+        :return: Formatted text, or [text, vulgar] if we are finding vulgarity
+        """
 
-        for state in exp:
+        # We now split up the statement into list form:
 
-            # We now split up the statement into list form:
+        split = self._split_statement(state)
 
-            split = self._split_statement(state)
+        # Now we iterate over each character to do our format operations:
 
-            # Now we iterate over each character to do our format operations:
+        index = 0  # Index of pointer
+        final = []  # Final collection of text
+        end = []  # Text to add to the end of the statement
+        vulg = False  # Value determining if statement is vulgar
 
-            index = 0  # Index of pointer
-            final = []  # Final collection of text
-            end = []  # Text to add to the end of the statement
-            vulg = False  # Value determining if statement is vulgar
+        while index < len(split):
 
-            while index < len(split):
+            char = split[index]
 
-                char = split[index]
+            if char == ';':
 
-                if char == ';':
+                # Next character is to be added to the collection:
 
-                    # Next character is to be added to the collection:
+                final.append(split[index+1])
 
-                    final.append(split[index+1])
+                index = index + 2
 
-                    index = index + 2
+                continue
 
-                    continue
+            elif char == '!' and find_vulg:
 
-                elif char == '!' and find_vulg:
+                # Insult is vulgar, do something
 
-                    # Insult is vulgar, do something
+                vulg = True
 
-                    vulg = True
+                index = index + 1
 
-                    index = index + 1
+                continue
 
-                    continue
+            elif char == '^':
 
-                elif char == '^':
+                # Next character should be uppercase
 
-                    # Next character should be uppercase
+                final.append(split[index+1].upper())
 
-                    final.append(split[index+1].upper())
+                index = index + 2
 
-                    index = index + 2
+                continue
 
-                    continue
+            elif char == '<' or char == '>':
 
-                elif char == '<' or char == '>':
+                # Next character should be moved to the start/end of the statement:
 
-                    # Next character should be moved to the start/end of the statement:
+                move = split.pop(index + 1)
 
-                    move = split.pop(index + 1)
+                if char == '<':
 
-                    if char == '<':
+                    final.insert(0, move)
 
-                        final.insert(0, move)
+                else:
 
-                    else:
+                    end.append(move)
 
-                        end.append(move)
+                index = index + 1
 
-                    index = index + 1
+                continue
 
-                    continue
+            elif char == '*':
 
-                elif char == '*':
+                # Repeat the next character a specified number of times:
 
-                    # Repeat the next character a specified number of times:
+                num = split[index+1]
 
-                    num = split[index+1]
+                try:
 
-                    try:
+                    num = int(num)
 
-                        num = int(num)
+                except:
 
-                    except:
+                    raise Exception("No number after '*' char! Must be in form '*3' or '*(123)!")
 
-                        raise Exception("No number after '*' char! Must be in form '*3' or '*(123)!")
+                if self.max_length is not None and num * len(split[index+2]) > self.max_length:
 
-                    final.append(split[index+2] * num)
+                    # Repeat is too big, stop before we build it:
 
-                    index = index + 3
+                    raise ValueError("Repeat is longer than the limit of {} characters!".format(self.max_length))
 
-                    continue
+                final.append(split[index+2] * num)
 
-                else:
+                index = index + 3
 
-                    # Add character to final:
+                continue
 
-                    final.append(char)
+            else:
 
-                    index = index + 1
+                # Add character to final:
 
-                    continue
+                final.append(char)
 
-            # Merging final + end statements
+                index = index + 1
 
-            final = final + end
+                continue
 
-            if find_vulg:
+        # Merging final + end statements
 
-                ret.append([''.join(final), vulg])
+        final = final + end
 
-            else:
+        if find_vulg:
+
+            return [''.join(final), vulg]
+
+        return ''.join(final)
+
+
+class _NotationNode:
+
+    """
+    A node of compiled notation.
+    Every value under this node starts with the prefix, followed by a value from one of the children.
+    A node without children has a single value, the prefix.
+    """
+
+    __slots__ = ('prefix', 'children', 'offsets', 'count', 'length')
+
+    def __init__(self, prefix, children=()):
+
+        self.prefix = prefix  # Text every value under this node starts with
+        self.children = tuple(children)  # Alternatives that can follow the prefix
+        self.offsets = []  # Index of the first value of each child
+        self.count = 1  # Number of values under this node
+        self.length = len(prefix)  # Length of the longest value under this node, before formatting
+
+        if self.children:
+
+            # Working out the offsets and total count of the children:
+
+            self.count = 0
+            self.length = self.length + max(child.length for child in self.children)
+
+            for child in self.children:
+
+                self.offsets.append(self.count)
+
+                self.count = self.count + child.count
+
+
+class CompiledNotation:
+
+    """
+    DIS notation that has been compiled once, and can be expanded lazily.
+    Iterating over it will generate each value on demand, in the same order as InsultParser.notation_parse().
+    The number of values, and any single value, can be found without expanding the others.
+    """
+
+    def __init__(self, parser, root, text, find_vulg=True, weight=1):
+
+        self.parser = parser  # Parser used to format the values
+        self.root = root  # Root node of the compiled notation
+        self.text = text  # Text that was compiled, without the weight
+        self.find_vulg = find_vulg  # Value determining if we should find vulgarity
+        self.weight = weight  # Weight of each value, how likely they are to be picked
+
+    def count(self):
+
+        """
+        Gets the number of values this notation expands to.
+        :return: Number of values
+        """
+
+        return self.root.count
+
+    def estimate(self):
+
+        """
+        Estimates the cost of expanding this notation, without expanding anything.
+        :return: Number of values, and the most characters a value could have(None if it can't be bounded)
+        """
+
+        bound = self.parser._repeat_bound(self.text)
+
+        return self.root.count, (self.root.length * bound if bound is not None else None)
+
+    def check(self, max_values=None, max_length=None):
+
+        """
+        Checks this notation is within some limits, without expanding anything.
+        :param max_values: Maximum number of values, None for no limit
+        :param max_length: Maximum characters a value may have, None for no limit
+        :raises ValueError: If the notation is over a limit
+        """
+
+        count, length = self.estimate()
+
+        if max_values is not None and count > max_values:
+
+            raise ValueError("Notation expands to {} values, the limit is {}!".format(count, max_values))
+
+        if max_length is not None and length is None:
+
+            raise ValueError("Unable to work out how long the values could be, repeat counts must be plain numbers!")
+
+        if max_length is not None and length > max_length:
+
+            raise ValueError("Notation may expand to values {} characters long, the limit is {}!".format(
+                length, max_length))
+
+    def nth(self, index):
+
+        """
+        Gets a specific value, without expanding any of the others.
+        :param index: Index of the value, negative values count from the end
+        :return: Formatted value, in the same form InsultParser.notation_parse() returns
+        """
+
+        if index < 0:
+
+            index = index + self.root.count
+
+        if not 0 <= index < self.root.count:
+
+            raise IndexError("Notation only has {} values!".format(self.root.count))
+
+        node = self.root
+        final = []
+
+        while True:
+
+            final.append(node.prefix)
+
+            if not node.children:
+
+                # Reached the end of the value:
+
+                break
+
+            # Find the child the index falls under:
+
+            child = bisect_right(node.offsets, index) - 1
+            index = index - node.offsets[child]
+            node = node.children[child]
+
+        return self.parser._statement_format(''.join(final), self.find_vulg)
+
+    def __iter__(self):
+
+        # Walking over the nodes, and formatting each value as it is reached:
+
+        stack = [(self.root, '')]
+
+        while stack:
+
+            node, text = stack.pop()
+            text = text + node.prefix
+
+            if not node.children:
+
+                yield self.parser._statement_format(text, self.find_vulg)
+
+                continue
+
+            # Add the children in reverse, so they are visited in order:
+
+            for child in reversed(node.children):
+
+                stack.append((child, text))
+
+
+class NotationCompressor:
+
+    """
+    Folds expanded values back into lines of DIS notation, using brackets for the parts that differ.
+
+    Values sharing a prefix become 'prefix[tail,tail]', and any suffix the tails share is moved after the bracket.
+    The values are sorted, so the longest common prefix of each pair of neighbours gives a compacted trie
+    of the values(an LCP interval tree). Each node of the trie is a prefix shared by the values under it,
+    and we pick the nodes to fold at that save the most characters.
+    Values that are left over are then folded by their suffixes the same way, using the values reversed.
+
+    Values in brackets can't contain ',', '[' or ']', so values with them are never folded.
+    Lines with escapes are expanded again to check them, and written one value per line if they don't match.
+    """
+
+    def __init__(self, parser):
+
+        self.parser = parser  # Parser used to escape and check the lines
+        self.folded = 0  # Number of values folded into a line with others
+        self.fallbacks = 0  # Number of lines that didn't expand to their values, and were written one value per line
+
+    def compress(self, words):
+
+        """
+        Folds values into lines of DIS notation.
+        Values with different weights can't share a line, so each weight is folded separately.
+        :param words: Iterable of (text, vulgar, weight) records
+        :return: List of lines, which expand to exactly the given values
+        """
+
+        groups = {}  # Dictionary mapping weights to dictionaries mapping values to their vulgarity
+        final = []
+
+        for text, vulg, weight in words:
+
+            if ',' in text or '[' in text or ']' in text:
+
+                # Can't go in a bracket, write the value on its own:
+
+                final.append(self.parser.escape(text, vulg, weight))
+
+                continue
+
+            groups.setdefault(weight, {})[text] = vulg
+
+        for weight, values in groups.items():
+
+            left = []
+
+            # Folding by prefix, and then folding what is left by suffix:
+
+            for prefix, tails in self._fold(sorted(values), left):
+
+                final.extend(self._line(prefix, tails, '', values, weight))
+
+            single = []
+
+            for suffix, heads in self._fold(sorted(word[::-1] for word in left), single):
+
+                final.extend(self._line('', [head[::-1] for head in heads], suffix[::-1], values, weight))
+
+            final.extend(self.parser.escape(word[::-1], values[word[::-1]], weight) for word in single)
+
+        return final
+
+    def _fold(self, words, left):
+
+        """
+        Picks the prefixes to fold sorted values at.
+        :param words: Sorted list of values
+        :param left: List to add the values that aren't folded to
+        :return: List of (prefix, tails) pairs, one for each line
+        """
+
+        size = len(words)
+
+        if size < 2:
+
+            left.extend(words)
+
+            return []
+
+        # Each interval of the trie is [depth, first, last, children, saving, fold]:
+
+        stack = [[0, 0, None, [], 0, False]]
+
+        for num in range(1, size + 1):
+
+            # Length of the prefix shared with the previous value, 0 past the end to close every interval:
+
+            depth = (len(os.path.commonprefix((words[num-1], words[num]))) if num < size else 0)
+            first = num - 1
+            last = None
+
+            while depth < stack[-1][0]:
+
+                # Interval ends here, work out what it saves:
+
+                last = stack.pop()
+                last[2] = num - 1
+                first = last[1]
+
+                self._score(last)
+
+                if depth <= stack[-1][0]:
+
+                    stack[-1][3].append(last)
+
+                    last = None
+
+            if depth > stack[-1][0]:
+
+                stack.append([depth, first, None, ([last] if last is not None else []), 0, False])
+
+        # Walking the trie, and collecting the intervals we fold at:
+
+        folds = []
+        covered = bytearray(size)
+        todo = stack[0][3]
+
+        while todo:
+
+            node = todo.pop()
+
+            if not node[5]:
+
+                todo.extend(node[3])
+
+                continue
+
+            depth, first, last = node[0], node[1], node[2]
+
+            folds.append((words[first][:depth], [word[depth:] for word in words[first:last+1]]))
+            covered[first:last+1] = b'\x01' * (last + 1 - first)
+
+            self.folded = self.folded + last + 1 - first
+
+        left.extend(word for num, word in enumerate(words) if not covered[num])
+
+        return folds
+
+    def _score(self, node):
+
+        """
+        Works out the most characters we can save under an interval, and if we should fold at it.
+        Folding saves the prefix for every value after the first, and costs the two brackets.
+        Commas cost the same as the newlines they replace.
+        :param node: Interval of the trie
+        """
+
+        saving = sum(child[4] for child in node[3])
+        fold = (node[2] - node[1]) * node[0] - 2
+
+        if fold > saving:
+
+            node[4] = fold
+            node[5] = True
+
+        else:
+
+            node[4] = saving
+
+    def _line(self, prefix, tails, suffix, values, weight):
+
+        """
+        Builds a line from a prefix, the tails that follow it, and a suffix after them.
+        Any suffix the tails share is moved after the bracket.
+        :param prefix: Text before the bracket
+        :param tails: Text that differs between the values
+        :param suffix: Text after the bracket
+        :param values: Dictionary mapping values to their vulgarity
+        :param weight: Weight of the values
+        :return: List of lines, a single line unless the line has to be split up
+        """
+
+        common = len(os.path.commonprefix([tail[::-1] for tail in tails]))
+
+        if common:
+
+            suffix = tails[0][len(tails[0])-common:] + suffix
+            tails = [tail[:len(tail)-common] for tail in tails]
+
+        words = [prefix + tail + suffix for tail in tails]
+        vulgs = [values[word] for word in words]
+        vulgar = all(vulgs)
+        escape = self.parser.escape_text
+
+        # Values with different vulgarity are marked inside the bracket:
+
+        alts = [('!' if vulg and not vulgar else '') + escape(tail) for tail, vulg in zip(tails, vulgs)]
+        line = self.parser.mark(escape(prefix) + '[' + ','.join(alts) + ']' + escape(suffix), vulgar, weight)
+
+        if ';' in line and not self._check(line, words, values, weight):
+
+            # Escapes got in the way of the bracket, write each value on its own:
+
+            self.fallbacks = self.fallbacks + 1
+
+            return [self.parser.escape(word, values[word], weight) for word in words]
+
+        return [line]
+
+    def _check(self, line, words, values, weight):
+
+        """
+        Checks a line expands to exactly the values it was made from.
+        :param line: Line to check
+        :param words: Values the line was made from
+        :param values: Dictionary mapping values to their vulgarity
+        :param weight: Weight of the values
+        :return: True if the line is correct
+        """
+
+        try:
+
+            compiled = self.parser.compile(line)
+
+            return (compiled.weight == weight and
+                    sorted(tuple(value) for value in compiled) == sorted((word, values[word]) for word in words))
+
+        except Exception:
+
+            return False
+
+
+class ParseCache:
+
+    """
+    Caches parsed insult files on disk, so they don't have to be parsed again if they haven't changed.
+    The cache is stored next to the insult file, and is keyed on a hash of the file contents,
+    along with the version of the insult logic.
+    If either changes, the cache is ignored and rewritten.
+
+    The cache is the key on the first line, followed by a single marshal dump of a ParsedLines,
+    so loading it is a single read.
+    Any problem reading or writing the cache is ignored, and the file is parsed as normal.
+    """
+
+    FORMAT = 3  # Version of the cache format
+
+    def __init__(self, parser, suffix='.discache'):
+
+        self.parser = parser  # Parser used when the cache is out of date
+        self.suffix = suffix  # Suffix added to the insult file path to get the cache path
+
+    def path(self, path):
+
+        """
+        Gets the path to the cache of an insult file.
+        :param path: Path to insult file
+        :return: Path to cache file
+        """
+
+        return path + self.suffix
+
+    def parse(self, path, version, known=None):
+
+        """
+        Parses over the insults, using the cache if it is up to date.
+        The cache is rewritten if it is not.
+        :param path: Path to insult file
+        :param version: Version of the insult logic, the cache is ignored if it was made by another
+        :param known: Dictionary mapping (section, line) to values we already have, these lines are not parsed again
+        :return: ParsedLines of the insult file
+        """
+
+        with open(path, mode='rb') as file:
+
+            data = file.read()
+
+        key = self.key(data, version)
+        final = self.load(path, key)
+
+        if final is not None:
+
+            # Cache is up to date, use it:
+
+            return final
+
+        # Parsing the contents we hashed, decoding them the same way open() would:
+
+        final = ParsedLines(self.parser.iter_expanded(io.TextIOWrapper(io.BytesIO(data)), known))
+
+        self.save(path, key, final)
+
+        return final
+
+    def key(self, data, version):
+
+        """
+        Generates the key of an insult file.
+        :param data: Contents of the insult file, in bytes
+        :param version: Version of the insult logic
+        :return: Key in string format
+        """
+
+        return '{}:{}:{}'.format(self.FORMAT, version, hashlib.sha256(data).hexdigest())
+
+    def load(self, path, key):
+
+        """
+        Loads the cache of an insult file.
+        :param path: Path to insult file
+        :param key: Key the cache must have
+        :return: ParsedLines of the insult file, or None if the cache is missing or out of date
+        """
+
+        try:
+
+            with open(self.path(path), mode='rb') as file:
+
+                # The key is stored on the first line, so out of date caches can be skipped without loading them:
+
+                if file.readline() != key.encode() + b'\n':
+
+                    # Cache is out of date:
+
+                    return None
+
+                cache = marshal.load(file)
+
+        except (OSError, EOFError, ValueError, TypeError):
+
+            # Cache is missing or corrupt:
+
+            return None
+
+        return ParsedLines.from_columns(cache)
+
+    def save(self, path, key, table):
+
+        """
+        Saves the cache of an insult file.
+        The cache is written to a temporary file first, so it is never left half written.
+        :param path: Path to insult file
+        :param key: Key of the insult file
+        :param table: ParsedLines of the insult file
+        """
+
+        cache = table.to_columns()
+
+        temp = self.path(path) + '.tmp'
+
+        try:
+
+            with open(temp, mode='wb') as file:
+
+                file.write(key.encode() + b'\n')
+
+                marshal.dump(cache, file)
+
+            os.replace(temp, self.path(path))
+
+        except OSError:
+
+            # Unable to write the cache, we will just parse again next time
+
+            pass
+
+
+class ParsedLines:
+
+    """
+    The values of a parsed insult file, grouped by the line they came from.
+    Keeping the lines allows changed files to be parsed again incrementally.
+
+    Everything is stored in flat columns rather than a list per line,
+    as that is much more compact, and much faster to load from the cache.
+    """
+
+    def __init__(self, records=None):
+
+        self.sections = []  # Section of each line, 'flat' or 'chain'
+        self.lines = []  # Text of each line
+        self.counts = array('L')  # Number of values each line has
+        self.weights = array('L')  # Weight of each line
+        self.texts = []  # Text of every value, in line order
+        self.flags = bytearray()  # Vulgarity of every value, in line order
+
+        if records is not None:
+
+            for record in records:
+
+                self.append(*record)
+
+    @classmethod
+    def from_columns(cls, columns):
+
+        """
+        Creates a ParsedLines from columns generated by to_columns().
+        :param columns: Dictionary of columns
+        :return: New ParsedLines
+        """
+
+        new = cls()
+
+        new.sections = columns['sections']
+        new.lines = columns['lines']
+        new.counts = array('L', columns['counts'])
+        new.weights = array('L', columns['weights'])
+        new.texts = columns['texts']
+        new.flags = bytearray(columns['flags'])
+
+        return new
+
+    def to_columns(self):
+
+        """
+        Gets the columns of this ParsedLines, as basic types marshal can dump.
+        :return: Dictionary of columns
+        """
+
+        return {'sections': self.sections, 'lines': self.lines, 'counts': self.counts.tobytes(),
+                'weights': self.weights.tobytes(), 'texts': self.texts, 'flags': bytes(self.flags)}
+
+    def append(self, section, line, values, weight=1):
+
+        """
+        Adds a line, along with its values.
+        :param section: Section of the line, 'flat' or 'chain'
+        :param line: Text of the line
+        :param values: List of [text, vulgar] values of the line
+        :param weight: Weight of the values of the line
+        """
+
+        self.sections.append(section)
+        self.lines.append(line)
+        self.counts.append(len(values))
+        self.weights.append(weight)
+
+        for text, vulg in values:
+
+            self.texts.append(text)
+            self.flags.append(bool(vulg))
+
+    def words(self, section):
+
+        """
+        Generates the values in a section.
+        :param section: Section to get the values of, 'flat' or 'chain'
+        :return: Generator yielding (text, vulgar, weight) records
+        """
+
+        index = 0
+
+        for sec, count, weight in zip(self.sections, self.counts, self.weights):
+
+            if sec == section:
+
+                for num in range(index, index + count):
+
+                    yield self.texts[num], self.flags[num], weight
+
+            index = index + count
+
+    def weighted(self):
+
+        """
+        Checks if any line has a weight.
+        :return: True if a line has a weight other than 1
+        """
+
+        return any(weight != 1 for weight in self.weights)
+
+    def known(self):
+
+        """
+        Gets the values of each line, in the form InsultParser.iter_expanded() accepts.
+        :return: Dictionary mapping (section, line) to values
+        """
+
+        return {(section, line): values for section, line, values in self}
+
+    def __len__(self):
+
+        return len(self.lines)
+
+    def __iter__(self):
+
+        index = 0
+
+        for section, line, count in zip(self.sections, self.lines, self.counts):
+
+            yield section, line, [[self.texts[num], bool(self.flags[num])] for num in range(index, index + count)]
+
+            index = index + count
+
+
+class WordFile:
+
+    """
+    A compact binary file holding a parsed wordlist, read through a memory map.
+
+    Nothing is loaded when the file is opened, words are decoded from the mapped pages as they are needed,
+    so very large wordlists use little memory, and processes opening the same file share its pages.
+
+    The file starts with a header, followed by these arrays for each section('flat' and 'chain'):
+
+    offsets - Where each word starts in the text, plus where the last word ends(8 bytes each)
+    text - Every word encoded as UTF-8, one after the other
+    vulgar - Bitmap of the vulgar words
+    safe - Indexes of the non-vulgar words, in order(4 bytes each)
+    order - Indexes of the words in sorted order, for looking words up(4 bytes each)
+    weights - Weight of each word, only present if a word has a weight(4 bytes each)
+
+    All numbers are little endian, and every array starts on an 8 byte boundary.
+    On big endian machines the numbers are swapped as they are written, and copied and swapped when the file is opened,
+    so the arrays are only read straight from the mapped pages on little endian machines.
+    """
+
+    MAGIC = b'DISWORDS'  # Start of every word file
+    FORMAT = 1  # Version of the file format
+    HEADER = struct.Struct('<8sI4x')  # Magic and format
+    SECTION = struct.Struct('<10Q')  # Count, safe count, weighted, then the position of each array
+
+    def __init__(self, path):
+
+        self.path = path  # Path to the word file
+        self.sections = {}  # Dictionary mapping 'flat' and 'chain' to their arrays
+
+        with open(path, mode='rb') as file:
+
+            self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)  # Memory map of the file
+
+        view = memoryview(self.map)
+        magic, version = self.HEADER.unpack_from(view, 0)
+
+        self.view = view  # View of the whole file, the arrays are views of this
+
+        if magic != self.MAGIC or version != self.FORMAT:
+
+            raise ValueError("File [{}] is not a word file, or was made by another version!".format(path))
+
+        pos = self.HEADER.size
+
+        for thing in ['flat', 'chain']:
+
+            count, safe, weighted, offsets, text, size, vulgar, indexes, order, weights = \
+                self.SECTION.unpack_from(view, pos)
+
+            # Views of each array, nothing is copied:
+
+            self.sections[thing] = WordSection(
+                count=count,
+                offsets=_numbers(view[offsets:offsets + 8 * (count + 1)], 'Q'),
+                text=view[text:text + size],
+                vulgar=view[vulgar:vulgar + (count + 7) // 8],
+                safe=_numbers(view[indexes:indexes + 4 * safe], 'I'),
+                order=_numbers(view[order:order + 4 * count], 'I'),
+                weights=(_numbers(view[weights:weights + 4 * count], 'I') if weighted else None))
+
+            pos = pos + self.SECTION.size
+
+    @classmethod
+    def write(cls, path, sections):
+
+        """
+        Writes a wordlist to a word file.
+        The file is written to a temporary file first, so it is never left half written.
+        :param path: Path to the word file
+        :param sections: Dictionary mapping 'flat' and 'chain' to iterables of (text, vulgar, weight) records
+        """
+
+        arrays = {}
+
+        for thing in ['flat', 'chain']:
+
+            offsets = array('Q', [0])
+            text = bytearray()
+            vulgar = bytearray()
+            safe = array('I')
+            weights = array('I')
+            words = []
+
+            for num, (word, vulg, weight) in enumerate(sections[thing]):
+
+                words.append(word)
+                text.extend(word.encode('utf-8'))
+                offsets.append(len(text))
+                weights.append(weight)
+
+                if num % 8 == 0:
+
+                    vulgar.append(0)
+
+                if vulg:
+
+                    vulgar[num // 8] |= 1 << (num % 8)
+
+                else:
+
+                    safe.append(num)
+
+            order = array('I', sorted(range(len(words)), key=words.__getitem__))
+            weighted = any(weight != 1 for weight in weights)
+
+            arrays[thing] = (len(words), len(safe), weighted,
+                             [offsets, text, vulgar, safe, order, (weights if weighted else b'')])
+
+        # Working out where each array goes, after the header:
+
+        pos = cls.HEADER.size + 2 * cls.SECTION.size
+        header = [cls.HEADER.pack(cls.MAGIC, cls.FORMAT)]
+        body = []
+
+        for thing in ['flat', 'chain']:
+
+            count, safe, weighted, parts = arrays[thing]
+            places = []
+
+            for part in parts:
+
+                if isinstance(part, array) and sys.byteorder == 'big':
+
+                    # Numbers are always written little endian:
+
+                    part.byteswap()
+
+                data = bytes(part)
+                padding = -pos % 8
+
+                body.append(b'\0' * padding + data)
+
+                places.append(pos + padding)
+
+                pos = pos + padding + len(data)
+
+            header.append(cls.SECTION.pack(count, safe, int(weighted), places[0], places[1], len(parts[1]),
+                                           places[2], places[3], places[4], places[5]))
+
+        temp = path + '.tmp'
+
+        with open(temp, mode='wb') as file:
+
+            file.write(b''.join(header))
+
+            for data in body:
+
+                file.write(data)
+
+        os.replace(temp, path)
+
+    def close(self):
+
+        """
+        Lets go of the memory map of the file, closing it if nothing else is reading from it.
+        Stores still reading the arrays keep working, and the map is closed once the last of them is thrown away.
+        """
+
+        # Dropping our views, without releasing them, as a search in a thread may still be using them:
+
+        self.sections = {}
+        self.view = None
+        file_map, self.map = self.map, None
+
+        try:
+
+            file_map.close()
+
+        except BufferError:
+
+            # Still being read, the map is closed once nothing uses it:
+
+            pass
+
+
+def _numbers(view, code):
+
+    """
+    Reads an array of little endian numbers from a word file.
+    :param view: View of the bytes of the array
+    :param code: Type code of the numbers, 'Q' or 'I'
+    :return: View of the numbers, or a swapped copy of them on big endian machines
+    """
+
+    if sys.byteorder == 'little':
+
+        return view.cast(code)
+
+    numbers = array(code)
+
+    numbers.frombytes(view)
+    numbers.byteswap()
+
+    return numbers
+
+
+class WordSection:
+
+    """
+    The arrays of a section of a word file, as views of the memory map.
+    """
+
+    __slots__ = ('count', 'offsets', 'text', 'vulgar', 'safe', 'order', 'weights')
 
-                ret.append(''.join(final))
+    def __init__(self, count, offsets, text, vulgar, safe, order, weights=None):
 
-            continue
+        self.count = count  # Number of words
+        self.offsets = offsets  # Where each word starts in the text, plus where the last word ends
+        self.text = text  # Every word encoded as UTF-8
+        self.vulgar = vulgar  # Bitmap of the vulgar words
+        self.safe = safe  # Indexes of the non-vulgar words
+        self.order = order  # Indexes of the words in sorted order
+        self.weights = weights  # Weight of each word, None if every word has a weight of 1
 
-        return ret
@@ -0,0 +1,475 @@
+import asyncio
+import time
+import weakref
+from collections import OrderedDict
+from concurrent.futures import Future
+from threading import Lock
+
+"""
+This file will contain the per-guild wordlists for DIS.
+
+Every guild starts out using the base wordlist parsed from the insult file.
+A guild only gets a wordlist of its own once it changes something(adding, removing or clearing words),
+and even then it only keeps its changes, sharing the base wordlist by reference(copy-on-write).
+This means memory stays close to the size of the base wordlist no matter how many guilds we are in.
+
+Guilds that haven't been used for a while are cleaned up:
+guilds that no longer have any changes are dropped, and guilds with changes drop their search caches.
+
+If we have an EditJournal, the changes of each guild are recorded in it,
+and replayed when DIS starts up, so they survive restarts.
+
+Reloads run in a thread, while guilds keep changing their words on the event loop.
+The changes of each guild are taken on the event loop, the new wordlists are built from them in the thread,
+and then swapped in on the event loop, along with any changes made while they were being built.
+"""
+
+
+class GuildWordlists:
+
+    """
+    Keeps a wordlist for each guild that has changed the base wordlist.
+    """
+
+    def __init__(self, base, max_idle=3600, sweep=60, journal=None):
+
+        self.base = base  # InsultGen holding the base wordlist
+        self.journal = journal  # EditJournal the changes of each guild are recorded in, None to not keep them
+        self.max_idle = max_idle  # Seconds a guild can go unused before it is cleaned up
+        self.sweep = sweep  # Seconds between each check for idle guilds
+        self.guilds = OrderedDict()  # Guild IDs mapped to [InsultGen, last used, stores, reader], oldest first
+        self.last_sweep = time.monotonic()  # Time we last checked for idle guilds
+        self.evicted = 0  # Number of guilds we have dropped
+        self.loop = None  # Event loop the guilds are changed on, None if they are only changed in the calling thread
+        self._reload_lock = Lock()  # Lock so only one reload runs at a time
+
+    def get(self, guild):
+
+        """
+        Gets the wordlist a guild should read from.
+        Guilds without any changes use the base wordlist.
+        :param guild: ID of the guild
+        :return: InsultGen for the guild
+        """
+
+        entry = self._touch(guild)
+
+        return (entry[0] if entry is not None else self.base)
+
+    def edit(self, guild):
+
+        """
+        Gets the wordlist a guild should make changes to, creating it if the guild doesn't have one.
+        :param guild: ID of the guild
+        :return: InsultGen for the guild
+        """
+
+        entry = self._touch(guild)
+
+        if entry is None:
+
+            # First change, make a wordlist on top of the base:
+
+            gen = self.base.overlay()
+            entry = [gen, time.monotonic(), self._state(gen), None]
+
+            gen.journal = self.journal
+            gen.name = guild
+
+            self.guilds[guild] = entry
+
+        return entry[0]
+
+    def reload(self, path=None):
+
+        """
+        Reloads the base wordlist, and moves the changes of each guild on top of the new one.
+        Safe to call from a thread, the guilds are only read and changed on the event loop.
+        :param path: Path to configuration file. If None, use default.
+        """
+
+        with self._reload_lock:
+
+            # Old words may still be shared by the guilds, so we close them once every guild has moved off them:
+
+            old = self.base.reload(path, close=False)
+
+            # Taking the changes of each guild, and building the new wordlists from them:
+
+            taken = self._call(self._take)
+            built = [[entry, None] for entry, snapshot in taken]
+
+            try:
+
+                for pair, (entry, snapshot) in zip(built, taken):
+
+                    pair[1] = self.rebuild(snapshot)
+
+            finally:
+
+                # Guilds we couldn't build a wordlist for keep their old one:
+
+                self._call(self._swap, built)
+
+            if old is not None:
+
+                old.close()
+
+    def changes(self, guild):
+
+        """
+        Takes the changes a guild has made, so a copy of its wordlist can be built with rebuild().
+        Used to read a wordlist in a thread, as the copy never changes.
+        Must be called on the event loop.
+        :param guild: ID of the guild
+        :return: Changes of the guild, None if it uses the base wordlist
+        """
+
+        entry = self._touch(guild)
+
+        return (entry[0].snapshot() if entry is not None else None)
+
+    def reader(self, guild):
+
+        """
+        Takes the changes of a guild, so its wordlist can be searched in a thread with read().
+        The same reader is handed out until the guild changes its words,
+        so the copy built from it(and the searches cached on the copy) are reused.
+        Must be called on the event loop.
+        :param guild: ID of the guild
+        :return: List of the stores of the guild, their changes, and the copy built from them(None until it is built)
+        """
+
+        entry = self._touch(guild)
+
+        if entry is None:
+
+            # Using the base wordlist, which is never changed:
+
+            return [None, None, self.base]
+
+        if entry[3] is None or not self._same(entry[3][0], entry[0]):
+
+            entry[3] = [self._state(entry[0]), entry[0].snapshot(), None]
+
+        return entry[3]
+
+    def read(self, reader):
+
+        """
+        Gets the copy of a wordlist taken by reader(), building it if it hasn't been built yet.
+        Safe to call from a thread, as the copy is never changed.
+        :param reader: Reader from reader()
+        :return: InsultGen
+        """
+
+        if reader[2] is None:
+
+            reader[2] = self.rebuild(reader[1])
+
+        return reader[2]
+
+    def rebuild(self, snapshot):
+
+        """
+        Builds a wordlist with changes on top of the base wordlist.
+        Only the changes and the base are read, so this is safe to call from a thread.
+        :param snapshot: Changes taken by changes() or InsultGen.snapshot(), None for the base wordlist
+        :return: InsultGen
+        """
+
+        if snapshot is None:
+
+            # The base is never changed, only replaced by a reload, so it can be used as it is:
+
+            return self.base
+
+        new = self.base.overlay()
+
+        new.restore(snapshot)
+
+        return new
+
+    def _take(self):
+
+        """
+        Takes the changes of each guild, and starts keeping any changes made after.
+        Must be called on the event loop.
+        :return: List of (entry, snapshot) pairs
+        """
+
+        taken = []
+
+        for entry in self.guilds.values():
+
+            entry[0].pending = []
+
+            taken.append((entry, entry[0].snapshot()))
+
+        return taken
+
+    def _swap(self, built):
+
+        """
+        Swaps in the wordlists built by a reload, applying any changes made while they were built.
+        Must be called on the event loop.
+        :param built: List of [entry, InsultGen] pairs, the InsultGen is None if it couldn't be built
+        """
+
+        for entry, new in built:
+
+            gen = entry[0]
+            clean = self._clean(entry)
+            pending, gen.pending = gen.pending, None
+
+            if new is None:
+
+                continue
+
+            # Readers are built on the old base, so they are dropped along with it:
+
+            entry[3] = None
+
+            gen.insults, gen.safe_insult = new.insults, new.safe_insult
+
+            # Changes are already in the journal, so we don't record them again:
+
+            journal, gen.journal = gen.journal, None
+
+            try:
+
+                for record in pending:
+
+                    self._apply(record, gen)
+
+            finally:
+
+                gen.journal = journal
+
+            if clean:
+
+                # Still unchanged, remember the stores after the rebase:
+
+                entry[2] = self._state(gen)
+
+    def _call(self, func, *args):
+
+        """
+        Calls a function on the event loop, and waits for it.
+        If we have no event loop, or are already on it, the function is called directly.
+        :param func: Function to call
+        :param args: Arguments to pass to the function
+        :return: Value returned by the function
+        """
+
+        try:
+
+            running = asyncio.get_running_loop()
+
+        except RuntimeError:
+
+            running = None
+
+        if self.loop is None or running is self.loop:
+
+            return func(*args)
+
+        future = Future()
+
+        def call():
+
+            try:
+
+                future.set_result(func(*args))
+
+            except Exception as e:
+
+                future.set_exception(e)
+
+        self.loop.call_soon_threadsafe(call)
+
+        return future.result()
+
+    def replay(self):
+
+        """
+        Replays the changes recorded in the journal, on top of the base wordlist.
+        Changes that fail are skipped, as they failed when they were first made.
+        The journal is then compacted, so the next startup has less to replay.
+        """
+
+        if self.journal is None:
+
+            return
+
+        # Not recording the changes again while we replay them:
+
+        self.journal.paused = True
+
+        try:
+
+            for record in self.journal.read():
+
+                self._apply(record)
+
+        finally:
+
+            self.journal.paused = False
+
+        self.journal.compact(self.snapshot())
+        self.journal.flush()
+
+    def _apply(self, record, gen=None):
+
+        """
+        Applies a record from the journal.
+        :param record: Record to apply
+        :param gen: InsultGen to apply the record to, None for the wordlist of the guild it names
+        """
+
+        try:
+
+            op = record['op']
+            gen = (gen if gen is not None else self.edit(record['name']))
+
+            if op == 'snapshot':
+
+                gen.restore(record['state'])
+
+            elif op == 'clear':
+
+                gen.clear()
+
+            elif op in ('add', 'remove'):
+
+                expanded = {'flat': [], 'chain': []}
+                expanded[record['type']] = record['words']
+
+                if op == 'add':
+
+                    gen.add_words(None, record['type'], expanded=expanded)
+
+                else:
+
+                    gen.remove_words(None, record['type'], expanded=expanded)
+
+        except (ValueError, KeyError, TypeError, IndexError) as e:
+
+            print("Unable to replay change [{}]: {}".format(record, e))
+
+    def snapshot(self):
+
+        """
+        Gets a snapshot of the changes of every guild, as journal records.
+        Guilds without changes are left out.
+        :return: List of records
+        """
+
+        return [{'op': 'snapshot', 'name': guild, 'state': entry[0].snapshot()}
+                for guild, entry in self.guilds.items() if not self._clean(entry)]
+
+    def evict(self):
+
+        """
+        Cleans up guilds that haven't been used for a while.
+        Guilds without changes are dropped, guilds with changes only drop their search caches.
+        """
+
+        now = time.monotonic()
+
+        self.last_sweep = now
+
+        for guild in list(self.guilds):
+
+            entry = self.guilds[guild]
+
+            if now - entry[1] < self.max_idle:
+
+                # Guilds are in the order they were used, so the rest are newer:
+
+                break
+
+            if self._clean(entry):
+
+                del self.guilds[guild]
+
+                self.evicted = self.evicted + 1
+
+                continue
+
+            entry[0].clear_caches()
+
+            entry[3] = None
+
+            # Move the guild to the end, so we don't check it again until it is idle again:
+
+            entry[1] = now
+            self.guilds.move_to_end(guild)
+
+    def _touch(self, guild):
+
+        """
+        Marks a guild as used, checking for idle guilds if it has been a while.
+        :param guild: ID of the guild
+        :return: Entry of the guild, None if it doesn't have one
+        """
+
+        if time.monotonic() - self.last_sweep > self.sweep:
+
+            self.evict()
+
+        entry = self.guilds.get(guild)
+
+        if entry is not None:
+
+            entry[1] = time.monotonic()
+            self.guilds.move_to_end(guild)
+
+        return entry
+
+    def _state(self, gen):
+
+        """
+        Gets the stores of a wordlist, along with their versions.
+        Stores are referenced weakly, so stores replaced by a clear or a reload aren't kept alive.
+        :param gen: InsultGen to check
+        :return: List of (weak store, version) pairs
+        """
+
+        return [(weakref.ref(store), store.version) for store in self._stores(gen)]
+
+    def _clean(self, entry):
+
+        """
+        Checks if a guild has changed anything since its wordlist was made.
+        Clearing a wordlist replaces its stores, so we check they are the same stores as well.
+        :param entry: Entry of the guild
+        :return: True if nothing has changed
+        """
+
+        return self._same(entry[2], entry[0])
+
+    def _same(self, state, gen):
+
+        """
+        Checks if a wordlist still has the same stores, at the same versions.
+        :param state: Stores and versions from _state()
+        :param gen: InsultGen to check
+        :return: True if nothing has changed
+        """
+
+        return all(old() is new and version == new.version for (old, version), new in zip(state, self._stores(gen)))
+
+    def _stores(self, gen):
+
+        """
+        Gets the stores of a wordlist.
+        :param gen: InsultGen to check
+        :return: List of stores
+        """
+
+        return [collec[thing] for collec in (gen.insults, gen.safe_insult) for thing in ['flat', 'chain']]
+
+    def __len__(self):
+
+        return len(self.guilds)
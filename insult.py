@@ -1,7 +1,49 @@
 import random
-from fileutils import InsultParser
+from fileutils import InsultParser, ParseCache, ParsedLines, WordFile, NotationCompressor
+from wordstore import WordStore, TemplateStore, WordIndex, OverlayStore, MappedStore, TrieStore
+from functools import lru_cache, partial
+from collections import OrderedDict
+from threading import Lock
+from array import array
+import tempfile
+import gzip
+import time
 import re
 
+try:
+
+    import numpy
+
+except ImportError:
+
+    # NumPy is optional, we fall back to the random module without it:
+
+    numpy = None
+
+# Maximum length of a user supplied regular expression:
+
+PATTERN_LIMIT = 200
+
+# Maximum number of repeats('*', '+', '?' and '{}') in a user supplied regular expression:
+
+REPEAT_LIMIT = 3
+
+# Seconds a search by regular expression may run before we give up on it:
+
+SEARCH_TIME = 5
+
+# Number of search results we keep cached:
+
+QUERY_CACHE = 64
+
+# Size a dump can reach in memory before it is moved to a temporary file, in bytes:
+
+DUMP_SPOOL = 8 * 1024 * 1024
+
+# Characters that have a special meaning in regular expressions:
+
+_SPECIAL = '.^$*+?{}[]\\|()'
+
 """
 This file will contain all insult logic for DIS.
 Ideally, the insults will be generated with minimal configuration and parameters,
@@ -19,162 +61,882 @@ n = Number which specifies how many "chains" the insult will have.
 Chase is bad - 1 chain
 Chase is bad and trash - 2 chains
 
-Pros:
+Pros:
+
+Simple algorithm
+Low computing power
+Scalability - Add as many words as we want
+
+Cons:
+
+Might be too simple
+Statements that make little sense
+Insults that may lack emphasis - weak insults
+"""
+
+
+class InsultGen:
+
+    """
+    InsultGen handles all insult logic, and allows for generating, adding, removing,
+    and parsing the config(s) file for insults.
+    """
+
+    CHAIN = 'chain'
+    FLAT = 'flat'
+
+    def __init__(self, config='insults.txt', start="You are", templates=False, cache=True, load=True, mapped=False,
+                 trie=False):
+
+        self.parser = InsultParser()
+        self.templates = templates  # Value determining if we keep words as unexpanded notation
+        self.mapped = mapped  # Value determining if the config is a word file, mapped into memory read only
+        self.words = None  # WordFile our words are mapped from, None if they aren't mapped
+        self.trie = trie  # Value determining if words are kept sorted and front coded in a TrieStore
+        self.cache = (ParseCache(self.parser) if cache else None)  # Cache of parsed insult files
+        self._lines = None  # ParsedLines of the last parse
+        self._indexes = {}  # Dictionary mapping word types to search indexes
+        self._source = None  # InsultGen our stores are overlaid on, its search indexes cover our base words
+        self._queries = OrderedDict()  # Cache of search results, least recently used first
+        self._lock = Lock()  # Lock for the search cache, as searches can run in threads
+        self.sampler = None  # InsultSampler used to avoid repeating words in a channel, None to pick at random
+        self.journal = None  # EditJournal our changes are recorded in, None to not keep them
+        self.pending = None  # Changes made while a rebase is being built, None if no rebase is running
+        self.name = None  # Name of this wordlist in the journal
+        self.insults = self._new_collection()  # Dictionary of insult words
+        self.safe_insult = self._new_collection(safe=True, share=self.insults)  # Dictionary for non-vulgar insults
+        self.config = config  # Path to default insult file
+        self.start = start  # Default phrase to start the insult.
+        self.ver = '1.2.0'  # Version of insult logic
+
+        if load:
+
+            # Parsing over insult file:
+
+            self.parse()
+
+    def clear(self):
+
+        """
+        Cleared the internal collection of inputs
+        """
+
+        self._record('clear')
+
+        insults = self._new_collection()
+
+        self.insults, self.safe_insult = insults, self._new_collection(safe=True, share=insults)
+
+    def _record(self, op, **fields):
+
+        """
+        Records a change in the journal, if we have one.
+        :param op: Operation of the change, 'add', 'remove' or 'clear'
+        :param fields: Any other values of the change
+        """
+
+        if self.pending is not None:
+
+            # A rebase is being built from our old changes, it has to apply this one as well:
+
+            self.pending.append(dict(fields, op=op, name=self.name))
+
+        if self.journal is not None:
+
+            self.journal.record(op, self.name, **fields)
+
+    def snapshot(self):
+
+        """
+        Gets the changes made to a generator created by overlay(), in a form that can be saved as JSON.
+        Wordlists that have been cleared are saved in full.
+        :return: Dictionary mapping 'insults' and 'safe' to the changes of each word type
+        """
+
+        final = {}
+
+        for name, collec in (('insults', self.insults), ('safe', self.safe_insult)):
+
+            final[name] = {}
+
+            for thing in ['flat', 'chain']:
+
+                store = collec[thing]
+
+                if isinstance(store, OverlayStore) and store.shared:
+
+                    # Only save the changes on top of the base:
+
+                    added = [[word, store.added.weight(num)] for num, word in enumerate(store.added)]
+
+                    final[name][thing] = {'added': added, 'removed': sorted(store.removed)}
+
+                elif self.templates and store.added is not None:
+
+                    # Only save the lines changed on top of the base:
+
+                    final[name][thing] = {'lines': list(store.added), 'removed': sorted(store.removed)}
+
+                elif self.templates:
+
+                    final[name][thing] = {'cleared': True, 'lines': store.lines()}
+
+                else:
+
+                    added = [[word, store.weight(num)] for num, word in enumerate(store)]
+
+                    final[name][thing] = {'cleared': True, 'added': added}
+
+        return final
+
+    def restore(self, snapshot):
+
+        """
+        Applies changes saved by snapshot() to a generator created by overlay().
+        Changes are not recorded in the journal.
+        :param snapshot: Changes to apply
+        """
+
+        for name, collec in (('insults', self.insults), ('safe', self.safe_insult)):
+
+            for thing in ['flat', 'chain']:
+
+                state = snapshot[name][thing]
+
+                if state.get('cleared'):
+
+                    # Wordlist was cleared, start from an empty store:
+
+                    collec[thing] = self._new_collection(safe=(name == 'safe'), share=self.insults)[thing]
+
+                if self.templates:
+
+                    # Removing first, as a line removed and then added again is in both:
+
+                    for line in state.get('removed', []):
+
+                        collec[thing].discard(line)
+
+                    for line in state.get('lines', []):
+
+                        collec[thing].add(line)
+
+                    continue
+
+                collec[thing].extend_weighted(state.get('added', []))
+
+                for word in state.get('removed', []):
+
+                    collec[thing].discard(word)
+
+    def overlay(self):
+
+        """
+        Creates a new InsultGen that shares this wordlist by reference.
+        Words added to or removed from the new generator are kept on top of our words(copy-on-write),
+        and never change this generator.
+        In template mode, the lines of notation are copied instead, as they are already compact,
+        and the lines added and removed are kept track of.
+        :return: New InsultGen
+        """
+
+        new = InsultGen(self.config, self.start, self.templates, cache=False, load=False, mapped=self.mapped,
+                        trie=self.trie)
+
+        # Sharing everything that doesn't depend on the words:
+
+        new.parser = self.parser
+        new.cache = self.cache
+        new.sampler = self.sampler
+        new._source = self
+
+        for thing in ['flat', 'chain']:
+
+            if self.templates:
+
+                new.insults[thing] = self.insults[thing].copy(track=True)
+                new.safe_insult[thing] = self.safe_insult[thing].copy(track=True)
+
+            else:
+
+                new.insults[thing] = OverlayStore(self.insults[thing])
+                new.safe_insult[thing] = OverlayStore(self.safe_insult[thing])
+
+        return new
+
+    def rebase(self, base):
+
+        """
+        Moves the changes made to a generator created by overlay() on top of a new base, such as after a reload.
+        The new wordlist is built on the side, and swapped in once it is done.
+        Wordlists that have been cleared keep the words added since.
+        Must not be called while our words are being changed, see GuildWordlists.reload() for a rebase
+        that is built in a thread.
+        :param base: InsultGen to share the wordlist of
+        """
+
+        new = base.overlay()
+
+        new.restore(self.snapshot())
+
+        # Swapping in the new wordlist:
+
+        self.insults, self.safe_insult = new.insults, new.safe_insult
+        self._source = base
+
+    def clear_caches(self):
+
+        """
+        Throws away the search indexes and cached search results.
+        They are built again the next time they are needed.
+        """
+
+        with self._lock:
+
+            self._indexes = {}
+            self._queries.clear()
+
+    def _new_collection(self, safe=False, share=None):
+
+        """
+        Creates an empty collection of words.
+        In template mode, the words are kept as unexpanded notation in a TemplateStore.
+        In trie mode, the words are kept in a TrieStore, with the safe words sharing the blocks of the full words.
+        :param safe: Value determining if the collection only holds non-vulgar words
+        :param share: Collection of every word, which a safe collection shares the blocks of in trie mode
+        :return: Dictionary mapping 'flat' and 'chain' to empty stores
+        """
+
+        if self.templates:
+
+            return {'flat': TemplateStore(self.parser, safe=safe), 'chain': TemplateStore(self.parser, safe=safe)}
+
+        if self.trie:
+
+            final = {}
+
+            for thing in ['flat', 'chain']:
+
+                full = (share[thing] if share is not None else None)
+
+                # Only sharing blocks the full collection owns, an overlay keeps its changes separately:
+
+                final[thing] = TrieStore((full.blocks if safe and isinstance(full, TrieStore) else None), safe=safe)
+
+            return final
+
+        return {'flat': WordStore(), 'chain': WordStore()}
+
+    def parse(self, path=None):
+
+        """
+        Parses a specified insult configuration file for insults.
+        We call the InsultParser to handle the reading and interpreting
+        of DIS Insult Notation.
+        If caching is enabled, the parsed words are cached next to the file,
+        and the file is only parsed again when it changes.
+
+        The new wordlist is built on the side, and swapped in once it is done.
+
+        :param path: Path to configuration file. If None, use default.
+        """
+
+        self._parse_file(path)
+
+    def reload(self, path=None, close=True):
+
+        """
+        Reloads a specified insult configuration file.
+        Only lines that have changed since the last parse are sent through the notation parser,
+        the values of every other line are reused.
+
+        The new wordlist is built on the side, and swapped in once it is done,
+        so insults generated during a reload never see a half built wordlist.
+
+        :param path: Path to configuration file. If None, use default.
+        :param close: Value determining if the word file of the old words is closed once the new words are swapped in.
+        If False, it is returned, so it can be closed once nothing else uses the old words.
+        :return: WordFile of the old words if we didn't close it, None otherwise
+        """
+
+        old = self.words
+
+        self._parse_file(path, known=(self._lines.known() if self._lines is not None else None))
+
+        # Search indexes and cached matches hold the old words, so they are thrown away with them:
+
+        self.clear_caches()
+
+        if old is None or old is self.words:
+
+            return None
+
+        if not close:
+
+            return old
+
+        old.close()
+
+        return None
+
+    def _parse_file(self, path=None, known=None):
+
+        """
+        Parses a specified insult configuration file, and swaps the new wordlist in.
+        :param path: Path to configuration file. If None, use default.
+        :param known: Dictionary mapping (section, line) to values we already have
+        """
+
+        path = (path if path is not None else self.config)
+
+        if self.mapped:
+
+            # Mapping the word file, nothing is parsed or loaded:
+
+            self._load_mapped(path)
+
+            return
+
+        if self.templates:
+
+            # Adding each line of notation once, without expanding it:
+
+            insults = self._new_collection()
+            safe = self._new_collection(safe=True, share=insults)
+
+            with open(path, mode='r') as reader:
+
+                for word_type, line in self.parser.iter_sections(reader):
+
+                    compiled = self.parser.compile(line)
+
+                    insults[word_type].add(line, compiled)
+                    safe[word_type].add(line, compiled)
+
+            self.insults, self.safe_insult = insults, safe
+
+            return
+
+        if self.cache is not None:
+
+            # Using the parsed words from the cache, if the file hasn't changed:
+
+            table = self.cache.parse(path, self.ver, known)
+
+        else:
+
+            # Streaming the insult file, and parsing any lines we don't know:
+
+            with open(path, mode='r') as reader:
+
+                table = ParsedLines(self.parser.iter_expanded(reader, known))
+
+        self._load_table(table)
+
+    def _load_table(self, table):
+
+        """
+        Builds a new wordlist from parsed lines, and swaps it in.
+        The parsed lines are remembered, so they can be reused on the next reload.
+        :param table: ParsedLines of the insult file
+        """
+
+        insults = self._new_collection()
+        safe = self._new_collection(safe=True, share=insults)
+
+        for thing in ['flat', 'chain']:
+
+            if table.weighted():
+
+                # Adding the words along with their weights, non-vulgar words also go in the safe words:
+
+                insults[thing].extend_weighted((text, weight) for text, vulg, weight in table.words(thing))
+                safe[thing].extend_weighted((text, weight) for text, vulg, weight in table.words(thing) if not vulg)
+
+                continue
+
+            # Adding the words in bulk, non-vulgar words also go in the safe words:
+
+            insults[thing].extend(text for text, vulg, weight in table.words(thing))
+            safe[thing].extend(text for text, vulg, weight in table.words(thing) if not vulg)
+
+        # Swapping in the new wordlist:
+
+        self._lines = table
+        self.insults, self.safe_insult = insults, safe
+
+    def _load_mapped(self, path):
+
+        """
+        Maps a word file made by export(), and swaps its words in.
+        The words are read only, and are decoded as they are needed.
+        :param path: Path to the word file
+        """
+
+        words = WordFile(path)
+
+        insults = {thing: MappedStore(words.sections[thing]) for thing in ['flat', 'chain']}
+        safe = {thing: MappedStore(words.sections[thing], safe=True) for thing in ['flat', 'chain']}
+
+        # Swapping in the new wordlist:
+
+        self._lines = None
+        self.words = words
+        self.insults, self.safe_insult = insults, safe
+
+    def export(self, path):
+
+        """
+        Writes the wordlist to a word file, which can be loaded with mapped=True.
+        Word files are much smaller in memory than a loaded wordlist, and can be shared between processes.
+        :param path: Path to the word file
+        """
+
+        WordFile.write(path, {thing: self._records(thing) for thing in ['flat', 'chain']})
+
+    def notation_lines(self, compact=False):
+
+        """
+        Generates the wordlist as lines of DIS notation, laid out like the insult file.
+        Each word is escaped, so it expands back to itself, with its vulgarity and weight.
+        If compact, words sharing a prefix or suffix are folded into brackets(see NotationCompressor).
+        In template mode, the lines of notation are used as they are.
+        :param compact: Value determining if words should be folded into as few lines as we can
+        :return: Generator yielding lines, without newlines
+        """
+
+        return self._notation_lines(self.insults, self.safe_insult, compact)
+
+    def _notation_lines(self, insults, safe, compact=False):
+
+        """
+        Generates a collection as lines of DIS notation.
+        :param insults: Dictionary of insult words
+        :param safe: Dictionary of non-vulgar insult words
+        :param compact: Value determining if words should be folded into as few lines as we can
+        :return: Generator yielding lines, without newlines
+        """
+
+        yield '# DIS wordlist, {} flat words and {} chain words.'.format(len(insults['flat']), len(insults['chain']))
+
+        for thing, header in [('flat', self.parser.start_flat), ('chain', self.parser.start_chain)]:
+
+            yield ''
+            yield header.upper()
+
+            store = insults[thing]
+
+            if self.templates:
+
+                yield from store.lines()
+
+            elif compact:
+
+                # Folding needs every word at once, as they are sorted:
+
+                weighted = store.weighted()
+
+                yield from NotationCompressor(self.parser).compress(
+                    (word, word not in safe[thing], (store.weight(num) if weighted else 1))
+                    for num, word in enumerate(store))
+
+            else:
+
+                escape = self.parser.escape
+                weighted = store.weighted()
+
+                for num, word in enumerate(store):
+
+                    yield escape(word, word not in safe[thing], (store.weight(num) if weighted else 1))
+
+            yield self.parser.stop.upper()
+
+    def dump(self, compress=False, spool=DUMP_SPOOL, attempts=3, compact=False):
+
+        """
+        Writes the wordlist as DIS notation to a temporary file, in a single pass.
+        The file is kept in memory until it gets too big, then moved to disk.
+        Safe to call from a thread. The wordlist is not locked,
+        so if it changes while we write, we start again.
+        :param compress: Value determining if the file should be gzip compressed
+        :param spool: Bytes the file can take up in memory before it is moved to disk
+        :param attempts: Number of times we try before giving up on a changing wordlist
+        :param compact: Value determining if words should be folded into as few lines as we can
+        :return: Temporary file holding the wordlist, positioned at the start
+        :raises ValueError: If the wordlist kept changing
+        """
+
+        for _ in range(attempts):
+
+            insults, safe = self.insults, self.safe_insult
+
+            stores = [collec[thing] for collec in (insults, safe) for thing in ['flat', 'chain']]
+            versions = [store.version for store in stores]
+
+            buffer = tempfile.SpooledTemporaryFile(max_size=spool)
+            writer = (gzip.GzipFile(fileobj=buffer, mode='wb') if compress else buffer)
+            chunk = []
+            size = 0
+
+            for line in self._notation_lines(insults, safe, compact):
+
+                chunk.append(line)
+                size = size + len(line)
+
+                if size > 65536:
+
+                    # Writing in large pieces, so we don't call into the file for every word:
+
+                    writer.write(('\n'.join(chunk) + '\n').encode('utf-8'))
+
+                    chunk = []
+                    size = 0
+
+            writer.write(('\n'.join(chunk) + '\n').encode('utf-8'))
+
+            if compress:
+
+                # Finishing the compressed data, this leaves the buffer open:
+
+                writer.close()
+
+            if [store.version for store in stores] == versions:
+
+                buffer.seek(0)
+
+                return buffer
+
+            # Wordlist changed while we were writing, try again:
+
+            buffer.close()
+
+        raise ValueError("Wordlist kept changing while it was being written!")
+
+    def _records(self, word_type):
+
+        """
+        Generates every word of a type, along with its vulgarity and weight.
+        :param word_type: Type of word, 'chain' or 'flat'
+        :return: Generator yielding (text, vulgar, weight) records
+        """
+
+        store = self.insults[word_type]
+
+        if self.templates:
+
+            # Checking the safe words of a template store is slow, so use the vulgarity of each value:
+
+            for num, (text, vulg) in enumerate(store.flagged()):
+
+                yield text, vulg, store.weight(num)
+
+            return
+
+        safe = self.safe_insult[word_type]
+
+        for num, word in enumerate(store):
+
+            yield word, word not in safe, store.weight(num)
+
+    def _parse_dict(self, raw, remove=False):
+
+        """
+        Parses a specified dictionary and adds the words as they are found.
+        :param raw: Dictionary to parse.
+        :param remove: Value determining if we should remove words
+        :return:
+        """
+
+        # Iterating over RAW insult list and sorting accordingly:
+
+        for thing in ['flat', 'chain']:
+
+            if not remove:
+
+                # Adding the words in bulk, along with their weights if they have them.
+                # Non-vulgar words also go in the safe words:
+
+                self.insults[thing].extend_weighted((word[0], _weight(word)) for word in raw[thing])
+                self.safe_insult[thing].extend_weighted((word[0], _weight(word)) for word in raw[thing] if not word[1])
+
+                continue
+
+            # Iterate over all relevant insults:
+
+            for word in raw[thing]:
+
+                self._remove_word(word[0], thing, word[1])
+
+    def find_word(self, pattern, word_type):
+
+        """
+        Checks if a word(s) is in the collection.
+        Uses regular expressions to search.
+        Patterns that are plain text, or plain text starting with '^',
+        are looked up in a search index instead of checking every word.
+        :param pattern: Regular expression to check
+        :param word_type: Type of word to check
+        :return:
+        """
+
+        return self.find_page(pattern, word_type, page=1, size=None)[0]
+
+    def find_page(self, pattern, word_type, page=1, size=10):
+
+        """
+        Gets a single page of the words matching a pattern.
+        Matches are cached until the wordlist changes, so paging through them doesn't search again.
+        :param pattern: Regular expression to check
+        :param word_type: Type of word to check
+        :param page: Page to get, starting at 1
+        :param size: Number of words on each page, None for every word on one page
+        :return: List of [word, safe] on the page, and the total number of matches
+        """
+
+        # Reading the safe words first, so they are never older than the words we search:
+
+        safe = self.safe_insult[word_type]
+        store, matches = self._matches(pattern, word_type)
+
+        start = (page - 1) * (size if size is not None else 0)
+        chunk = (matches[start:start + size] if size is not None else matches)
+
+        if self.templates:
+
+            # Template matches are already [word, safe]:
+
+            return list(chunk), len(matches)
+
+        # Working out the words and their vulgarity, only for this page, from the store we searched:
+
+        return [[store[index], store[index] in safe] for index in chunk], len(matches)
+
+    def _matches(self, pattern, word_type):
+
+        """
+        Gets the words in a wordlist matching a pattern, using the cache if the wordlist hasn't changed.
+        :param pattern: Regular expression to check
+        :param word_type: Type of word to check
+        :return: Store we searched, and the indexes of the matching words in it(a list of [word, safe] in template mode)
+        """
+
+        store = self.insults[word_type]
+        key = (word_type, pattern)
+
+        with self._lock:
+
+            entry = self._queries.get(key)
+
+            if entry is not None and entry[0] is store and entry[1] == store.version:
+
+                # Wordlist hasn't changed, use the cached matches:
+
+                self._queries.move_to_end(key)
+
+                return store, entry[2]
+
+        version = store.version
+        regex = _compile_pattern(pattern)
+
+        if self.templates:
+
+            # Generate the values along with their vulgarity, as checking the safe list is slow,
+            # giving up if it takes too long:
+
+            matches = [[word, not vulg] for word, vulg in _timed(store.flagged())
+                       if regex.search(word)]
+
+        else:
+
+            literal = _literal_pattern(pattern)
+            index = (self._search_index(word_type, store) if literal is not None else None)
+
+            if literal is not None and isinstance(store, TrieStore):
+
+                # Words are sorted, so the words starting with the text are a run of indexes.
+                # A search index would copy every word, so other text is checked word by word:
+
+                matches = array('L', (store.prefix(literal[0]) if literal[1] else
+                                      (num for num, word in enumerate(store) if literal[0] in word)))
+
+            elif index is not None:
+
+                # Plain text, use the search index:
+
+                text, anchored = literal
+                words = (index.prefix(text) if anchored else index.substring(text))
+
+                if isinstance(store, OverlayStore):
+
+                    # Index only has the base words, so leave out the removed words, and check the added words:
 
-Simple algorithm
-Low computing power
-Scalability - Add as many words as we want
+                    removed = store.removed
+                    words = [word for word in words if word not in removed]
 
-Cons:
+                    words.extend(word for word in store.added if (word.startswith(text) if anchored else text in word))
 
-Might be too simple
-Statements that make little sense
-Insults that may lack emphasis - weak insults
-"""
+                matches = array('L', (store.index(word) for word in words))
 
+            else:
 
-class InsultGen:
+                # Check every word in the wordlist, giving up if it takes too long:
 
-    """
-    InsultGen handles all insult logic, and allows for generating, adding, removing,
-    and parsing the config(s) file for insults.
-    """
+                matches = array('L', (num for num, word in _timed(enumerate(store))
+                                      if regex.search(word)))
 
-    CHAIN = 'chain'
-    FLAT = 'flat'
+        with self._lock:
 
-    def __init__(self, config='insults.txt', start="You are"):
+            # Cache the matches, removing the least recently used if we have too many:
 
-        self.parser = InsultParser()
-        self.insults = {'flat': [], 'chain': []}  # Dictionary of insult words
-        self.safe_insult = {'flat': [], 'chain': []}  # Dictionary for non-vulgar insults
-        self.config = config  # Path to default insult file
-        self.start = start  # Default phrase to start the insult.
-        self.ver = '1.1.0'  # Version of insult logic
+            self._queries[key] = (store, version, matches)
 
-        # Parsing over insult file:
+            if len(self._queries) > QUERY_CACHE:
 
-        self.parse()
+                self._queries.popitem(last=False)
 
-    def clear(self):
+        return store, matches
+
+    def _search_index(self, word_type, store):
 
         """
-        Cleared the internal collection of inputs
+        Gets the search index for a wordlist, rebuilding it if the wordlist has changed.
+        Overlays use the index of the base they share, so it is only built once for every guild,
+        and their own changes are checked when they are searched.
+        :param word_type: Type of word to get the index for
+        :param store: Store of the wordlist
+        :return: WordIndex of the wordlist, or of the base of an overlay. None if the words should be scanned instead
         """
 
-        self.insults = {'flat': [], 'chain': []}
-        self.safe_insult = {'flat': [], 'chain': []}
+        if isinstance(store, OverlayStore):
 
-    def parse(self, path=None):
+            if not store.shared or self._source is None or self._source.insults[word_type] is not store.base:
 
-        """
-        Parses a specified insult configuration file for insults.
-        We call the InsultParser to handle the reading and interpreting
-        of DIS Insult Notation.
+                # Not sharing the words of our source(cleared, or waiting to be rebased), scan them:
 
-        :param path: Path to configuration file. If None, use default.
-        """
+                return None
 
-        # Clearing internal values:
+            return self._source._search_index(word_type, store.base)
 
-        self.insults = {'flat': [], 'chain': []}
-        self.safe_insult = {'flat': [], 'chain': []}
+        if isinstance(store, TrieStore):
 
-        # Getting insult list:
+            # Words are already sorted, and an index would copy every one of them:
 
-        raw = self.parser.parse((path if path is not None else self.config))
+            return None
 
-        # Parsing over the dictionary and adding relevant words:
+        index = self._indexes.get(word_type)
 
-        self._parse_dict(raw)
+        if index is None or not index.valid(store):
 
-    def _parse_dict(self, raw, remove=False):
+            # Index is missing or out of date, build a new one:
 
-        """
-        Parses a specified dictionary and adds the words as they are found.
-        :param raw: Dictionary to parse.
-        :param remove: Value determining if we should remove words
-        :return:
-        """
+            index = WordIndex(store)
 
-        # Iterating over RAW insult list and sorting accordingly:
+            self._indexes[word_type] = index
 
-        for thing in ['flat', 'chain']:
+        return index
 
-            # Iterate over all relevant insults:
+    def get_word_length(self):
 
-            for word in raw[thing]:
+        """
+        Returns the length of both wordlists.
 
-                if not remove:
+        :return: Length of flat, length of chain
+        """
 
-                    # Add word to collection:
+        return len(self.insults['flat']), len(self.insults['chain'])
 
-                    self._add_word(word[0], thing, word[1])
+    def expand_words(self, words, word_type, budget=None, max_length=None):
 
-                    continue
+        """
+        Sends one or more words through the DIS notation parser, without adding or removing them.
+        This does not touch the internal collection, so it is safe to call from another thread.
+        In template mode, the words are not expanded, and the lines of notation are returned in place of their values.
+        :param words: Words to expand, can be string or list.
+        :param word_type: Type of words
+        :param budget: Maximum number of values the words may expand to, None for no limit.
+        :param max_length: Maximum characters a value may have, None for no limit.
+        Limits are checked before anything is expanded.
+        :return: Dictionary of expanded words, in the same format as InsultParser.parse(), with the weight of each word
+        """
 
-                else:
+        if type(words) == str:
 
-                    self._remove_word(word[0], thing, word[1])
+            # Convert into a list:
 
-    def find_word(self, pattern, word_type):
+            words = [words]
+
+        return self.expand_sections([(word_type, word) for word in words], budget, max_length)
+
+    def expand_sections(self, lines, budget=None, max_length=None):
 
         """
-        Checks if a word(s) is in the collection.
-        Uses regular expressions to search.
-        :param pattern: Regular expression to check
-        :param word_type: Type of word to check
-        :return:
+        Sends lines of words through the DIS notation parser, without adding or removing them.
+        Each line has its own word type, so a whole insult file can be expanded(see InsultParser.iter_sections()).
+        This does not touch the internal collection, so it is safe to call from another thread.
+        In template mode, the lines are not expanded, and are returned in place of their values.
+        :param lines: Iterable of (word type, line) pairs
+        :param budget: Maximum number of values the lines may expand to, None for no limit.
+        :param max_length: Maximum characters a value may have, None for no limit.
+        Limits are checked before anything is expanded.
+        :return: Dictionary of expanded words, in the same format as expand_words()
         """
 
-        final = []
+        out = {'chain': [], 'flat': []}
 
-        # Check if word is in main insult list:
+        # Compiling the lines, so we can check the limits before expanding anything:
 
-        for word in self.insults[word_type]:
+        compiled = [(word_type, line, self.parser.compile(line)) for word_type, line in lines]
 
-            if re.search(pattern, word):
+        for word_type, line, comp in compiled:
 
-                # Word is valid, add it to the list, and check vulgarity:
+            comp.check(max_length=max_length)
 
-                final.append([word, word in self.safe_insult[word_type]])
+        if budget is not None and sum(comp.count() for word_type, line, comp in compiled) > budget:
 
-        return final
+            raise ValueError("Words expand to {} values, the limit is {}!".format(
+                sum(comp.count() for word_type, line, comp in compiled), budget))
 
-    def get_word_length(self):
+        for word_type, line, comp in compiled:
 
-        """
-        Returns the length of both wordlists.
+            if self.templates:
 
-        :return: Length of flat, length of chain
-        """
+                # Keep each line of notation without expanding it:
 
-        return len(self.insults['flat']), len(self.insults['chain'])
+                out[word_type].append([line.lower(), None])
+
+                continue
 
-    def add_words(self, words, word_type):
+            # Expand the compiled line:
+
+            out[word_type].extend([text, vulg, comp.weight] for text, vulg in comp)
+
+        return out
+
+    def add_words(self, words, word_type, expanded=None):
 
         """
         Allows for the addition of one or more words.
         Sends the words through the DIS notation parser.
+        In template mode, the words are added as unexpanded notation,
+        and the lines of notation are returned in place of their values.
         :param words: Words to add, can be string or list.
         :param word_type: Type of words
+        :param expanded: Words already expanded by expand_words(), so they are not parsed again.
         """
 
-        out = {'chain': [], 'flat': []}
-
-        if type(words) == str:
+        out = (expanded if expanded is not None else self.expand_words(words, word_type))
 
-            # Convert into a list:
+        self._record('add', type=word_type, words=out[word_type])
 
-            words = [words]
+        if self.templates:
 
-        # Working with a list, handle it as such:
+            # Add each line of notation without expanding it:
 
-        for word in words:
+            for line, vulg in out[word_type]:
 
-            # Send the word through the parser:
+                self._add_template(line, word_type)
 
-            out[word_type] = out[word_type] + self.parser.notation_parse(word)
+            return out
 
         # Parse raw words and add them to dictionary:
 
@@ -182,30 +944,32 @@ class InsultGen:
 
         return out
 
-    def remove_words(self, words, word_type):
+    def remove_words(self, words, word_type, expanded=None):
 
         """
         Allows for the removal of one or more words.
         Sends the words through the DIS notation parser.
+        In template mode, the words must match the lines of notation that were added.
         :param words: Words to add, can be string or list
         :param word_type: Type of words to add
+        :param expanded: Words already expanded by expand_words(), so they are not parsed again.
         """
 
-        out = {'chain': [], 'flat': []}
+        out = (expanded if expanded is not None else self.expand_words(words, word_type))
 
-        if type(words) == str:
+        # Recorded before removing, so a removal that fails part way is replayed the same way:
 
-            # Convert into list:
+        self._record('remove', type=word_type, words=out[word_type])
 
-            words = [words]
+        if self.templates:
 
-        # Working with a list:
+            # Remove each line of notation:
 
-        for word in words:
+            for line, vulg in out[word_type]:
 
-            # Send word through the parser
+                self._remove_template(line, word_type)
 
-            out[word_type] = out[word_type] + self.parser.notation_parse(word)
+            return out
 
         # Parse raw words and remove them from the dictionary
 
@@ -213,38 +977,61 @@ class InsultGen:
 
         return out
 
-    def _add_word(self, text, word_type, vulgar=False):
+    def _add_word(self, text, word_type, vulgar=False, weight=1):
 
         """
         Adds a word(Or a statement) to the internal collection.
-        These words are not persistent and will be reset on the next runtime.
+        These words are not persistent and will be reset on the next runtime,
+        unless the add is recorded in a journal by add_words().
         :param text: Word(s) to add.
         :param word_type: Specifies which word it is, 'chain' or 'flat'
         :param vulgar: Boolean determining if he word is vulgar
+        :param weight: Weight of the word, how likely it is to be picked
         :return:
         """
 
         if not vulgar:
 
-            # Word is not vulgar, add it to the safe words:
+            # Word is not vulgar, add it to the safe words.
+            # Already registered words are ignored by the store:
 
-            if text in self.safe_insult[word_type]:
+            if not self.safe_insult[word_type].add(text, weight):
 
                 # Already have to word registered, do nothing.
 
                 return
 
-            self.safe_insult[word_type].append(text)
+        # Add the word to the insult collection:
 
-        if text in self.insults[word_type]:
+        self.insults[word_type].add(text, weight)
 
-            # Already have word registered, do nothing
+    def _add_template(self, line, word_type):
 
-            return
+        """
+        Adds a line of notation to the internal collection, without expanding it.
+        Only used in template mode.
+        :param line: Line of DIS notation to add
+        :param word_type: Specifies which word it is, 'chain' or 'flat'
+        """
 
-        # Add the word to the insult collection:
+        # Compile the line once, and share it between both collections:
+
+        compiled = self.parser.compile(line)
+
+        self.insults[word_type].add(line, compiled)
+        self.safe_insult[word_type].add(line, compiled)
+
+    def _remove_template(self, line, word_type):
+
+        """
+        Removes a line of notation from the internal collection.
+        Only used in template mode.
+        :param line: Line of DIS notation to remove
+        :param word_type: Type of word to remove, 'chain' or 'flat'
+        """
 
-        self.insults[word_type].append(text)
+        self.insults[word_type].remove(line)
+        self.safe_insult[word_type].discard(line)
 
     def _remove_word(self, text, word_type, safe=True):
 
@@ -270,17 +1057,9 @@ class InsultGen:
 
             # Attempt to remove form the safe word list:
 
-            try:
-
-                self.safe_insult[word_type].remove(text)
-
-            except Exception:
-
-                # Word not in safe list, move on
+            self.safe_insult[word_type].discard(text)
 
-                pass
-
-    def gen_insult(self, num, start=None, vulgar=False, limit=None):
+    def gen_insult(self, num, start=None, vulgar=False, limit=None, channel=None):
 
         """
         Generates an insult based on the internal collection.
@@ -289,30 +1068,65 @@ class InsultGen:
         :param num: Number of chains the insult has
         :param start: Start text. If none, resort to default.
         :param vulgar: Boolean determining if we should use vulgar insults.
+        :param limit: Maximum length of the insult, chains that go over it are not added.
+        :param channel: Channel the insult is for. If we have a sampler, it is used to avoid repeating words here.
+        Weighted words are still drawn in proportion to their weights, the sampler only skips recent ones.
         :return: Insult in string format
         """
 
         collec = (self.insults if vulgar else self.safe_insult)
 
-        if collec == {'flat': [], 'chain': []}:
+        if not collec['flat'] and not collec['chain']:
 
             # Empty wordlist, return false
 
             return False
 
-        # Getting start of the argument:
+        start = (str(start) if start is not None else self.start)
+
+        # Planning the insult using the word lengths, so we only build the string once:
+
+        flat_len = collec['flat'].length
+        chain_len = collec['chain'].length
+        flat_num = len(collec['flat'])
+        chain_num = len(collec['chain'])
+        rand = random.random
+
+        if flat_num == 0 or (num > 1 and chain_num == 0):
+
+            # Same error random.choice() raises:
+
+            raise IndexError("Cannot choose from an empty sequence")
+
+        if channel is not None and self.sampler is not None:
+
+            # Drawing words with the sampler, so the channel doesn't see the same words over and over:
+
+            draw_flat = partial(self.sampler.draw, (channel, vulgar, 'flat'), collec['flat'])
+            draw_chain = partial(self.sampler.draw, (channel, vulgar, 'chain'), collec['chain'])
+
+        else:
+
+            # Weighted words are drawn by their store, everything else is drawn uniformly:
+
+            draw_flat = (collec['flat'].draw if collec['flat'].weighted() else (lambda: int(rand() * flat_num)))
+            draw_chain = (collec['chain'].draw if collec['chain'].weighted() else (lambda: int(rand() * chain_num)))
 
-        final = (str(start) if start is not None else self.start) + ' ' + random.choice(collec['flat'])
+        flats = [draw_flat()]
+        chains = []
+        length = len(start) + 1 + flat_len(flats[0])
 
         # Generating chains:
 
         for i in range(num - 1):
 
-            # Generate values and combine together into the final insult:
+            # Generate values, and check the length of the chain:
 
-            choice = ' ' + random.choice(collec['chain']) + ' ' + random.choice(collec['flat'])
+            chain = draw_chain()
+            flat = draw_flat()
+            size = chain_len(chain) + flat_len(flat) + 2
 
-            if limit is not None and len(choice) + len(final) >= limit:
+            if limit is not None and length + size >= limit:
 
                 # Insult is too big! do not generate.
 
@@ -320,8 +1134,327 @@ class InsultGen:
 
             # Insult length is still valid, add it:
 
-            final = final + choice
+            chains.append(chain)
+            flats.append(flat)
+            length = length + size
 
         # Return the insult
 
+        return _join_insult(start, collec, flats, chains)
+
+    def gen_insults(self, count, num, start=None, vulgar=False, limit=None):
+
+        """
+        Generates a batch of insults based on the internal collection.
+        All the words are drawn at once, which is much faster than calling gen_insult() over and over.
+        Uses NumPy to draw the words if it is available.
+        :param count: Number of insults to generate
+        :param num: Number of chains each insult has
+        :param start: Start text. If none, resort to default.
+        :param vulgar: Boolean determining if we should use vulgar insults.
+        :param limit: Maximum length of each insult, chains that go over it are not added.
+        :return: List of insults in string format
+        """
+
+        collec = (self.insults if vulgar else self.safe_insult)
+
+        if not collec['flat'] and not collec['chain']:
+
+            # Empty wordlist, return false
+
+            return False
+
+        start = (str(start) if start is not None else self.start)
+        chains = max(num - 1, 0)
+
+        if limit is not None:
+
+            # Each chain adds at least two spaces, so no more than this many can fit under the limit.
+            # Capping the chains here means we don't draw words that would be thrown away:
+
+            chains = min(chains, max(limit - len(start), 0) // 2)
+
+        # Drawing every word we need in one go:
+
+        flat = _draw_indexes(collec['flat'], count * (chains + 1))
+        chain = _draw_indexes(collec['chain'], count * chains)
+
+        final = []
+
+        for index in range(count):
+
+            # Working out the words for this insult:
+
+            flats = flat[index * (chains + 1):(index + 1) * (chains + 1)]
+            chain_indexes = chain[index * chains:(index + 1) * chains]
+
+            # Planning the chains that fit under the limit:
+
+            kept = _plan_chains(len(start) + 1 + collec['flat'].length(flats[0]), collec, flats, chain_indexes, limit)
+
+            final.append(_join_insult(start, collec, flats[:kept + 1], chain_indexes[:kept]))
+
         return final
+
+
+@lru_cache(maxsize=256)
+def _compile_pattern(pattern):
+
+    """
+    Compiles a regular expression, keeping the most recent ones so they aren't compiled again.
+    Patterns are checked first, as users can supply them.
+    :param pattern: Regular expression to compile
+    :return: Compiled regular expression
+    :raises ValueError: If the pattern is too long, or could take forever to match
+    """
+
+    if len(pattern) > PATTERN_LIMIT:
+
+        raise ValueError("Pattern is longer than the limit of {} characters!".format(PATTERN_LIMIT))
+
+    if _backtracks(pattern):
+
+        raise ValueError("Pattern can take forever to match! Groups containing a repeat or '|' can't be repeated, "
+                         "and patterns can have at most {} repeats.".format(REPEAT_LIMIT))
+
+    return re.compile(pattern)
+
+
+def _backtracks(pattern):
+
+    """
+    Checks if a regular expression could backtrack for a long time.
+    This is the case if it repeats a group containing a repeat or an alternation, such as '(a+)+' or '(a|aa)*',
+    or if it has more than REPEAT_LIMIT repeats, such as '\\w*\\w*\\w*\\w*!'.
+    This is a cheap check of the text, so it may reject some patterns that would be fine.
+    :param pattern: Regular expression to check
+    :return: True if the pattern could backtrack for a long time
+    """
+
+    groups = [False]  # Stack of values determining if each open group contains a repeat or alternation
+    index = 0
+    repeats = 0  # Number of repeats we have seen
+    closed = False  # Value determining if the last thing was a group containing a repeat or alternation
+    repeated = False  # Value determining if the last thing was a repeat
+
+    while index < len(pattern):
+
+        char = pattern[index]
+
+        if char == '\\':
+
+            # Escaped character, skip it:
+
+            index = index + 2
+            closed = repeated = False
+
+            continue
+
+        if char == '[':
+
+            # Character set, skip to the end of it:
+
+            end = pattern.find(']', index + 2)
+            index = (end + 1 if end != -1 else len(pattern))
+            closed = repeated = False
+
+            continue
+
+        if char in '*+?{':
+
+            if repeated:
+
+                # Lazy or possessive repeat, such as '*?', this is part of the last repeat:
+
+                index = index + 1
+
+                continue
+
+            if closed:
+
+                return True
+
+            repeats = repeats + 1
+            groups[-1] = True
+            repeated = True
+            index = index + 1
+
+            if char == '{':
+
+                # Skip to the end of the count:
+
+                end = pattern.find('}', index)
+                index = (end + 1 if end != -1 else len(pattern))
+
+            continue
+
+        if char == '|':
+
+            groups[-1] = True
+
+        elif char == '(':
+
+            groups.append(False)
+
+            if pattern.startswith('?', index + 1):
+
+                # Group extension, such as '(?:', not a repeat:
+
+                index = index + 1
+
+        elif char == ')' and len(groups) > 1:
+
+            inner = groups.pop()
+            groups[-1] = groups[-1] or inner
+            closed = inner
+            repeated = False
+            index = index + 1
+
+            continue
+
+        closed = repeated = False
+        index = index + 1
+
+    return repeats > REPEAT_LIMIT
+
+
+def _timed(items, seconds=SEARCH_TIME):
+
+    """
+    Generates items until a number of seconds have passed.
+    Used to stop a search by regular expression from holding a thread for too long.
+    :param items: Iterable of items
+    :param seconds: Seconds we may take
+    :return: Generator yielding each item
+    :raises ValueError: If we take too long
+    """
+
+    deadline = time.monotonic() + seconds
+
+    for item in items:
+
+        if time.monotonic() > deadline:
+
+            raise ValueError("Search took longer than {} seconds, try a simpler pattern!".format(seconds))
+
+        yield item
+
+
+def _literal_pattern(pattern):
+
+    """
+    Checks if a regular expression is plain text, optionally starting with '^'.
+    :param pattern: Regular expression to check
+    :return: Tuple of the text and if it must be at the start, or None if the pattern is not plain text
+    """
+
+    anchored = pattern.startswith('^')
+    text = (pattern[1:] if anchored else pattern)
+
+    if text == '' or any(char in _SPECIAL for char in text):
+
+        return None
+
+    return text, anchored
+
+
+def _draw_indexes(store, count):
+
+    """
+    Draws random indexes for a collection.
+    Uses NumPy if it is available, and random.choices() if it is not.
+    Weighted stores are drawn from with their alias table.
+    :param store: Store to draw from
+    :param count: Number of indexes to draw
+    :return: List of indexes
+    """
+
+    length = len(store)
+
+    if count == 0:
+
+        return []
+
+    if length == 0:
+
+        # Same error random.choice() raises:
+
+        raise IndexError("Cannot choose from an empty sequence")
+
+    if store.weighted():
+
+        return store.draw_many(count)
+
+    if numpy is not None:
+
+        return numpy.random.randint(0, length, size=count).tolist()
+
+    return random.choices(range(length), k=count)
+
+
+def _weight(word):
+
+    """
+    Gets the weight of an expanded word.
+    :param word: Word in the form [text, vulgar] or [text, vulgar, weight]
+    :return: Weight of the word
+    """
+
+    return (word[2] if len(word) > 2 else 1)
+
+
+def _plan_chains(length, collec, flats, chains, limit=None):
+
+    """
+    Works out how many chains fit in an insult, using the word lengths alone.
+    Chains are added until one goes over the limit, in the same way gen_insult() does.
+    :param length: Length of the insult before any chains
+    :param collec: Collection the words are from
+    :param flats: Indexes of flat words, one more than the number of chains
+    :param chains: Indexes of chain words
+    :param limit: Maximum length of the insult, None for no limit
+    :return: Number of chains that fit
+    """
+
+    if limit is None:
+
+        return len(chains)
+
+    kept = 0
+
+    for chain, flat in zip(chains, flats[1:]):
+
+        # Each chain adds the chain word, the flat word, and two spaces:
+
+        length = length + collec['chain'].length(chain) + collec['flat'].length(flat) + 2
+
+        if length >= limit:
+
+            # Insult is too big! do not generate.
+
+            break
+
+        kept = kept + 1
+
+    return kept
+
+
+def _join_insult(start, collec, flats, chains):
+
+    """
+    Builds an insult from planned word indexes, with a single join.
+    :param start: Start text
+    :param collec: Collection the words are from
+    :param flats: Indexes of flat words, one more than the number of chains
+    :param chains: Indexes of chain words
+    :return: Insult in string format
+    """
+
+    parts = [start, collec['flat'][flats[0]]]
+
+    for chain, flat in zip(chains, flats[1:]):
+
+        parts.append(collec['chain'][chain])
+        parts.append(collec['flat'][flat])
+
+    return ' '.join(parts)
@@ -0,0 +1,221 @@
+import asyncio
+import json
+import os
+from threading import Lock
+
+"""
+This file will contain the edit journal for DIS.
+
+Words added and removed at runtime used to be lost on the next restart.
+The journal keeps a record of every change(add, remove or clear) in a file,
+so the changes can be replayed on top of the insult file when DIS starts up.
+
+Records are kept in memory, and written in batches by a background task,
+with a single fsync for each batch, so commands never wait on the disk.
+The journal is only ever added to, apart from when it is compacted:
+every record is then replaced with a snapshot of the changes they add up to,
+so the journal doesn't grow forever.
+
+Each record is a line of JSON. Lines that can't be read(such as a line cut short by a crash) are skipped.
+"""
+
+
+class EditJournal:
+
+    """
+    An append only journal of changes, written to a file in batches.
+    """
+
+    def __init__(self, path='edits.journal', interval=1.0, threshold=1000):
+
+        self.path = path  # Path to the journal file
+        self.interval = interval  # Seconds between each write of the records
+        self.threshold = threshold  # Number of records written before we compact the journal
+        self.buffer = []  # Records that haven't been written, oldest first
+        self.snapshot = None  # Records to replace the journal with on the next write, None to add to it
+        self.written = 0  # Number of records written on top of the last snapshot
+        self.paused = False  # Value determining if new records are ignored, such as when replaying
+        self.task = None  # Task writing the records
+        self._lock = Lock()  # Lock for the buffer, as records are written in a thread
+        self._file_lock = Lock()  # Lock for the file, so only one write happens at a time
+
+    def record(self, op, name, **fields):
+
+        """
+        Adds a record to the journal.
+        The record is written to the file on the next write.
+        :param op: Operation of the record, such as 'add', 'remove' or 'clear'
+        :param name: Name of the wordlist the operation was done to
+        :param fields: Any other values of the record, must be JSON serializable
+        """
+
+        if self.paused:
+
+            return
+
+        fields['op'] = op
+        fields['name'] = name
+
+        with self._lock:
+
+            self.buffer.append(json.dumps(fields))
+
+    def compact(self, records):
+
+        """
+        Replaces every record in the journal with a snapshot.
+        Records that haven't been written are dropped, as the snapshot must already contain them.
+        The journal file is replaced on the next write.
+        :param records: List of records making up the snapshot
+        """
+
+        with self._lock:
+
+            self.snapshot = [json.dumps(record) for record in records]
+            self.buffer = []
+
+    def read(self):
+
+        """
+        Reads the records in the journal file.
+        :return: Generator yielding each record, oldest first
+        """
+
+        try:
+
+            file = open(self.path, mode='r')
+
+        except OSError:
+
+            # No journal yet, nothing to read
+
+            return
+
+        with file:
+
+            for line in file:
+
+                try:
+
+                    yield json.loads(line)
+
+                except ValueError:
+
+                    # Bad line, skip it:
+
+                    continue
+
+    def flush(self):
+
+        """
+        Writes any records to the journal file, and waits for them to reach the disk.
+        If a snapshot is waiting, the file is replaced with it instead.
+        Safe to call from a thread.
+        """
+
+        with self._file_lock:
+
+            with self._lock:
+
+                snapshot, lines = self.snapshot, self.buffer
+                self.snapshot, self.buffer = None, []
+
+            if snapshot is None and not lines:
+
+                return
+
+            try:
+
+                if snapshot is not None:
+
+                    # Writing to a temporary file first, so the journal is never left half written:
+
+                    temp = self.path + '.tmp'
+
+                    with open(temp, mode='w') as file:
+
+                        file.write(''.join(line + '\n' for line in snapshot + lines))
+                        file.flush()
+                        os.fsync(file.fileno())
+
+                    os.replace(temp, self.path)
+
+                    # Only counting the records on top of the snapshot:
+
+                    self.written = len(lines)
+
+                    return
+
+                with open(self.path, mode='a') as file:
+
+                    file.write(''.join(line + '\n' for line in lines))
+                    file.flush()
+                    os.fsync(file.fileno())
+
+                self.written = self.written + len(lines)
+
+            except OSError as e:
+
+                # Unable to write, keep the records so we can try again next time:
+
+                print("Unable to write journal [{}]: {}".format(self.path, e))
+
+                with self._lock:
+
+                    if self.snapshot is None:
+
+                        self.snapshot = snapshot
+                        self.buffer = lines + self.buffer
+
+    def start(self, snapshot=None):
+
+        """
+        Starts writing records in the background.
+        Must be called from a running event loop.
+        Does nothing if we are already writing.
+        :param snapshot: Function returning the records of a snapshot, used to compact the journal.
+        None to never compact.
+        """
+
+        if self.task is not None and not self.task.done():
+
+            # Already writing, do nothing
+
+            return
+
+        self.task = asyncio.ensure_future(self._flush(snapshot))
+
+    def stop(self):
+
+        """
+        Stops writing records in the background, and writes any that are left.
+        """
+
+        if self.task is not None:
+
+            self.task.cancel()
+
+        self.task = None
+
+        self.flush()
+
+    async def _flush(self, snapshot):
+
+        """
+        Writes records until we are stopped, compacting the journal once it gets too big.
+        :param snapshot: Function returning the records of a snapshot, None to never compact
+        """
+
+        while True:
+
+            await asyncio.sleep(self.interval)
+
+            if snapshot is not None and self.written >= self.threshold:
+
+                # Taking the snapshot here, so nothing changes while it is taken:
+
+                self.compact(snapshot())
+
+            # Writing in a thread, so the event loop is never held up by the disk:
+
+            await asyncio.get_event_loop().run_in_executor(None, self.flush)
@@ -0,0 +1,210 @@
+import asyncio
+import time
+from collections import deque
+
+"""
+This file will contain the message buffer for DIS.
+
+Commands that output many lines(such as adding or removing lots of words) used to send one message for each line.
+Every message is a request to discord, so adding 50 words meant 50 requests, and we would quickly be rate limited.
+
+The message buffer collects lines, and joins as many as it can into each message,
+without going over the 2000 character limit discord has on messages.
+Messages are sent once the next line won't fit, and anything left is sent at the end of the command.
+
+Discord only allows a few messages in each channel every few seconds.
+Each channel gets a bucket, and we wait for the bucket to have room before sending,
+rather than sending anyway and having the request rejected.
+"""
+
+# Largest number of characters discord allows in a message:
+
+MESSAGE_LIMIT = 2000
+
+
+class ChannelLimiter:
+
+    """
+    Keeps a rate limit bucket for each channel, allowing a number of messages every few seconds.
+    """
+
+    def __init__(self, rate=5, per=5.0, max_buckets=1000):
+
+        self.rate = rate  # Number of messages allowed in each period
+        self.per = per  # Seconds in each period
+        self.max_buckets = max_buckets  # Maximum number of buckets we keep
+        self.buckets = {}  # Dictionary mapping channel IDs to the times of their recent messages, oldest first
+        self.waited = 0  # Number of times we had to wait for a bucket
+
+    def delay(self, channel):
+
+        """
+        Gets the number of seconds until a channel can send another message.
+        :param channel: ID of the channel
+        :return: Seconds to wait, 0 if we can send now
+        """
+
+        bucket = self.buckets.get(channel)
+
+        if bucket is None or len(bucket) < self.rate:
+
+            return 0
+
+        # Bucket is full, wait until the oldest message leaves the period:
+
+        return max(bucket[0] + self.per - time.monotonic(), 0)
+
+    async def acquire(self, channel):
+
+        """
+        Waits until a channel can send a message, and takes a place in its bucket.
+        :param channel: ID of the channel
+        """
+
+        while True:
+
+            wait = self.delay(channel)
+
+            if wait <= 0:
+
+                break
+
+            self.waited = self.waited + 1
+
+            await asyncio.sleep(wait)
+
+        bucket = self.buckets.get(channel)
+
+        if bucket is None:
+
+            if len(self.buckets) >= self.max_buckets:
+
+                # Too many buckets, drop any that have emptied:
+
+                self.sweep()
+
+            bucket = deque(maxlen=self.rate)
+
+            self.buckets[channel] = bucket
+
+        bucket.append(time.monotonic())
+
+    def sweep(self):
+
+        """
+        Drops the buckets of channels that haven't sent anything in the last period.
+        """
+
+        cutoff = time.monotonic() - self.per
+
+        self.buckets = {key: bucket for key, bucket in self.buckets.items() if bucket and bucket[-1] > cutoff}
+
+
+class MessageBuffer:
+
+    """
+    Collects lines of output, and sends them in as few messages as possible.
+    Can be used as an async context manager, which sends anything left when the block ends:
+
+        async with MessageBuffer(ctx) as out:
+            await out.add("line")
+    """
+
+    def __init__(self, destination, limiter=None, limit=MESSAGE_LIMIT):
+
+        self.destination = destination  # Object we send messages to, such as a context or channel
+        self.limiter = limiter  # ChannelLimiter to wait on before sending, None to not wait
+        self.limit = limit  # Maximum number of characters in each message
+        self.lines = []  # Lines waiting to be sent
+        self.size = 0  # Number of characters the waiting lines take up, including newlines
+        self.sent = 0  # Number of messages we have sent
+
+    async def add(self, line):
+
+        """
+        Adds a line to the buffer.
+        If the line won't fit in the current message, the current message is sent first.
+        Lines longer than a message are split across messages.
+        :param line: Line to add
+        """
+
+        line = str(line)
+
+        while len(line) > self.limit:
+
+            # Line is too long for a single message, send it in pieces:
+
+            await self.flush()
+            await self._send(line[:self.limit])
+
+            line = line[self.limit:]
+
+        # Newline between this line and the last:
+
+        extra = len(line) + (1 if self.lines else 0)
+
+        if self.size + extra > self.limit:
+
+            await self.flush()
+
+            extra = len(line)
+
+        self.lines.append(line)
+        self.size = self.size + extra
+
+    async def extend(self, lines):
+
+        """
+        Adds many lines to the buffer.
+        :param lines: Iterable of lines to add
+        """
+
+        for line in lines:
+
+            await self.add(line)
+
+    async def flush(self):
+
+        """
+        Sends any lines in the buffer as a single message.
+        """
+
+        if not self.lines:
+
+            return
+
+        text = '\n'.join(self.lines)
+
+        self.lines = []
+        self.size = 0
+
+        await self._send(text)
+
+    async def _send(self, text):
+
+        """
+        Sends a message, waiting for the rate limit of the channel first.
+        :param text: Text to send
+        """
+
+        if self.limiter is not None:
+
+            channel = getattr(self.destination, 'channel', self.destination)
+
+            await self.limiter.acquire(channel.id)
+
+        # Discord doesn't allow empty messages:
+
+        await self.destination.send(text if text.strip() else '​')
+
+        self.sent = self.sent + 1
+
+    async def __aenter__(self):
+
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+
+        # Sending what we have even if the command failed, so the output so far isn't lost:
+
+        await self.flush()
@@ -0,0 +1,254 @@
+import asyncio
+from collections import deque, OrderedDict
+
+"""
+This file will contain the insult pool for DIS.
+
+Generating an insult is quick, but under a burst of messages(raids, mass mentions) the work adds up on the event loop.
+The pool keeps insults ready made, so replies only have to take one off the front of a queue.
+
+Insults are pooled for each set of settings(vulgar, number of chains and limit),
+without the start of the insult, as that contains the name of whoever is being insulted.
+The number of chains is capped, and only so many sets of settings are pooled, dropping the least recently used.
+A background task refills each pool once it drops below a low water mark, a few insults at a time,
+so refilling never holds up the event loop for long.
+
+Pooled insults are thrown away if the wordlist changes, so removed words are never used.
+"""
+
+
+class _PoolEntry:
+
+    """
+    Ready made insults for one set of settings, along with the wordlist they were made from.
+    """
+
+    __slots__ = ('stores', 'versions', 'bodies', 'filling')
+
+    def __init__(self):
+
+        self.stores = None  # Flat and chain stores the insults were made from
+        self.versions = None  # Versions of the stores when the insults were made
+        self.bodies = deque()  # Insults without their start, oldest first
+        self.filling = True  # Value determining if we are refilling up to the full size
+
+
+class InsultPool:
+
+    """
+    Keeps pools of ready made insults, and refills them in the background.
+    """
+
+    def __init__(self, gen, size=100, low=25, rate=50, interval=0.5, max_chains=100, max_pools=64):
+
+        self.gen = gen  # InsultGen used to make the insults
+        self.size = size  # Number of insults we fill each pool up to
+        self.low = low  # Number of insults a pool can drop to before we refill it
+        self.rate = rate  # Maximum number of insults made on each refill
+        self.interval = interval  # Seconds between each refill
+        self.max_chains = max_chains  # Maximum number of chains an insult can have, more are capped to this
+        self.max_pools = max_pools  # Maximum number of sets of settings we pool
+        self.pools = OrderedDict()  # Dictionary mapping (vulgar, chains, limit) to pool entries, oldest first
+        self.task = None  # Task running the refills
+        self.hits = 0  # Number of insults taken from a pool
+        self.misses = 0  # Number of insults we had to generate on demand
+
+    def get(self, num, start=None, vulgar=False, limit=None, channel=None):
+
+        """
+        Gets an insult, taking it from the pool if we have one ready.
+        Settings we haven't seen before start being pooled, so later calls can use them.
+        Arguments are the same as InsultGen.gen_insult(), apart from the number of chains being capped.
+        Pooled insults are made without the sampler, so the channel is only used when we generate on demand.
+        :return: Insult in string format
+        """
+
+        start = (str(start) if start is not None else self.gen.start)
+        num = min(num, self.max_chains)
+        key = (vulgar, num, limit)
+        entry = self.pools.get(key)
+
+        if entry is None:
+
+            # New settings, the refill task will start pooling them:
+
+            self.pools[key] = _PoolEntry()
+
+            if len(self.pools) > self.max_pools:
+
+                # Too many settings, stop pooling the least recently used:
+
+                self.pools.popitem(last=False)
+
+        else:
+
+            self.pools.move_to_end(key)
+
+            if entry.bodies and self._fresh(entry, vulgar):
+
+                body = entry.bodies.popleft()
+
+                if limit is None or len(start) + 1 + len(body) < limit:
+
+                    # Insult still fits once the start is added:
+
+                    self.hits = self.hits + 1
+
+                    return start + ' ' + body
+
+        self.misses = self.misses + 1
+
+        return self.gen.gen_insult(num, start=start, vulgar=vulgar, limit=limit, channel=channel)
+
+    def _fresh(self, entry, vulgar):
+
+        """
+        Checks if the insults in a pool were made from the current wordlist.
+        :param entry: Pool entry to check
+        :param vulgar: Value determining if the pool uses vulgar words
+        :return: True if the wordlist hasn't changed
+        """
+
+        collec = (self.gen.insults if vulgar else self.gen.safe_insult)
+
+        return (entry.stores is not None and entry.stores[0] is collec['flat'] and entry.stores[1] is collec['chain']
+                and entry.versions == (collec['flat'].version, collec['chain'].version))
+
+    def refill(self):
+
+        """
+        Refills any pools that have dropped below the low water mark.
+        Pools are refilled up to the full size, no more than the rate in each call.
+        """
+
+        budget = self.rate
+        failed = []
+
+        for key, entry in self.pools.items():
+
+            vulgar, num, limit = key
+
+            if not self._fresh(entry, vulgar):
+
+                # Wordlist has changed, throw away the old insults:
+
+                collec = (self.gen.insults if vulgar else self.gen.safe_insult)
+
+                entry.stores = (collec['flat'], collec['chain'])
+                entry.versions = (collec['flat'].version, collec['chain'].version)
+                entry.bodies.clear()
+                entry.filling = True
+
+            if len(entry.bodies) < self.low:
+
+                entry.filling = True
+
+            if len(entry.bodies) >= self.size:
+
+                entry.filling = False
+
+            if not entry.filling:
+
+                continue
+
+            if budget <= 0:
+
+                # Out of budget, the rest will be refilled next time:
+
+                break
+
+            count = min(self.size - len(entry.bodies), budget)
+
+            try:
+
+                made = self.gen.gen_insults(count, num, start='', vulgar=vulgar, limit=limit)
+
+            except IndexError:
+
+                # Not enough words for these settings:
+
+                continue
+
+            except Exception as e:
+
+                # Unable to make insults for these settings, stop pooling them:
+
+                print("Unable to refill pool {}: {}".format(key, e))
+
+                failed.append(key)
+
+                continue
+
+            if not made:
+
+                # Wordlist is empty:
+
+                continue
+
+            # Start is empty, so remove the space that joined it:
+
+            entry.bodies.extend(text[1:] for text in made)
+            budget = budget - count
+
+        for key in failed:
+
+            del self.pools[key]
+
+    def hit_rate(self):
+
+        """
+        Gets the fraction of insults taken from a pool.
+        :return: Hit rate between 0 and 1, None if no insults have been requested
+        """
+
+        total = self.hits + self.misses
+
+        return (self.hits / total if total else None)
+
+    def start(self):
+
+        """
+        Starts refilling the pools in the background.
+        Must be called from a running event loop.
+        Does nothing if we are already refilling.
+        """
+
+        if self.task is not None and not self.task.done():
+
+            # Already refilling, do nothing
+
+            return
+
+        self.task = asyncio.ensure_future(self._refill())
+
+    def stop(self):
+
+        """
+        Stops refilling the pools.
+        """
+
+        if self.task is not None:
+
+            self.task.cancel()
+
+        self.task = None
+
+    async def _refill(self):
+
+        """
+        Refills the pools until we are stopped.
+        """
+
+        while True:
+
+            await asyncio.sleep(self.interval)
+
+            try:
+
+                self.refill()
+
+            except Exception as e:
+
+                # Keep refilling, a failed refill shouldn't stop the pool for good:
+
+                print("Unable to refill pools: {}".format(e))
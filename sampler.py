@@ -0,0 +1,297 @@
+import random
+import weakref
+from array import array
+from collections import OrderedDict, deque
+
+try:
+
+    import numpy
+
+except ImportError:
+
+    # NumPy is optional, we fall back to the random module without it:
+
+    numpy = None
+
+"""
+This file will contain the samplers DIS can use to pick words without repeating itself.
+
+Picking words with random.choice() means the same words come up again and again in busy channels.
+Samplers remember what has been picked recently, and avoid picking it again.
+
+Shuffle bag - Words are drawn without replacement, so every word is used once before any word is used again.
+Recent window - Words picked in the last few draws are skipped.
+
+A shuffle bag would use every word equally, so wordlists with weighted words always use a recent window,
+drawing each word in proportion to its weight, and skipping it if it was drawn recently.
+
+Each channel gets its own state, so one busy channel doesn't use up the words for everyone else.
+States are kept in a least recently used order, and the oldest are dropped when we have too many.
+
+Weighted words are picked with an alias table(Vose's method),
+which takes linear time to build, but only a single random number to draw from.
+"""
+
+
+class AliasTable:
+
+    """
+    Draws indexes in proportion to their weights, in constant time.
+    Each index gets a slot, holding the chance of keeping the index, and another index to use otherwise.
+    """
+
+    __slots__ = ('prob', 'alias', 'size')
+
+    def __init__(self, weights):
+
+        weights = list(weights)
+
+        self.size = len(weights)  # Number of indexes
+        self.prob = array('d', bytes(8 * self.size))  # Chance of keeping the index of each slot
+        self.alias = array('L', bytes(array('L').itemsize * self.size))  # Index to use if we don't keep the slot
+
+        total = sum(weights)
+
+        if self.size == 0 or total <= 0:
+
+            return
+
+        # Scaling the weights so the average is 1, and sorting them into slots above and below it:
+
+        scaled = [weight * self.size / total for weight in weights]
+        small = [num for num, weight in enumerate(scaled) if weight < 1]
+        large = [num for num, weight in enumerate(scaled) if weight >= 1]
+
+        while small and large:
+
+            # Fill the rest of a small slot with a large one:
+
+            less = small.pop()
+            more = large.pop()
+
+            self.prob[less] = scaled[less]
+            self.alias[less] = more
+
+            scaled[more] = scaled[more] + scaled[less] - 1
+
+            if scaled[more] < 1:
+
+                small.append(more)
+
+            else:
+
+                large.append(more)
+
+        # Anything left over is full, apart from rounding errors:
+
+        for num in large + small:
+
+            self.prob[num] = 1
+
+    def draw(self):
+
+        """
+        Draws an index.
+        The whole part of a random number picks the slot, and the fraction decides if we keep it.
+        :return: Index, picked in proportion to its weight
+        """
+
+        num = random.random() * self.size
+        index = int(num)
+
+        return (index if num - index < self.prob[index] else self.alias[index])
+
+    def draw_many(self, count):
+
+        """
+        Draws many indexes at once.
+        Uses NumPy if it is available.
+        :param count: Number of indexes to draw
+        :return: List of indexes
+        """
+
+        if numpy is None:
+
+            draw = self.draw
+
+            return [draw() for _ in range(count)]
+
+        num = numpy.random.random(count) * self.size
+        index = num.astype(numpy.int64)
+        prob = numpy.frombuffer(self.prob, dtype=numpy.float64)
+        alias = numpy.frombuffer(self.alias, dtype=numpy.dtype(self.alias.typecode))
+
+        return numpy.where(num - index < prob[index], index, alias[index]).tolist()
+
+
+class ShuffleBag:
+
+    """
+    Draws indexes from a collection without replacement, starting again once every index has been drawn.
+    The shuffle is done lazily, only remembering the positions that have been swapped,
+    so each draw is constant time and memory only grows with the number of draws.
+    """
+
+    __slots__ = ('size', 'drawn', 'swaps')
+
+    def __init__(self, size):
+
+        self.size = size  # Size of the collection
+        self.drawn = 0  # Number of indexes drawn since the last reset
+        self.swaps = {}  # Dictionary mapping shuffled positions to the index now in them
+
+    def draw(self):
+
+        """
+        Draws the next index.
+        :return: Index that hasn't been drawn since the last reset
+        """
+
+        if self.drawn >= self.size:
+
+            # Every index has been drawn, start again:
+
+            self.drawn = 0
+            self.swaps = {}
+
+        # Pick a position from the ones we haven't drawn, and swap it with the next position:
+
+        pos = self.drawn + int(random.random() * (self.size - self.drawn))
+        index = self.swaps.get(pos, pos)
+
+        self.swaps[pos] = self.swaps.pop(self.drawn, self.drawn)
+        self.drawn = self.drawn + 1
+
+        return index
+
+
+class RecentWindow:
+
+    """
+    Draws indexes from a collection at random, skipping any index drawn in the last few draws.
+    """
+
+    __slots__ = ('size', 'recent', 'seen')
+
+    TRIES = 10  # Number of weighted draws we try before taking an index in the window
+
+    def __init__(self, size, window):
+
+        self.size = size  # Size of the collection
+        self.recent = deque(maxlen=min(window, size - 1) if size > 1 else 0)  # Most recent indexes, oldest first
+        self.seen = set()  # Set of the indexes in the window
+
+    def draw(self, pick=None):
+
+        """
+        Draws the next index.
+        The window is never more than half the collection, so we expect to need at most two tries.
+        Weighted draws can keep landing on heavy words in the window, so we give up on skipping them after a few tries.
+        :param pick: Function drawing an index in proportion to the weights, None to draw every index equally
+        :return: Index that isn't in the window
+        """
+
+        tries = 0
+
+        while True:
+
+            index = (pick() if pick is not None else int(random.random() * self.size))
+            tries = tries + 1
+
+            if index not in self.seen or (pick is not None and tries >= self.TRIES):
+
+                break
+
+        if self.recent.maxlen:
+
+            if len(self.recent) == self.recent.maxlen:
+
+                # Window is full, forget the oldest index:
+
+                self.seen.discard(self.recent[0])
+
+            self.recent.append(index)
+            self.seen.add(index)
+
+        return index
+
+
+class InsultSampler:
+
+    """
+    Keeps a sampler state for each channel, and draws words with it.
+    States are thrown away if the wordlist they were made for changes.
+    Stores are only referenced weakly, so a state never keeps an old wordlist alive after a reload.
+    """
+
+    BAG = 'bag'
+    WINDOW = 'window'
+
+    def __init__(self, mode='bag', window=20, max_states=1000):
+
+        self.mode = mode  # Type of sampler to use, 'bag' or 'window'
+        self.window = window  # Number of recent draws to skip, for the recent window sampler
+        self.max_states = max_states  # Maximum number of states we keep
+        self.states = OrderedDict()  # Keys mapped to [weak store, version, state], least recently used first
+
+    def _new_state(self, size, weighted=False):
+
+        """
+        Creates a new sampler state.
+        :param size: Size of the collection
+        :param weighted: Value determining if the collection has weighted words, which always use a recent window
+        :return: New sampler state
+        """
+
+        if self.mode == self.WINDOW or weighted:
+
+            # Never skip more than half the words, so draws stay fast:
+
+            return RecentWindow(size, min(self.window, size // 2))
+
+        return ShuffleBag(size)
+
+    def draw(self, key, store):
+
+        """
+        Draws an index from a store, using the state for a key.
+        Stores with weighted words are drawn from in proportion to their weights.
+        :param key: Key of the state to use, such as (channel, vulgar, word type)
+        :param store: Store to draw from
+        :return: Index of the word
+        """
+
+        entry = self.states.get(key)
+        weighted = store.weighted()
+
+        if entry is None or entry[0]() is not store or entry[1] != store.version:
+
+            # No state yet, or the wordlist has changed(or been thrown away), make a new one:
+
+            entry = [weakref.ref(store), store.version, self._new_state(len(store), weighted)]
+
+            self.states[key] = entry
+
+            if len(self.states) > self.max_states:
+
+                # Too many states, drop the one that was used least recently:
+
+                self.states.popitem(last=False)
+
+        else:
+
+            self.states.move_to_end(key)
+
+        if weighted:
+
+            return entry[2].draw(store.draw)
+
+        return entry[2].draw()
+
+    def clear(self):
+
+        """
+        Throws away every state.
+        """
+
+        self.states = OrderedDict()
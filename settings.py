@@ -0,0 +1,327 @@
+import asyncio
+import json
+import os
+from threading import Lock
+
+"""
+This file will contain the settings store for DIS.
+
+Settings can be set for a whole guild, or for a single channel, with channel settings taking priority.
+Anything that isn't set uses the default value.
+
+Every setting is held in memory, and the settings for each channel are worked out once and kept,
+so looking them up when generating an insult is a single dictionary access.
+
+Changes are written to a JSON lines file in the background(write-behind),
+so commands never wait on the disk, and many changes are written at once.
+Each line holds every setting of a guild or channel, and later lines replace earlier ones.
+The file is compacted down to one line for each guild and channel when it is loaded.
+"""
+
+# Default value of each setting:
+
+DEFAULTS = {'vulgar': True, 'chain': 3, 'limit': 2000, 'start': 'is a'}
+
+# Largest value of each number setting, messages can't be longer than 2000 characters:
+
+MAXIMUMS = {'chain': 100, 'limit': 2000}
+
+# Scopes settings can be set at, in order of priority:
+
+SCOPES = ('channel', 'guild')
+
+
+class SettingsStore:
+
+    """
+    Holds the settings of each guild and channel, and writes any changes to a file in the background.
+    """
+
+    def __init__(self, path='settings.jsonl', interval=5.0):
+
+        self.path = path  # Path to the settings file
+        self.interval = interval  # Seconds between each write of the changes
+        self.scopes = {}  # Dictionary mapping (scope, ID) to a dictionary of the settings set there
+        self.resolved = {}  # Dictionary mapping (guild ID, channel ID) to the settings in use there
+        self.dirty = set()  # Set of (scope, ID) with changes that haven't been written
+        self.task = None  # Task writing the changes
+        self.writes = 0  # Number of times changes have been written
+        self._lock = Lock()  # Lock for the changes, as they are written in a thread
+
+        self.load()
+
+    def get(self, guild, channel):
+
+        """
+        Gets the settings in use in a channel.
+        :param guild: ID of the guild, None for direct messages
+        :param channel: ID of the channel
+        :return: Dictionary of settings, must not be changed
+        """
+
+        final = self.resolved.get((guild, channel))
+
+        if final is None:
+
+            # Work out the settings, and keep them for next time:
+
+            final = dict(DEFAULTS)
+
+            final.update(self.scopes.get(('guild', guild), {}))
+            final.update(self.scopes.get(('channel', channel), {}))
+
+            self.resolved[(guild, channel)] = final
+
+        return final
+
+    def set(self, scope, ident, key, value):
+
+        """
+        Changes a setting.
+        The change is used straight away, and written to the file later.
+        :param scope: Scope to set the setting at, 'guild' or 'channel'
+        :param ident: ID of the guild or channel
+        :param key: Name of the setting
+        :param value: Value of the setting, None to go back to the default
+        :raises ValueError: If the scope or setting is unknown
+        """
+
+        if scope not in SCOPES:
+
+            raise ValueError("Unknown scope [{}]! Must be one of: {}".format(scope, ', '.join(SCOPES)))
+
+        if key not in DEFAULTS:
+
+            raise ValueError("Unknown setting [{}]! Must be one of: {}".format(key, ', '.join(DEFAULTS)))
+
+        with self._lock:
+
+            settings = self.scopes.setdefault((scope, ident), {})
+
+            if value is None:
+
+                settings.pop(key, None)
+
+            else:
+
+                settings[key] = value
+
+            # An empty entry is still written, so removals are saved:
+
+            self.dirty.add((scope, ident))
+
+        # Settings in use may have changed, work them out again when they are next needed:
+
+        self.resolved = {}
+
+    def parse_value(self, key, text):
+
+        """
+        Converts text supplied by a user into a value for a setting.
+        :param key: Name of the setting
+        :param text: Text to convert
+        :return: Value of the setting
+        :raises ValueError: If the text is not valid for the setting
+        """
+
+        if key not in DEFAULTS:
+
+            raise ValueError("Unknown setting [{}]! Must be one of: {}".format(key, ', '.join(DEFAULTS)))
+
+        default = DEFAULTS[key]
+
+        if isinstance(default, bool):
+
+            if text.lower() in ('true', 'yes', 'on', 'enable', 'enabled', '1'):
+
+                return True
+
+            if text.lower() in ('false', 'no', 'off', 'disable', 'disabled', '0'):
+
+                return False
+
+            raise ValueError("Setting [{}] must be true or false!".format(key))
+
+        if isinstance(default, int):
+
+            try:
+
+                value = int(text)
+
+            except ValueError:
+
+                raise ValueError("Setting [{}] must be a number!".format(key))
+
+            if value < 1:
+
+                raise ValueError("Setting [{}] must be at least 1!".format(key))
+
+            if value > MAXIMUMS.get(key, value):
+
+                raise ValueError("Setting [{}] can't be more than {}!".format(key, MAXIMUMS[key]))
+
+            return value
+
+        return text
+
+    def load(self):
+
+        """
+        Loads the settings file, and compacts it.
+        Lines that can't be read(such as a line cut short by a crash) are skipped.
+        """
+
+        scopes = {}
+        lines = 0
+
+        try:
+
+            with open(self.path, mode='r') as file:
+
+                for line in file:
+
+                    lines = lines + 1
+
+                    try:
+
+                        record = json.loads(line)
+
+                        scopes[(record['scope'], record['id'])] = record['settings']
+
+                    except (ValueError, KeyError, TypeError):
+
+                        # Bad line, skip it:
+
+                        continue
+
+        except OSError:
+
+            # No settings file yet, use the defaults:
+
+            pass
+
+        # Removing scopes with nothing set:
+
+        self.scopes = {key: value for key, value in scopes.items() if value}
+        self.resolved = {}
+
+        if lines > len(self.scopes):
+
+            # File has old lines, compact it:
+
+            self._write(self.scopes, compact=True)
+
+    def flush(self):
+
+        """
+        Writes any changes to the settings file.
+        Safe to call from a thread.
+        """
+
+        with self._lock:
+
+            if not self.dirty:
+
+                return
+
+            # Taking a copy of the changes, so they can keep changing while we write:
+
+            changes = {key: dict(self.scopes.get(key, {})) for key in self.dirty}
+
+            self.dirty = set()
+
+        if not self._write(changes):
+
+            with self._lock:
+
+                # Unable to write, try again next time:
+
+                self.dirty.update(changes)
+
+    def _write(self, changes, compact=False):
+
+        """
+        Writes settings to the settings file.
+        :param changes: Dictionary mapping (scope, ID) to settings
+        :param compact: Value determining if we should replace the file, rather than add to it
+        :return: True if the settings were written
+        """
+
+        lines = ''.join(json.dumps({'scope': scope, 'id': ident, 'settings': settings}) + '\n'
+                        for (scope, ident), settings in changes.items())
+
+        try:
+
+            if compact:
+
+                # Writing to a temporary file first, so the settings are never left half written:
+
+                temp = self.path + '.tmp'
+
+                with open(temp, mode='w') as file:
+
+                    file.write(lines)
+
+                os.replace(temp, self.path)
+
+            else:
+
+                with open(self.path, mode='a') as file:
+
+                    file.write(lines)
+
+        except OSError as e:
+
+            # Unable to write the settings, keep them in memory:
+
+            print("Unable to write settings [{}]: {}".format(self.path, e))
+
+            return False
+
+        self.writes = self.writes + 1
+
+        return True
+
+    def start(self):
+
+        """
+        Starts writing changes in the background.
+        Must be called from a running event loop.
+        Does nothing if we are already writing.
+        """
+
+        if self.task is not None and not self.task.done():
+
+            # Already writing, do nothing
+
+            return
+
+        self.task = asyncio.ensure_future(self._flush())
+
+    def stop(self):
+
+        """
+        Stops writing changes in the background, and writes any that are left.
+        """
+
+        if self.task is not None:
+
+            self.task.cancel()
+
+        self.task = None
+
+        self.flush()
+
+    async def _flush(self):
+
+        """
+        Writes changes until we are stopped.
+        """
+
+        while True:
+
+            await asyncio.sleep(self.interval)
+
+            # Writing in a thread, so the event loop is never held up by the disk:
+
+            await asyncio.get_event_loop().run_in_executor(None, self.flush)
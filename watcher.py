@@ -0,0 +1,127 @@
+import asyncio
+import os
+
+"""
+This file will contain the file watcher for DIS.
+
+The watcher checks the insult configuration file for changes,
+and reloads the wordlist when it does, so users don't have to run the reload command by hand.
+
+We poll the modification time and size of the file, as this works everywhere without any extra libraries.
+Editors can save a file several times in quick succession,
+so we wait until the file has stopped changing before we reload it.
+The reload runs in a thread, so the event loop is never blocked by a large wordlist.
+"""
+
+
+class ConfigWatcher:
+
+    """
+    Watches a file for changes, and calls a function once it has stopped changing.
+    """
+
+    def __init__(self, path, callback, interval=1.0, delay=2.0):
+
+        self.path = path  # Path to the file we are watching
+        self.callback = callback  # Function to call when the file changes, called in a thread
+        self.interval = interval  # Seconds between each check of the file
+        self.delay = delay  # Seconds the file must stay unchanged before we call the function
+        self.task = None  # Task running the watcher
+        self.reloads = 0  # Number of times the function has been called
+
+    def _stat(self):
+
+        """
+        Gets the current state of the file.
+        :return: Tuple of modification time and size, None if the file is missing
+        """
+
+        try:
+
+            stat = os.stat(self.path)
+
+        except OSError:
+
+            return None
+
+        return stat.st_mtime_ns, stat.st_size
+
+    def start(self):
+
+        """
+        Starts watching the file.
+        Must be called from a running event loop.
+        Does nothing if we are already watching.
+        """
+
+        if self.task is not None and not self.task.done():
+
+            # Already watching, do nothing
+
+            return
+
+        self.task = asyncio.ensure_future(self._watch())
+
+    def stop(self):
+
+        """
+        Stops watching the file.
+        """
+
+        if self.task is not None:
+
+            self.task.cancel()
+
+        self.task = None
+
+    async def _watch(self):
+
+        """
+        Checks the file for changes until we are stopped.
+        """
+
+        last = self._stat()
+
+        while True:
+
+            await asyncio.sleep(self.interval)
+
+            state = self._stat()
+
+            if state == last or state is None:
+
+                # File is unchanged, or in the middle of being replaced:
+
+                continue
+
+            # File has changed, wait for it to stop changing:
+
+            while True:
+
+                await asyncio.sleep(self.delay)
+
+                new = self._stat()
+
+                if new == state:
+
+                    break
+
+                state = new
+
+            last = state
+
+            # Calling the function in a thread, so we don't block the event loop:
+
+            try:
+
+                await asyncio.get_event_loop().run_in_executor(None, self.callback)
+
+            except Exception as e:
+
+                # Bad edit to the file, keep the old wordlist and keep watching:
+
+                print("Unable to reload [{}]: {}".format(self.path, e))
+
+                continue
+
+            self.reloads = self.reloads + 1
@@ -0,0 +1,2118 @@
+"""
+This file will contain the data structures DIS uses to hold its wordlists.
+
+Wordlists can get quite large once DIS notation has been expanded,
+so we want adding, removing and checking words to be cheap no matter how many we have.
+
+WordStore keeps the words in a list, so they can be accessed by index(random.choice() works on it),
+and keeps a dictionary mapping each word to its index, so membership checks and removals don't scan the list.
+The length of each word is also kept in an array, so insults can be planned without building any strings.
+Words can be given a weight, making them more likely to be picked by draw().
+Weights are only stored once a word has one, so unweighted wordlists cost nothing extra.
+
+Removals are done by swapping the last word into the removed slot.
+This means the order is insertion order until something is removed.
+
+TemplateStore holds lines of DIS notation without expanding them,
+and decodes values by index when they are requested.
+
+WordIndex is a search index over a WordStore, used to find words without scanning the whole store.
+
+OverlayStore shares a WordStore by reference, and only keeps the words added to it and removed from it.
+This lets many wordlists be made from the same base, without copying it.
+
+MappedStore is a read only store over a section of a memory mapped word file(see fileutils.WordFile),
+which only decodes the words that are accessed.
+
+TrieStore keeps its words sorted and front coded in blocks, so shared prefixes are only kept once,
+and can find the words starting with some text without a search index.
+"""
+
+from array import array
+from bisect import bisect_left, bisect_right, insort
+from itertools import islice
+from random import random
+from sampler import AliasTable
+
+# Number of words in each block of a TrieStore, blocks are split in half once they are twice as big:
+
+BLOCK = 32
+
+
+class WordStore:
+
+    """
+    An insertion ordered collection of unique words,
+    with constant time add, remove, membership and index lookups.
+    """
+
+    def __init__(self, words=None):
+
+        self._words = []  # List of words, addressable by index
+        self._lengths = array('I')  # Length of each word, in the same order as the list
+        self._index = {}  # Dictionary mapping words to their index in the list
+        self._weights = None  # Weight of each word, None if every word has a weight of 1
+        self._alias = None  # Version and AliasTable of the weights, rebuilt on the next draw once the words change
+        self.version = 0  # Incremented every time the words change
+
+        if words is not None:
+
+            # Add the initial words:
+
+            self.extend(words)
+
+    def add(self, word, weight=1):
+
+        """
+        Adds a word to the store.
+        :param word: Word to add
+        :param weight: Weight of the word, how likely it is to be drawn
+        :return: True if the word was added, False if it was already present
+        """
+
+        if word in self._index:
+
+            # Already have the word registered, do nothing
+
+            return False
+
+        if weight != 1 and self._weights is None:
+
+            # First weighted word, start keeping weights:
+
+            self._weights = array('L', [1]) * len(self._words)
+
+        self._index[word] = len(self._words)
+        self._words.append(word)
+        self._lengths.append(len(word))
+        self.version = self.version + 1
+
+        if self._weights is not None:
+
+            self._weights.append(weight)
+
+        return True
+
+    def extend(self, words):
+
+        """
+        Adds multiple words to the store.
+        :param words: Iterable of words to add
+        """
+
+        # Same as add(), but with everything looked up once, as this is used for bulk loading:
+
+        index = self._index
+        final = self._words
+        lengths = self._lengths
+
+        for word in words:
+
+            if word in index:
+
+                continue
+
+            index[word] = len(final)
+            final.append(word)
+            lengths.append(len(word))
+
+        if self._weights is not None:
+
+            # New words have a weight of 1:
+
+            self._weights.extend(array('L', [1]) * (len(final) - len(self._weights)))
+
+        self.version = self.version + 1
+
+    def extend_weighted(self, words):
+
+        """
+        Adds multiple words to the store, along with their weights.
+        :param words: Iterable of (word, weight) pairs to add
+        """
+
+        # Same as add(), but with everything looked up once, as this is used for bulk loading and imports:
+
+        index = self._index
+        final = self._words
+        lengths = self._lengths
+        weights = self._weights
+
+        for word, weight in words:
+
+            if word in index:
+
+                continue
+
+            if weight != 1 and weights is None:
+
+                # First weighted word, start keeping weights:
+
+                weights = self._weights = array('L', [1]) * len(final)
+
+            index[word] = len(final)
+            final.append(word)
+            lengths.append(len(word))
+
+            if weights is not None:
+
+                weights.append(weight)
+
+        self.version = self.version + 1
+
+    def remove(self, word):
+
+        """
+        Removes a word from the store.
+        The last word is moved into the slot of the removed word.
+        :param word: Word to remove
+        :raises ValueError: If the word is not in the store
+        """
+
+        try:
+
+            index = self._index.pop(word)
+
+        except KeyError:
+
+            raise ValueError("Word [{}] is not in the store!".format(word))
+
+        self.version = self.version + 1
+        last = self._words.pop()
+        size = self._lengths.pop()
+        weight = (self._weights.pop() if self._weights is not None else 1)
+
+        if index < len(self._words):
+
+            # Move the last word into the empty slot:
+
+            self._words[index] = last
+            self._lengths[index] = size
+            self._index[last] = index
+
+            if self._weights is not None:
+
+                self._weights[index] = weight
+
+    def discard(self, word):
+
+        """
+        Removes a word from the store, if it is present.
+        :param word: Word to remove
+        :return: True if the word was removed, False if it was not present
+        """
+
+        if word not in self._index:
+
+            return False
+
+        self.remove(word)
+
+        return True
+
+    def index(self, word):
+
+        """
+        Gets the current index of a word.
+        :param word: Word to find
+        :return: Index of the word
+        :raises ValueError: If the word is not in the store
+        """
+
+        try:
+
+            return self._index[word]
+
+        except KeyError:
+
+            raise ValueError("Word [{}] is not in the store!".format(word))
+
+    def clear(self):
+
+        """
+        Removes all words from the store.
+        """
+
+        self._words = []
+        self._lengths = array('I')
+        self._index = {}
+        self._weights = None
+        self._alias = None
+        self.version = self.version + 1
+
+    def length(self, index):
+
+        """
+        Gets the length of the word at an index, without touching the word itself.
+        :param index: Index of the word
+        :return: Length of the word
+        """
+
+        return self._lengths[index]
+
+    def weight(self, index):
+
+        """
+        Gets the weight of the word at an index.
+        :param index: Index of the word
+        :return: Weight of the word
+        """
+
+        return (self._weights[index] if self._weights is not None else 1)
+
+    def weighted(self):
+
+        """
+        Checks if any word has been given a weight.
+        :return: True if words must be drawn with draw() to respect their weights
+        """
+
+        return self._weights is not None
+
+    def alias(self):
+
+        """
+        Gets the alias table of the weights, building it if the words have changed since it was last built.
+        :return: AliasTable of the weights
+        """
+
+        if self._alias is None or self._alias[0] != self.version:
+
+            self._alias = (self.version, AliasTable(self._weights if self._weights is not None else
+                                                    array('L', [1]) * len(self._words)))
+
+        return self._alias[1]
+
+    def draw(self):
+
+        """
+        Draws the index of a word at random, in proportion to the weights.
+        Unweighted stores are drawn from uniformly, without building an alias table.
+        :return: Index of the word
+        """
+
+        if self._weights is None:
+
+            return int(random() * len(self._words))
+
+        return self.alias().draw()
+
+    def draw_many(self, count):
+
+        """
+        Draws many indexes at random, in proportion to the weights.
+        :param count: Number of indexes to draw
+        :return: List of indexes
+        """
+
+        return self.alias().draw_many(count)
+
+    def copy(self):
+
+        """
+        Creates a shallow copy of this store.
+        :return: New WordStore with the same words, in the same order
+        """
+
+        new = WordStore()
+
+        new._words = list(self._words)
+        new._lengths = array('I', self._lengths)
+        new._index = dict(self._index)
+        new._weights = (array('L', self._weights) if self._weights is not None else None)
+
+        return new
+
+    def __contains__(self, word):
+
+        return word in self._index
+
+    def __len__(self):
+
+        return len(self._words)
+
+    def __getitem__(self, index):
+
+        return self._words[index]
+
+    def __iter__(self):
+
+        return iter(self._words)
+
+    def __eq__(self, other):
+
+        if isinstance(other, WordStore):
+
+            return self._words == other._words
+
+        return self._words == other
+
+    def __repr__(self):
+
+        return 'WordStore({!r})'.format(self._words)
+
+
+class OverlayStore:
+
+    """
+    A WordStore made of a shared base store, and the changes made on top of it(copy-on-write).
+    The base is never changed, words added are kept in a store of their own,
+    and words removed from the base are remembered, along with their position in it.
+
+    Indexes run over the base words that haven't been removed, in base order, followed by the added words.
+    Mapping an index to a base word is a binary search over the removed positions,
+    so it stays cheap as long as only a few base words are removed.
+    """
+
+    def __init__(self, base):
+
+        self.base = base  # Store we are sharing, never changed by us
+        self.added = WordStore()  # Words added on top of the base
+        self.removed = set()  # Base words that have been removed
+        self._holes = []  # Sorted positions of the removed words in the base
+        self.shared = True  # Value determining if we still share the base, False once we have been cleared
+        self._alias = None  # Version and AliasTable of the weights, rebuilt on the next draw once the words change
+        self.version = 0  # Incremented every time the words change
+
+    def _live(self):
+
+        """
+        Gets the number of base words that haven't been removed.
+        :return: Number of base words
+        """
+
+        return len(self.base) - len(self._holes)
+
+    def _base_index(self, index):
+
+        """
+        Maps an index to the position of the word in the base, skipping the removed words.
+        :param index: Index under the number of live base words
+        :return: Position in the base
+        """
+
+        holes = self._holes
+        low = 0
+        high = len(holes)
+
+        # Finding the number of removed positions before the word:
+
+        while low < high:
+
+            mid = (low + high) // 2
+
+            if holes[mid] - mid <= index:
+
+                low = mid + 1
+
+            else:
+
+                high = mid
+
+        return index + low
+
+    def _locate(self, index):
+
+        """
+        Finds the store an index falls in, and the index within it.
+        :param index: Index of the word, negative values count from the end
+        :return: Store and index within it
+        """
+
+        if index < 0:
+
+            index = index + len(self)
+
+        live = self._live()
+
+        if index < live:
+
+            return self.base, self._base_index(index)
+
+        return self.added, index - live
+
+    def dirty(self):
+
+        """
+        Checks if any changes have been made on top of the base.
+        :return: True if words have been added or removed
+        """
+
+        return bool(self.added) or bool(self.removed) or not self.shared
+
+    def add(self, word, weight=1):
+
+        """
+        Adds a word to the store.
+        Base words that were removed are restored, with their base weight.
+        :param word: Word to add
+        :param weight: Weight of the word, how likely it is to be drawn
+        :return: True if the word was added, False if it was already present
+        """
+
+        if word in self.removed:
+
+            # Restore the base word:
+
+            self.removed.discard(word)
+            self._holes.pop(bisect_left(self._holes, self.base.index(word)))
+
+        elif word in self.base or not self.added.add(word, weight):
+
+            # Already have the word registered, do nothing
+
+            return False
+
+        self.version = self.version + 1
+
+        return True
+
+    def extend(self, words):
+
+        """
+        Adds multiple words to the store.
+        :param words: Iterable of words to add
+        """
+
+        for word in words:
+
+            self.add(word)
+
+    def extend_weighted(self, words):
+
+        """
+        Adds multiple words to the store, along with their weights.
+        :param words: Iterable of (word, weight) pairs to add
+        """
+
+        for word, weight in words:
+
+            self.add(word, weight)
+
+    def remove(self, word):
+
+        """
+        Removes a word from the store.
+        Base words are only hidden, the base itself is not changed.
+        :param word: Word to remove
+        :raises ValueError: If the word is not in the store
+        """
+
+        if word in self.added:
+
+            self.added.remove(word)
+
+        elif word in self.base and word not in self.removed:
+
+            self.removed.add(word)
+            insort(self._holes, self.base.index(word))
+
+        else:
+
+            raise ValueError("Word [{}] is not in the store!".format(word))
+
+        self.version = self.version + 1
+
+    def discard(self, word):
+
+        """
+        Removes a word from the store, if it is present.
+        :param word: Word to remove
+        :return: True if the word was removed, False if it was not present
+        """
+
+        if word not in self:
+
+            return False
+
+        self.remove(word)
+
+        return True
+
+    def index(self, word):
+
+        """
+        Gets the current index of a word.
+        :param word: Word to find
+        :return: Index of the word
+        :raises ValueError: If the word is not in the store
+        """
+
+        if word in self.added:
+
+            return self._live() + self.added.index(word)
+
+        if word not in self.removed:
+
+            position = self.base.index(word)
+
+            return position - bisect_left(self._holes, position)
+
+        raise ValueError("Word [{}] is not in the store!".format(word))
+
+    def clear(self):
+
+        """
+        Removes all words from the store.
+        The base is no longer shared, as none of it is used.
+        """
+
+        self.base = WordStore()
+        self.added = WordStore()
+        self.removed = set()
+        self._holes = []
+        self.shared = False
+        self.version = self.version + 1
+
+    def length(self, index):
+
+        """
+        Gets the length of the word at an index, without touching the word itself.
+        :param index: Index of the word
+        :return: Length of the word
+        """
+
+        store, index = self._locate(index)
+
+        return store.length(index)
+
+    def weight(self, index):
+
+        """
+        Gets the weight of the word at an index.
+        :param index: Index of the word
+        :return: Weight of the word
+        """
+
+        store, index = self._locate(index)
+
+        return store.weight(index)
+
+    def weighted(self):
+
+        """
+        Checks if any word has been given a weight.
+        :return: True if words must be drawn with draw() to respect their weights
+        """
+
+        return self.base.weighted() or self.added.weighted()
+
+    def alias(self):
+
+        """
+        Gets the alias table of the weights, building it if the words have changed since it was last built.
+        :return: AliasTable of the weights
+        """
+
+        if self._alias is None or self._alias[0] != self.version:
+
+            self._alias = (self.version, AliasTable(self.weight(num) for num in range(len(self))))
+
+        return self._alias[1]
+
+    def draw(self):
+
+        """
+        Draws the index of a word at random, in proportion to the weights.
+        :return: Index of the word
+        """
+
+        if not self.weighted():
+
+            return int(random() * len(self))
+
+        return self.alias().draw()
+
+    def draw_many(self, count):
+
+        """
+        Draws many indexes at random, in proportion to the weights.
+        :param count: Number of indexes to draw
+        :return: List of indexes
+        """
+
+        return self.alias().draw_many(count)
+
+    def copy(self):
+
+        """
+        Creates a plain copy of this store, no longer sharing the base.
+        :return: New WordStore with the same words, in the same order
+        """
+
+        new = WordStore()
+
+        new.extend_weighted((word, self.weight(num)) for num, word in enumerate(self))
+
+        return new
+
+    def __contains__(self, word):
+
+        return word in self.added or (word in self.base and word not in self.removed)
+
+    def __len__(self):
+
+        return self._live() + len(self.added)
+
+    def __getitem__(self, index):
+
+        if not -len(self) <= index < len(self):
+
+            raise IndexError("Store only has {} words!".format(len(self)))
+
+        store, index = self._locate(index)
+
+        return store[index]
+
+    def __iter__(self):
+
+        if self.removed:
+
+            # Skip the removed words:
+
+            removed = self.removed
+
+            yield from (word for word in self.base if word not in removed)
+
+        else:
+
+            yield from self.base
+
+        yield from self.added
+
+    def __eq__(self, other):
+
+        return list(self) == list(other)
+
+    def __repr__(self):
+
+        return 'OverlayStore({!r}, added={!r}, removed={!r})'.format(self.base, list(self.added),
+                                                                    sorted(self.removed))
+
+
+class MappedStore:
+
+    """
+    A read only collection of words, kept in a memory mapped word file.
+    Words are only decoded when they are accessed, so the store itself uses almost no memory.
+    A store can hold every word of a section, or only the non-vulgar words.
+
+    Word lengths are the length of the UTF-8 encoding, which is never shorter than the word,
+    so planning an insult by length stays under the limit.
+    Words are looked up with a binary search over the sorted order of the file.
+    """
+
+    def __init__(self, section, safe=False):
+
+        self.section = section  # WordSection of the word file
+        self.safe = safe  # Value determining if we only hold non-vulgar words
+        self._size = (len(section.safe) if safe else section.count)  # Number of words we hold
+        self._alias = None  # AliasTable of the weights, built on the first weighted draw
+        self.version = 0  # Never changes, as the store is read only
+
+    def _position(self, index):
+
+        """
+        Gets the position of a word in the section.
+        :param index: Index of the word, negative values count from the end
+        :return: Position of the word in the section
+        """
+
+        if index < 0:
+
+            index = index + self._size
+
+        if not 0 <= index < self._size:
+
+            raise IndexError("Store only has {} words!".format(self._size))
+
+        return (self.section.safe[index] if self.safe else index)
+
+    def _text(self, position):
+
+        """
+        Decodes the word at a position in the section.
+        :param position: Position of the word
+        :return: Word in string format
+        """
+
+        offsets = self.section.offsets
+
+        return str(self.section.text[offsets[position]:offsets[position + 1]], 'utf-8')
+
+    def _vulgar(self, position):
+
+        """
+        Checks if the word at a position in the section is vulgar.
+        :param position: Position of the word
+        :return: True if the word is vulgar
+        """
+
+        return bool(self.section.vulgar[position >> 3] >> (position & 7) & 1)
+
+    def _find(self, word):
+
+        """
+        Finds the position of a word in the section.
+        :param word: Word to find
+        :return: Position of the word, -1 if it is not in the section
+        """
+
+        order = self.section.order
+        low = 0
+        high = len(order)
+
+        while low < high:
+
+            mid = (low + high) // 2
+
+            if self._text(order[mid]) < word:
+
+                low = mid + 1
+
+            else:
+
+                high = mid
+
+        if low < len(order) and self._text(order[low]) == word:
+
+            return order[low]
+
+        return -1
+
+    def _read_only(self, *args):
+
+        """
+        Stands in for every method that changes the store.
+        :raises ValueError: Always, as the store can't be changed
+        """
+
+        raise ValueError("Mapped wordlists are read only!")
+
+    add = extend = extend_weighted = remove = discard = clear = _read_only
+
+    def index(self, word):
+
+        """
+        Gets the index of a word.
+        :param word: Word to find
+        :return: Index of the word
+        :raises ValueError: If the word is not in the store
+        """
+
+        position = self._find(word)
+
+        if position == -1 or (self.safe and self._vulgar(position)):
+
+            raise ValueError("Word [{}] is not in the store!".format(word))
+
+        return (bisect_left(self.section.safe, position) if self.safe else position)
+
+    def length(self, index):
+
+        """
+        Gets the length of the word at an index, without decoding it.
+        :param index: Index of the word
+        :return: Length of the word in bytes
+        """
+
+        position = self._position(index)
+
+        return self.section.offsets[position + 1] - self.section.offsets[position]
+
+    def weight(self, index):
+
+        """
+        Gets the weight of the word at an index.
+        :param index: Index of the word
+        :return: Weight of the word
+        """
+
+        return (self.section.weights[self._position(index)] if self.section.weights is not None else 1)
+
+    def weighted(self):
+
+        """
+        Checks if any word has been given a weight.
+        :return: True if words must be drawn with draw() to respect their weights
+        """
+
+        return self.section.weights is not None
+
+    def alias(self):
+
+        """
+        Gets the alias table of the weights, building it the first time it is needed.
+        :return: AliasTable of the weights
+        """
+
+        if self._alias is None:
+
+            self._alias = AliasTable(self.weight(num) for num in range(self._size))
+
+        return self._alias
+
+    def draw(self):
+
+        """
+        Draws the index of a word at random, in proportion to the weights.
+        :return: Index of the word
+        """
+
+        if self.section.weights is None:
+
+            return int(random() * self._size)
+
+        return self.alias().draw()
+
+    def draw_many(self, count):
+
+        """
+        Draws many indexes at random, in proportion to the weights.
+        :param count: Number of indexes to draw
+        :return: List of indexes
+        """
+
+        return self.alias().draw_many(count)
+
+    def copy(self):
+
+        """
+        Creates a copy of this store in memory.
+        :return: New WordStore with the same words, in the same order
+        """
+
+        new = WordStore()
+
+        new.extend_weighted((word, self.weight(num)) for num, word in enumerate(self))
+
+        return new
+
+    def __contains__(self, word):
+
+        position = self._find(word)
+
+        return position != -1 and not (self.safe and self._vulgar(position))
+
+    def __len__(self):
+
+        return self._size
+
+    def __getitem__(self, index):
+
+        return self._text(self._position(index))
+
+    def __iter__(self):
+
+        for num in range(self._size):
+
+            yield self[num]
+
+    def __repr__(self):
+
+        return 'MappedStore({} words, safe={})'.format(self._size, self.safe)
+
+
+class TrieBlocks:
+
+    """
+    The words of a TrieStore, kept sorted and front coded in blocks.
+
+    Each block holds a few dozen neighbouring words in a single string.
+    Every word only keeps the part that differs from the word before it, along with the length they share,
+    so shared prefixes are only kept once(the same saving a trie gives, without an object for every node).
+    The number of words in each block are the subtree counts, which let us find a word by its index.
+
+    One set of blocks holds both the full and safe wordlists, each block has a bitmask of the words each one leaves out:
+    the vulgar words are left out of the safe wordlist,
+    and words removed from the full wordlist(but still in the safe wordlist) are left out of the full wordlist.
+    Words left out of both are dropped.
+    """
+
+    def __init__(self):
+
+        self.heads = []  # First word of each block, used to find the block a word belongs in
+        self.blocks = []  # Words of each block, front coded into a single string
+        self.counts = array('L')  # Number of words in each block
+        self.vulgar = []  # Bitmask of the words in each block left out of the safe wordlist
+        self.hidden = []  # Bitmask of the words in each block left out of the full wordlist
+        self.weights = None  # Weights of the words in each block, None if every word has a weight of 1
+        self.version = 0  # Incremented every time the words change
+        self._starts = None  # Version, and the index of the first word and first non-vulgar word of each block
+        self._cache = None  # Version, number and words of the last block we decoded
+
+    def _encode(self, words):
+
+        """
+        Front codes a block of words.
+        Each word is stored as the length it shares with the word before it,
+        the length of the rest of the word, and the rest of the word.
+        :param words: Sorted list of words
+        :return: Front coded block
+        """
+
+        final = []
+        prev = ''
+
+        for word in words:
+
+            # Neighbouring words tend to share a short prefix, so checking it a character at a time is quickest:
+
+            shared = 0
+            limit = min(len(prev), len(word))
+
+            while shared < limit and prev[shared] == word[shared]:
+
+                shared = shared + 1
+
+            final.append(chr(shared) + chr(len(word) - shared) + word[shared:])
+
+            prev = word
+
+        return ''.join(final)
+
+    def decode(self, num):
+
+        """
+        Decodes the words of a block.
+        The last block decoded is kept, as lookups tend to hit the same block over and over.
+        :param num: Number of the block
+        :return: List of words in the block, must not be changed
+        """
+
+        cache = self._cache
+
+        if cache is not None and cache[0] == self.version and cache[1] == num:
+
+            return cache[2]
+
+        text = self.blocks[num]
+        words = []
+        prev = ''
+        pos = 0
+
+        while pos < len(text):
+
+            shared = ord(text[pos])
+            size = ord(text[pos+1])
+
+            prev = prev[:shared] + text[pos+2:pos+2+size]
+            pos = pos + 2 + size
+
+            words.append(prev)
+
+        self._cache = (self.version, num, words)
+
+        return words
+
+    def word(self, num, pos):
+
+        """
+        Decodes a single word of a block, only decoding the words before it.
+        :param num: Number of the block
+        :param pos: Position of the word in the block
+        :return: Word in string format
+        """
+
+        cache = self._cache
+
+        if cache is not None and cache[0] == self.version and cache[1] == num:
+
+            return cache[2][pos]
+
+        text = self.blocks[num]
+        prev = ''
+        at = 0
+
+        for _ in range(pos + 1):
+
+            shared = ord(text[at])
+            size = ord(text[at+1])
+
+            prev = prev[:shared] + text[at+2:at+2+size]
+            at = at + 2 + size
+
+        return prev
+
+    def starts(self):
+
+        """
+        Gets the index of the first word of each block, worked out again once the words change.
+        :return: Arrays of the index of the first word and the first non-vulgar word of each block,
+        with the total number of words at the end
+        """
+
+        starts = self._starts
+
+        if starts is None or starts[0] != self.version:
+
+            full = array('L', [0])
+            safe = array('L', [0])
+            total = 0
+            total_safe = 0
+
+            for count, mask, hidden in zip(self.counts, self.vulgar, self.hidden):
+
+                total = total + count - _popcount(hidden)
+                total_safe = total_safe + count - _popcount(mask)
+
+                full.append(total)
+                safe.append(total_safe)
+
+            starts = (self.version, full, safe)
+
+            self._starts = starts
+
+        return starts[1], starts[2]
+
+    def find(self, word):
+
+        """
+        Finds where a word is, or where it would go.
+        :param word: Word to find
+        :return: Number of the block, position in the block, and True if the word is there
+        """
+
+        num = bisect_right(self.heads, word) - 1
+
+        if num < 0:
+
+            # Before the first word, or we have no words:
+
+            return 0, 0, False
+
+        cache = self._cache
+
+        if cache is not None and cache[0] == self.version and cache[1] == num:
+
+            words = cache[2]
+            pos = bisect_left(words, word)
+
+            return num, pos, pos < len(words) and words[pos] == word
+
+        # Decoding the block until we reach the word, or a word after it:
+
+        text = self.blocks[num]
+        prev = ''
+        at = 0
+        pos = 0
+
+        while at < len(text):
+
+            shared = ord(text[at])
+            size = ord(text[at+1])
+
+            prev = prev[:shared] + text[at+2:at+2+size]
+            at = at + 2 + size
+
+            if prev >= word:
+
+                return num, pos, prev == word
+
+            pos = pos + 1
+
+        return num, pos, False
+
+    def missing(self, safe):
+
+        """
+        Gets the bitmasks of the words left out of a wordlist.
+        :param safe: Value determining if we want the safe wordlist, or the full wordlist
+        :return: List of bitmasks, one for each block
+        """
+
+        return (self.vulgar if safe else self.hidden)
+
+    def insert(self, word, weight=1, safe=False):
+
+        """
+        Adds a word to the full or safe wordlist.
+        New words are left out of the other wordlist.
+        :param word: Word to add
+        :param weight: Weight of the word, words we already have keep their weight
+        :param safe: Value determining if the word is added to the safe wordlist, or the full wordlist
+        :return: True if the word was added, False if the wordlist already has it
+        """
+
+        num, pos, found = self.find(word)
+
+        if found:
+
+            # Already have the word, it is only added if the wordlist left it out:
+
+            masks = self.missing(safe)
+
+            if not masks[num] >> pos & 1:
+
+                return False
+
+            masks[num] = masks[num] ^ (1 << pos)
+            self.version = self.version + 1
+
+            return True
+
+        if weight != 1 and self.weights is None:
+
+            # First weighted word, start keeping weights:
+
+            self.weights = [array('L', [1]) * count for count in self.counts]
+
+        if self.blocks:
+
+            words = list(self.decode(num))
+            mask = self.vulgar[num]
+            hidden = self.hidden[num]
+            weights = (array('L', self.weights[num]) if self.weights is not None else None)
+
+        else:
+
+            words = []
+            mask = 0
+            hidden = 0
+            weights = (array('L') if self.weights is not None else None)
+
+        words.insert(pos, word)
+
+        if weights is not None:
+
+            weights.insert(pos, weight)
+
+        self._write(num, words, _insert_bit(mask, pos, not safe), _insert_bit(hidden, pos, safe), weights)
+
+        return True
+
+    def delete(self, word, safe=False):
+
+        """
+        Removes a word from the full or safe wordlist.
+        The word is only dropped once both wordlists leave it out.
+        :param word: Word to remove
+        :param safe: Value determining if the word is removed from the safe wordlist, or the full wordlist
+        :return: True if the word was removed, False if the wordlist doesn't have it
+        """
+
+        num, pos, found = self.find(word)
+        masks = self.missing(safe)
+
+        if not found or masks[num] >> pos & 1:
+
+            return False
+
+        if not self.missing(not safe)[num] >> pos & 1:
+
+            # Still in the other wordlist, only leave it out of this one:
+
+            masks[num] = masks[num] | (1 << pos)
+            self.version = self.version + 1
+
+            return True
+
+        words = list(self.decode(num))
+        weights = (array('L', self.weights[num]) if self.weights is not None else None)
+
+        del words[pos]
+
+        if weights is not None:
+
+            del weights[pos]
+
+        self._write(num, words, _delete_bit(self.vulgar[num], pos), _delete_bit(self.hidden[num], pos), weights)
+
+        return True
+
+    def merge(self, words, safe=False):
+
+        """
+        Adds many words to the full or safe wordlist at once.
+        A few words are added one at a time, many words are merged in and the blocks are built again.
+        :param words: Iterable of (word, weight) pairs to add
+        :param safe: Value determining if the words are added to the safe wordlist, or the full wordlist
+        """
+
+        new = {}
+
+        for word, weight in words:
+
+            new.setdefault(word, weight)
+
+        if len(new) < len(self.blocks) * 4:
+
+            # Only a few words, add them where they go:
+
+            for word, weight in new.items():
+
+                self.insert(word, weight, safe)
+
+            self.version = self.version + 1
+
+            return
+
+        # Many words, check which ones we already have a block at a time, and stop leaving them out:
+
+        masks = self.missing(safe)
+
+        for num in range(len(self.blocks)):
+
+            mask = masks[num]
+
+            for pos, word in enumerate(self.decode(num)):
+
+                if new.pop(word, None) is not None:
+
+                    mask = mask & ~(1 << pos)
+
+            masks[num] = mask
+
+        self.version = self.version + 1
+
+        if new:
+
+            # Merging in the new words, and building the blocks again:
+
+            final = list(self.records())
+
+            final.extend((word, not safe, safe, weight) for word, weight in new.items())
+            final.sort()
+
+            self.build(final)
+
+    def build(self, records):
+
+        """
+        Replaces every word, building the blocks from scratch.
+        :param records: Sorted list of (word, vulgar, hidden, weight) records, without repeats
+        """
+
+        heads = []
+        blocks = []
+        counts = array('L')
+        vulgar = []
+        hidden = []
+        weights = ([] if any(record[3] != 1 for record in records) else None)
+
+        for start in range(0, len(records), BLOCK):
+
+            chunk = records[start:start + BLOCK]
+            mask = 0
+            hide = 0
+
+            for pos, record in enumerate(chunk):
+
+                if record[1]:
+
+                    mask = mask | (1 << pos)
+
+                if record[2]:
+
+                    hide = hide | (1 << pos)
+
+            heads.append(chunk[0][0])
+            blocks.append(self._encode([record[0] for record in chunk]))
+            counts.append(len(chunk))
+            vulgar.append(mask)
+            hidden.append(hide)
+
+            if weights is not None:
+
+                weights.append(array('L', [record[3] for record in chunk]))
+
+        self.heads, self.blocks, self.counts, self.weights = heads, blocks, counts, weights
+        self.vulgar, self.hidden = vulgar, hidden
+        self.version = self.version + 1
+
+    def _write(self, num, words, mask, hidden, weights):
+
+        """
+        Replaces the words of a block.
+        Blocks that get too big are split in half, and blocks that become empty are dropped.
+        :param num: Number of the block, may be the number after the last block if we have none
+        :param words: Sorted list of words in the block
+        :param mask: Bitmask of the words left out of the safe wordlist
+        :param hidden: Bitmask of the words left out of the full wordlist
+        :param weights: Weights of the words, None if we don't keep weights
+        """
+
+        pieces = ([(words, mask, hidden, weights)] if words else [])
+
+        if len(words) > 2 * BLOCK:
+
+            half = len(words) // 2
+            low = (1 << half) - 1
+
+            pieces = [(words[:half], mask & low, hidden & low, (weights[:half] if weights is not None else None)),
+                      (words[half:], mask >> half, hidden >> half, (weights[half:] if weights is not None else None))]
+
+        self.heads[num:num+1] = [piece[0][0] for piece in pieces]
+        self.blocks[num:num+1] = [self._encode(piece[0]) for piece in pieces]
+        self.counts[num:num+1] = array('L', [len(piece[0]) for piece in pieces])
+        self.vulgar[num:num+1] = [piece[1] for piece in pieces]
+        self.hidden[num:num+1] = [piece[2] for piece in pieces]
+
+        if self.weights is not None:
+
+            self.weights[num:num+1] = [piece[3] for piece in pieces]
+
+        self.version = self.version + 1
+
+    def records(self):
+
+        """
+        Generates every word, along with the wordlists that leave it out, and its weight.
+        :return: Generator yielding (word, vulgar, hidden, weight) records, in sorted order
+        """
+
+        for num in range(len(self.blocks)):
+
+            mask = self.vulgar[num]
+            hidden = self.hidden[num]
+            weights = (self.weights[num] if self.weights is not None else None)
+
+            for pos, word in enumerate(self.decode(num)):
+
+                yield word, bool(mask >> pos & 1), bool(hidden >> pos & 1), (weights[pos] if weights is not None else 1)
+
+    def __len__(self):
+
+        return self.starts()[0][-1]
+
+
+class TrieStore:
+
+    """
+    A sorted collection of unique words, front coded in blocks(see TrieBlocks).
+    Uses much less memory than a WordStore when words share prefixes, at the cost of slower lookups,
+    as a block has to be decoded to get at a word.
+
+    Words are looked up with a binary search over the first word of each block, and then over the block.
+    Indexes are found from the number of words in each block, so drawing a word uniformly only needs its index.
+    Words starting with some text are a run of indexes, found in two lookups(see prefix()).
+
+    The full and safe wordlists share the same blocks, each store skipping the words it leaves out.
+    Adding a word we don't have to one store leaves it out of the other, so words added to the full store are vulgar.
+    Removing a word from one store doesn't change the other, in the same way as two WordStores.
+    Indexes change as words are added and removed, as the words are kept sorted.
+    """
+
+    def __init__(self, blocks=None, safe=False):
+
+        self.blocks = (blocks if blocks is not None else TrieBlocks())  # Blocks holding the words
+        self.safe = safe  # Value determining if we only hold non-vulgar words
+        self._alias = None  # Version and AliasTable of the weights, rebuilt on the next draw once the words change
+
+    @property
+    def version(self):
+
+        # Shared with the other store using the blocks, so either store changing is seen by both:
+
+        return self.blocks.version
+
+    def _position(self, index):
+
+        """
+        Finds the block and position of a word.
+        :param index: Index of the word, negative values count from the end
+        :return: Number of the block, and the position in the block
+        """
+
+        full, safe = self.blocks.starts()
+        starts = (safe if self.safe else full)
+        size = starts[-1]
+
+        if index < 0:
+
+            index = index + size
+
+        if not 0 <= index < size:
+
+            raise IndexError("Store only has {} words!".format(size))
+
+        num = bisect_right(starts, index) - 1
+        pos = index - starts[num]
+        mask = self.blocks.missing(self.safe)[num]
+
+        if not mask:
+
+            return num, pos
+
+        # Skipping over the words we leave out in the block:
+
+        for place in range(self.blocks.counts[num]):
+
+            if not mask >> place & 1:
+
+                if pos == 0:
+
+                    return num, place
+
+                pos = pos - 1
+
+    def _rank(self, word):
+
+        """
+        Gets the number of words that sort before some text.
+        :param word: Text to check
+        :return: Number of words before the text
+        """
+
+        if not self.blocks.blocks:
+
+            return 0
+
+        num, pos, found = self.blocks.find(word)
+        full, safe = self.blocks.starts()
+        starts = (safe if self.safe else full)
+
+        return starts[num] + pos - _popcount(self.blocks.missing(self.safe)[num] & ((1 << pos) - 1))
+
+    def add(self, word, weight=1):
+
+        """
+        Adds a word to the store.
+        :param word: Word to add
+        :param weight: Weight of the word, how likely it is to be drawn
+        :return: True if the word was added, False if it was already present
+        """
+
+        return self.blocks.insert(word, weight, self.safe)
+
+    def extend(self, words):
+
+        """
+        Adds multiple words to the store.
+        :param words: Iterable of words to add
+        """
+
+        self.blocks.merge(((word, 1) for word in words), self.safe)
+
+    def extend_weighted(self, words):
+
+        """
+        Adds multiple words to the store, along with their weights.
+        :param words: Iterable of (word, weight) pairs to add
+        """
+
+        self.blocks.merge(words, self.safe)
+
+    def remove(self, word):
+
+        """
+        Removes a word from the store.
+        :param word: Word to remove
+        :raises ValueError: If the word is not in the store
+        """
+
+        if not self.blocks.delete(word, self.safe):
+
+            raise ValueError("Word [{}] is not in the store!".format(word))
+
+    def discard(self, word):
+
+        """
+        Removes a word from the store, if it is present.
+        :param word: Word to remove
+        :return: True if the word was removed, False if it was not present
+        """
+
+        if word not in self:
+
+            return False
+
+        self.remove(word)
+
+        return True
+
+    def index(self, word):
+
+        """
+        Gets the current index of a word.
+        :param word: Word to find
+        :return: Index of the word
+        :raises ValueError: If the word is not in the store
+        """
+
+        num, pos, found = self.blocks.find(word)
+
+        if not found or self.blocks.missing(self.safe)[num] >> pos & 1:
+
+            raise ValueError("Word [{}] is not in the store!".format(word))
+
+        return self._rank(word)
+
+    def prefix(self, text):
+
+        """
+        Finds the words starting with some text.
+        Words are sorted, so they are the words from the text up to the next text that doesn't start with it.
+        :param text: Prefix to search for
+        :return: Range of indexes of the words
+        """
+
+        if not text:
+
+            return range(len(self))
+
+        if ord(text[-1]) == 0x10FFFF:
+
+            # No text sorts after this one, check the words instead:
+
+            return [num for num, word in enumerate(self) if word.startswith(text)]
+
+        return range(self._rank(text), self._rank(text[:-1] + chr(ord(text[-1]) + 1)))
+
+    def clear(self):
+
+        """
+        Removes all words from the store.
+        Every word is left out of this store, and dropped if the other store leaves it out as well.
+        """
+
+        if self.safe:
+
+            self.blocks.build([(word, True, hidden, weight) for word, vulg, hidden, weight in self.blocks.records()
+                               if not hidden])
+
+            return
+
+        self.blocks.build([(word, vulg, True, weight) for word, vulg, hidden, weight in self.blocks.records()
+                           if not vulg])
+
+    def length(self, index):
+
+        """
+        Gets the length of the word at an index.
+        :param index: Index of the word
+        :return: Length of the word
+        """
+
+        return len(self[index])
+
+    def weight(self, index):
+
+        """
+        Gets the weight of the word at an index.
+        :param index: Index of the word
+        :return: Weight of the word
+        """
+
+        if self.blocks.weights is None:
+
+            return 1
+
+        num, pos = self._position(index)
+
+        return self.blocks.weights[num][pos]
+
+    def weighted(self):
+
+        """
+        Checks if any word has been given a weight.
+        :return: True if words must be drawn with draw() to respect their weights
+        """
+
+        return self.blocks.weights is not None
+
+    def alias(self):
+
+        """
+        Gets the alias table of the weights, building it again if the words have changed.
+        :return: AliasTable of the weights
+        """
+
+        if self._alias is None or self._alias[0] != self.version:
+
+            self._alias = (self.version, AliasTable(weight for word, vulg, hidden, weight in self.blocks.records()
+                                                    if not (vulg if self.safe else hidden)))
+
+        return self._alias[1]
+
+    def draw(self):
+
+        """
+        Draws the index of a word at random, in proportion to the weights.
+        :return: Index of the word
+        """
+
+        if self.blocks.weights is None:
+
+            return int(random() * len(self))
+
+        return self.alias().draw()
+
+    def draw_many(self, count):
+
+        """
+        Draws many indexes at random, in proportion to the weights.
+        :param count: Number of indexes to draw
+        :return: List of indexes
+        """
+
+        return self.alias().draw_many(count)
+
+    def copy(self):
+
+        """
+        Creates a copy of this store, with blocks of its own.
+        :return: New TrieStore with the same words
+        """
+
+        new = TrieStore(safe=self.safe)
+
+        new.blocks.build(list(self.blocks.records()))
+
+        return new
+
+    def __contains__(self, word):
+
+        num, pos, found = self.blocks.find(word)
+
+        return found and not self.blocks.missing(self.safe)[num] >> pos & 1
+
+    def __len__(self):
+
+        full, safe = self.blocks.starts()
+
+        return (safe if self.safe else full)[-1]
+
+    def __getitem__(self, index):
+
+        num, pos = self._position(index)
+
+        return self.blocks.word(num, pos)
+
+    def __iter__(self):
+
+        for word, vulg, hidden, weight in self.blocks.records():
+
+            if not (vulg if self.safe else hidden):
+
+                yield word
+
+    def __eq__(self, other):
+
+        return list(self) == list(other)
+
+    def __repr__(self):
+
+        return 'TrieStore({} words, safe={})'.format(len(self), self.safe)
+
+
+class TemplateStore:
+
+    """
+    A collection of words kept as unexpanded DIS notation.
+    Each line of notation is stored once, along with the number of values it expands to.
+    Values are only generated when they are accessed, so memory grows with the number of lines,
+    not the number of values.
+
+    Indexing works over all the values of all the lines, so random.choice() picks uniformly across every value.
+    Unlike WordStore, values generated by more than one line are not merged.
+    """
+
+    def __init__(self, parser, safe=False):
+
+        self.parser = parser  # Parser used to compile the notation
+        self.safe = safe  # Value determining if we only hold non-vulgar values
+        self._templates = []  # List of [line, compiled notation, count, safe indexes]
+        self._offsets = []  # Index of the first value of each line
+        self._total = 0  # Total number of values
+        self._weighted = 0  # Number of lines with a weight other than 1
+        self._alias = None  # Version and AliasTable of the lines, for drawing weighted values
+        self.version = 0  # Incremented every time the lines change
+        self.added = None  # Lines added since we were copied from a base, None if we don't keep track
+        self.removed = None  # Lines removed since we were copied from a base, None if we don't keep track
+
+    def add(self, line, compiled=None):
+
+        """
+        Adds a line of notation to the store.
+        If we only hold non-vulgar values, every value of the line is checked once,
+        and the indexes of the non-vulgar values are only kept if the line has a mix of both.
+        :param line: Line of DIS notation
+        :param compiled: CompiledNotation of the line, if it has already been compiled
+        :return: True if the line was added, False if it had no values for this store
+        """
+
+        if compiled is None:
+
+            compiled = self.parser.compile(line)
+
+        if self.added is not None:
+
+            # Keeping track of the change, so it can be moved on top of a new base:
+
+            self.added.append(line)
+
+        count = compiled.count()
+        indexes = None
+
+        if self.safe:
+
+            # Find the non-vulgar values:
+
+            indexes = array('L', (num for num, val in enumerate(compiled) if not val[1]))
+
+            if len(indexes) == count:
+
+                # Every value is safe, no need to keep the indexes:
+
+                indexes = None
+
+            count = count if indexes is None else len(indexes)
+
+        if count == 0:
+
+            # No values to add, do nothing
+
+            return False
+
+        self._templates.append([line.lower(), compiled, count, indexes])
+        self._offsets.append(self._total)
+        self._total = self._total + count
+        self._weighted = self._weighted + (compiled.weight != 1)
+        self.version = self.version + 1
+
+        return True
+
+    def remove(self, line):
+
+        """
+        Removes all copies of a line of notation from the store.
+        :param line: Line of DIS notation, as it was added
+        :raises ValueError: If the line is not in the store
+        """
+
+        line = line.lower()
+        templates = [temp for temp in self._templates if temp[0] != line]
+
+        if len(templates) == len(self._templates):
+
+            raise ValueError("Line [{}] is not in the store!".format(line))
+
+        if self.added is not None:
+
+            # Every copy is removed, including any we added:
+
+            self.added = [temp for temp in self.added if temp.lower() != line]
+            self.removed.add(line)
+
+        # Rebuilding the offsets:
+
+        self._templates = []
+        self._offsets = []
+        self._total = 0
+        self._weighted = 0
+        self.version = self.version + 1
+
+        for temp in templates:
+
+            self._templates.append(temp)
+            self._offsets.append(self._total)
+            self._total = self._total + temp[2]
+            self._weighted = self._weighted + (temp[1].weight != 1)
+
+    def discard(self, line):
+
+        """
+        Removes all copies of a line of notation from the store, if it is present.
+        :param line: Line of DIS notation
+        :return: True if the line was removed, False if it was not present
+        """
+
+        try:
+
+            self.remove(line)
+
+        except ValueError:
+
+            return False
+
+        return True
+
+    def clear(self):
+
+        """
+        Removes all lines from the store.
+        We no longer keep track of changes, as none of the base is used.
+        """
+
+        self._templates = []
+        self._offsets = []
+        self._total = 0
+        self._weighted = 0
+        self._alias = None
+        self.added = None
+        self.removed = None
+        self.version = self.version + 1
+
+    def length(self, index):
+
+        """
+        Gets the length of the value at an index.
+        The value has to be decoded to find this.
+        :param index: Index of the value
+        :return: Length of the value
+        """
+
+        return len(self[index])
+
+    def weight(self, index):
+
+        """
+        Gets the weight of the value at an index, which is the weight of its line.
+        :param index: Index of the value
+        :return: Weight of the value
+        """
+
+        return self._templates[bisect_right(self._offsets, index) - 1][1].weight
+
+    def weighted(self):
+
+        """
+        Checks if any line has been given a weight.
+        :return: True if values must be drawn with draw() to respect their weights
+        """
+
+        return self._weighted > 0
+
+    def draw(self):
+
+        """
+        Draws the index of a value at random, in proportion to the weights.
+        A line is picked in proportion to its number of values times its weight,
+        then a value is picked from the line uniformly.
+        :return: Index of the value
+        """
+
+        if self._alias is None or self._alias[0] != self.version:
+
+            self._alias = (self.version, AliasTable(temp[2] * temp[1].weight for temp in self._templates))
+
+        num = self._alias[1].draw()
+
+        return self._offsets[num] + int(random() * self._templates[num][2])
+
+    def draw_many(self, count):
+
+        """
+        Draws many indexes at random, in proportion to the weights.
+        :param count: Number of indexes to draw
+        :return: List of indexes
+        """
+
+        return [self.draw() for _ in range(count)]
+
+    def copy(self, track=False):
+
+        """
+        Creates a copy of this store.
+        The compiled notation is shared, as it is never changed.
+        :param track: Value determining if the copy keeps track of the lines added to and removed from it,
+        so the changes can be moved on top of a new base
+        :return: New TemplateStore with the same lines, in the same order
+        """
+
+        new = TemplateStore(self.parser, safe=self.safe)
+
+        new._templates = [list(temp) for temp in self._templates]
+        new._offsets = list(self._offsets)
+        new._total = self._total
+        new._weighted = self._weighted
+
+        if track:
+
+            new.added = []
+            new.removed = set()
+
+        return new
+
+    def lines(self):
+
+        """
+        Gets the lines of notation in the store.
+        :return: List of lines
+        """
+
+        return [temp[0] for temp in self._templates]
+
+    def flagged(self):
+
+        """
+        Generates every value in the store, along with its vulgarity.
+        :return: Generator yielding (text, vulgar) pairs
+        """
+
+        for temp in self._templates:
+
+            for text, vulg in temp[1]:
+
+                if self.safe and vulg:
+
+                    continue
+
+                yield text, vulg
+
+    def __contains__(self, word):
+
+        # We have to generate the values to check, this is slow!
+
+        return any(text == word for text in self)
+
+    def __len__(self):
+
+        return self._total
+
+    def __getitem__(self, index):
+
+        if index < 0:
+
+            index = index + self._total
+
+        if not 0 <= index < self._total:
+
+            raise IndexError("Store only has {} values!".format(self._total))
+
+        # Find the line the index falls under, and decode the value:
+
+        num = bisect_right(self._offsets, index) - 1
+        line, compiled, count, indexes = self._templates[num]
+        index = index - self._offsets[num]
+
+        return compiled.nth(index if indexes is None else indexes[index])[0]
+
+    def __iter__(self):
+
+        for text, vulg in self.flagged():
+
+            yield text
+
+    def __repr__(self):
+
+        return 'TemplateStore({!r})'.format(self.lines())
+
+
+class WordIndex:
+
+    """
+    A search index over a WordStore, for finding words by a literal prefix or substring without scanning every word.
+
+    Prefixes are found with a binary search over the sorted words,
+    and substrings by intersecting the words containing each trigram(3 character slice) of the substring.
+    The index is a snapshot, and must be rebuilt once the store changes.
+    """
+
+    def __init__(self, store):
+
+        self.store = store  # Store we are indexing
+        self.version = store.version  # Version of the store when we were built
+        self.sorted = sorted(store)  # Words in sorted order
+        self.grams = {}  # Dictionary mapping trigrams to the set of words containing them
+
+        for word in store:
+
+            for num in range(len(word) - 2):
+
+                self.grams.setdefault(word[num:num+3], set()).add(word)
+
+    def valid(self, store):
+
+        """
+        Checks if this index is still valid for a store.
+        :param store: Store to check
+        :return: True if the index is up to date
+        """
+
+        return self.store is store and self.version == store.version
+
+    def prefix(self, text):
+
+        """
+        Finds the words starting with some text.
+        :param text: Prefix to search for
+        :return: List of words, in store order
+        """
+
+        start = bisect_left(self.sorted, text)
+        final = []
+
+        for word in islice(self.sorted, start, None):
+
+            if not word.startswith(text):
+
+                break
+
+            final.append(word)
+
+        return sorted(final, key=self.store.index)
+
+    def substring(self, text):
+
+        """
+        Finds the words containing some text.
+        Text shorter than a trigram can't use the index, and is found by scanning.
+        :param text: Substring to search for
+        :return: List of words, in store order
+        """
+
+        if len(text) < 3:
+
+            return [word for word in self.store if text in word]
+
+        # Getting the words for each trigram, smallest first:
+
+        sets = []
+
+        for num in range(len(text) - 2):
+
+            gram = self.grams.get(text[num:num+3])
+
+            if gram is None:
+
+                # Trigram is in no words, so nothing matches:
+
+                return []
+
+            sets.append(gram)
+
+        sets.sort(key=len)
+
+        # Words containing every trigram might still not contain the text, so check them:
+
+        final = [word for word in sets[0].intersection(*sets[1:]) if text in word]
+
+        return sorted(final, key=self.store.index)
+
+
+def _popcount(mask):
+
+    """
+    Counts the bits set in a bitmask.
+    :param mask: Bitmask to count
+    :return: Number of bits set
+    """
+
+    return bin(mask).count('1')
+
+
+def _insert_bit(mask, pos, bit):
+
+    """
+    Inserts a bit into a bitmask, moving the bits above it up.
+    :param mask: Bitmask to insert into
+    :param pos: Position of the new bit
+    :param bit: Value of the new bit
+    :return: New bitmask
+    """
+
+    return (mask & ((1 << pos) - 1)) | ((mask >> pos) << (pos + 1)) | (int(bit) << pos)
+
+
+def _delete_bit(mask, pos):
+
+    """
+    Deletes a bit from a bitmask, moving the bits above it down.
+    :param mask: Bitmask to delete from
+    :param pos: Position of the bit
+    :return: New bitmask
+    """
+
+    return (mask & ((1 << pos) - 1)) | ((mask >> (pos + 1)) << pos)